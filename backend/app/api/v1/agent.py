@@ -3,9 +3,9 @@
 """
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
-from app.services.agent_service import get_agent
+from app.services.agent_service import get_agent_session, get_session_pool
 from app.core.tool_monitor import get_monitor
 
 router = APIRouter()
@@ -14,6 +14,7 @@ router = APIRouter()
 class AgentChatRequest(BaseModel):
     """Agent对话请求"""
     message: str
+    session_id: Optional[str] = None  # 会话ID，不提供时创建新会话（在响应中返回）
 
 
 class AgentChatResponse(BaseModel):
@@ -21,6 +22,9 @@ class AgentChatResponse(BaseModel):
     reply: str
     tool_calls: List[Dict[str, Any]]
     intermediate_steps: List[Any]
+    session_id: str
+    tool_usage: Dict[str, Any] = {}  # 本次运行的工具调用统计（预算、实际执行、重复调用、超预算拒绝）
+    token_usage: Dict[str, Any] = {}  # 本次运行的token用量（LLM调用轮数、prompt/completion token数）
 
 
 @router.post("/chat", response_model=AgentChatResponse)
@@ -48,13 +52,16 @@ async def agent_chat(request: AgentChatRequest):
     4. 返回完整的行程建议
     """
     try:
-        agent = get_agent()
-        result = await agent.chat(request.message)
+        session = get_agent_session(request.session_id)
+        result = await session.chat(request.message)
         
         return AgentChatResponse(
             reply=result['reply'],
             tool_calls=result['tool_calls'],
-            intermediate_steps=result['intermediate_steps']
+            intermediate_steps=result['intermediate_steps'],
+            session_id=session.session_id,
+            tool_usage=result.get('tool_usage', {}),
+            token_usage=result.get('token_usage', {})
         )
         
     except Exception as e:
@@ -72,11 +79,12 @@ async def agent_chat_stream(request: AgentChatRequest):
     返回Server-Sent Events (SSE)流式响应
     
     事件类型：
-    - start: Agent开始思考
+    - start: Agent开始思考（session_id字段为会话ID，后续请求带上以继续该会话）
     - thinking: AI决策过程
     - tool_start: 开始调用工具
     - tool_end: 工具调用完成
     - llm_stream: AI回复的流式输出
+    - llm_stream_reset: 撤回已收到的llm_stream内容（那是工具调用前的说明，随后作为thinking重新发送）
     - done: 完成
     - error: 错误
     
@@ -94,8 +102,10 @@ async def agent_chat_stream(request: AgentChatRequest):
     
     async def event_generator():
         try:
-            agent = get_agent()
-            async for event in agent.chat_stream(request.message):
+            session = get_agent_session(request.session_id)
+            async for event in session.chat_stream(request.message):
+                if event['type'] == 'start':
+                    event['session_id'] = session.session_id
                 # 转换为SSE格式
                 yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
         except Exception as e:
@@ -112,14 +122,13 @@ async def agent_chat_stream(request: AgentChatRequest):
 
 
 @router.post("/reset")
-async def reset_agent():
+async def reset_agent(session_id: Optional[str] = None):
     """
-    重置Agent对话历史
+    重置Agent对话历史（指定session_id时只重置该会话）
     """
     try:
-        agent = get_agent()
-        agent.reset_history()
-        return {"message": "对话历史已重置"}
+        count = get_session_pool().reset(session_id)
+        return {"message": "对话历史已重置", "sessions": count}
         
     except Exception as e:
         raise HTTPException(
@@ -155,7 +164,8 @@ async def get_agent_stats():
                 "total_duration": f"{stats['total_duration']:.2f}秒"
             },
             "tool_ranking": ranking,
-            "tool_details": stats['tool_stats']
+            "tool_details": stats['tool_stats'],
+            "sessions": get_session_pool().get_stats()
         }
         
     except Exception as e:
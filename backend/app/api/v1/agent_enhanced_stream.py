@@ -8,9 +8,8 @@ from pydantic import BaseModel
 from typing import List
 from datetime import datetime, timedelta
 import json
-import asyncio
 
-from app.services.agent_service import get_agent
+from app.services.agent_service import get_agent_session
 from app.core.tool_monitor import get_monitor
 
 router = APIRouter()
@@ -24,6 +23,7 @@ class EnhancedStreamRequest(BaseModel):
     budget: float = 5000
     preferences: list = None
     departureDate: str = None  # 出发日期 YYYY-MM-DD
+    session_id: str = None  # 会话ID，不提供时创建新会话（在start事件中返回）
 
 
 @router.post("/enhanced-stream")
@@ -59,7 +59,7 @@ async def enhanced_agent_stream(request: EnhancedStreamRequest):
     async def event_generator():
         try:
             monitor = get_monitor()
-            agent = get_agent()
+            session = get_agent_session(request.session_id)
             
             # 格式化出发日期信息
             date_info = ""
@@ -113,21 +113,20 @@ async def enhanced_agent_stream(request: EnhancedStreamRequest):
 """
             
             # 发送开始信号
-            yield f"data: {json.dumps({'type': 'start', 'content': '🤖 AI Agent开始工作...'}, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'type': 'start', 'content': '🤖 AI Agent开始工作...', 'session_id': session.session_id}, ensure_ascii=False)}\n\n"
             yield f"data: {json.dumps({'type': 'thinking', 'content': 'AI正在分析您的需求，准备调用工具...'}, ensure_ascii=False)}\n\n"
             
             # Agent流式对话
             final_reply = ""
-            async for event in agent.chat_stream(enhanced_message):
+            async for event in session.chat_stream(enhanced_message):
                 # 转发所有事件
                 yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
                 
                 # 收集最终回复
                 if event['type'] == 'llm_stream':
                     final_reply += event['content']
-                
-                # 心跳包（每15秒）
-                await asyncio.sleep(0.01)
+                elif event['type'] == 'llm_stream_reset':
+                    final_reply = ""
             
             # 发送完成信号
             yield f"data: {json.dumps({'type': 'complete', 'content': '✅ 行程规划完成', 'reply': final_reply}, ensure_ascii=False)}\n\n"
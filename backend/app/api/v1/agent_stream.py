@@ -177,28 +177,27 @@ async def generate_stream_response(request: StreamChatRequest):
         if is_multi_destination:
             yield f"data: {json.dumps({'type': 'thinking', 'content': f'思考：多目的地旅行，按城市分组验证景点'}, ensure_ascii=False)}\n\n"
         
-        # 并发查询（每批5个，避免API限制）
-        batch_size = 5
+        # 全部并发查询，高德配额由共享客户端的限流器统一排队控制
         processed = 0
         valid_count = 0
         
-        for i in range(0, len(all_queries), batch_size):
-            batch = all_queries[i:i+batch_size]
-            
-            # 并发查询这一批
-            tasks = [
-                map_service.search_attractions(
-                    city=request.destination,
-                    keyword=attr.name,
-                    limit=3
-                )
-                for day, attr in batch
-            ]
-            
-            results_batch = await asyncio.gather(*tasks, return_exceptions=True)
-            
-            # 处理结果
-            for (day, attraction), results in zip(batch, results_batch):
+        tasks = [
+            asyncio.ensure_future(map_service.search_attractions(
+                city=request.destination,
+                keyword=attr.name,
+                limit=3
+            ))
+            for day, attr in all_queries
+        ]
+        
+        try:
+            # 按原顺序处理结果
+            for (day, attraction), task in zip(all_queries, tasks):
+                try:
+                    results = await task
+                except Exception as e:
+                    results = e
+                
                 processed += 1
                 
                 # 每5个发送一次进度
@@ -245,6 +244,11 @@ async def generate_stream_response(request: StreamChatRequest):
                         attraction.opentime = valid_poi.get('opentime', '')
                     if hasattr(attraction, 'business_area'):
                         attraction.business_area = valid_poi.get('business_area', '')
+        finally:
+            # 客户端断开时取消尚未完成的查询
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
         
         # 5. 验证结果并补全（快速输出）
         invalid_count = total_attractions - valid_count
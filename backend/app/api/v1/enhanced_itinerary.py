@@ -58,7 +58,7 @@ async def generate_complete_itinerary(request: GenerateRequest):
     流程：
     1. AI生成结构化行程框架
     2. 调用高德API获取景点详细坐标
-    3. TSP算法优化每天的景点顺序
+    3. VRP算法按地理位置和营业时间把景点分到各天，并给出每天的顺序和开始时间
     4. 计算实际路线和距离
     5. 返回可直接使用的完整行程
     
@@ -88,77 +88,96 @@ async def generate_complete_itinerary(request: GenerateRequest):
         
         # 步骤2：填充景点详细信息（坐标、地址等）
         print("步骤2: 获取景点详细信息...")
-        for day in itinerary.daily_schedule:
-            for attraction in day.attractions:
-                try:
-                    # 调用高德POI搜索获取景点详细信息
-                    results = await map_service.search_attractions(
-                        city=request.destination,
-                        keyword=attraction.name,
-                        limit=1
-                    )
-                    
-                    if results and len(results) > 0:
-                        poi = results[0]  # 取第一个结果
-                        # 更新景点信息（包含图片）
-                        attraction.address = poi.get('address', '')
-                        attraction.lng = poi.get('lng', 0)
-                        attraction.lat = poi.get('lat', 0)
-                        attraction.type = poi.get('type', '')
-                        attraction.rating = poi.get('rating', 0)
-                        attraction.tel = poi.get('tel', '')
-                        attraction.photos = poi.get('photos', [])
-                        attraction.thumbnail = poi.get('thumbnail', '')
-                        
-                        print(f"  ✓ {attraction.name}: {attraction.address} {'📷' if attraction.thumbnail else ''}")
-                    else:
-                        print(f"  ✗ {attraction.name}: 未找到详细信息")
-                        
-                except Exception as e:
-                    print(f"  ✗ {attraction.name}: 获取信息失败 - {e}")
-                    continue
+        all_attractions = [
+            attraction
+            for day in itinerary.daily_schedule
+            for attraction in day.attractions
+        ]
+        # 批量解析（优先读取本地POI库，其余并发调用高德POI搜索）
+        pois = await map_service.get_attractions_by_names(
+            request.destination,
+            [attraction.name for attraction in all_attractions]
+        )
+        
+        for attraction, poi in zip(all_attractions, pois):
+            if poi:
+                # 更新景点信息（包含图片）
+                attraction.address = poi.get('address', '')
+                attraction.lng = poi.get('lng', 0)
+                attraction.lat = poi.get('lat', 0)
+                attraction.type = poi.get('type', '')
+                attraction.rating = poi.get('rating', 0)
+                attraction.tel = poi.get('tel', '')
+                attraction.opentime = poi.get('opentime', '')
+                attraction.photos = poi.get('photos', [])
+                attraction.thumbnail = poi.get('thumbnail', '')
+                
+                print(f"  ✓ {attraction.name}: {attraction.address} {'📷' if attraction.thumbnail else ''}")
+            else:
+                print(f"  ✗ {attraction.name}: 未找到详细信息")
         
-        # 步骤3：优化每天的景点顺序（TSP）
-        print("步骤3: 优化每天景点顺序...")
-        for day in itinerary.daily_schedule:
-            if len(day.attractions) > 1:
-                # 转换为字典格式供TSP算法使用
-                attractions_data = [
-                    {
-                        'name': attr.name,
-                        'lng': getattr(attr, 'lng', 0),
-                        'lat': getattr(attr, 'lat', 0),
-                        'cost': attr.cost
-                    }
-                    for attr in day.attractions
-                    if hasattr(attr, 'lng') and hasattr(attr, 'lat')
-                ]
+        # 步骤3：按地理位置分天并优化每天的景点顺序（VRP，一次求解）
+        print("步骤3: 景点分天与顺序优化...")
+        schedule = itinerary.daily_schedule
+        located = [
+            (day_idx, attraction)
+            for day_idx, day in enumerate(schedule)
+            for attraction in day.attractions
+            if attraction.lng and attraction.lat
+        ]
+        
+        if len(located) > 1:
+            try:
+                # 酒店作为每天的起终点（取第一晚的酒店，解析失败时以景点中心为起终点）
+                hotel = None
+                first_hotel = next((day.hotel for day in schedule if day.hotel), None)
+                if first_hotel:
+                    geo = (await map_service.geocode([first_hotel.address or first_hotel.name], request.destination))[0]
+                    if geo:
+                        hotel = {'name': first_hotel.name, 'lng': geo['lng'], 'lat': geo['lat']}
+                
+                plan = await route_planner.plan_days(
+                    [
+                        {
+                            'index': i,
+                            'name': attr.name,
+                            'lng': attr.lng,
+                            'lat': attr.lat,
+                            'cost': attr.cost,
+                            'duration_hours': attr.duration_hours,
+                            'opentime': attr.opentime
+                        }
+                        for i, (_, attr) in enumerate(located)
+                    ],
+                    days=len(schedule),
+                    hotel=hotel,
+                    budget=request.budget,
+                    city=request.destination
+                )
+                
+                # 按求解结果重新分配每天的景点和开始时间（满足营业时间）；
+                # 没有坐标的景点留在原来那天，未能安排的放回原来那天末尾（由步骤4的本地检查报告冲突）
+                unlocated = [[attr for attr in day.attractions if not (attr.lng and attr.lat)] for day in schedule]
+                for day, day_plan in zip(schedule, plan['days']):
+                    day.attractions = [located[a['index']][1] for a in day_plan['attractions']]
+                    for attr, start_time in zip(day.attractions, day_plan['start_times']):
+                        attr.start_time = start_time
+                for a in plan['unassigned']:
+                    day_idx, attr = located[a['index']]
+                    schedule[day_idx].attractions.append(attr)
+                    print(f"  ✗ {attr.name}: 超出每日可用时长或营业时间冲突，保留在第{schedule[day_idx].day}天")
+                for day, extra in zip(schedule, unlocated):
+                    day.attractions.extend(extra)
                 
-                if len(attractions_data) > 1:
-                    try:
-                        # 使用TSP优化顺序（传入预算和城市用于智能选择交通方式）
-                        optimized = await route_planner.optimize_route(
-                            attractions_data,
-                            budget=request.budget,
-                            days=request.days,
-                            city=request.destination  # 传递城市参数
-                        )
-                        
-                        # 更新景点顺序
-                        optimized_names = [a['name'] for a in optimized['attractions']]
-                        day.attractions.sort(
-                            key=lambda x: optimized_names.index(x.name) 
-                            if x.name in optimized_names else 999
-                        )
-                        
-                        print(f"  ✓ 第{day.day}天: 优化完成，节省{optimized['summary'].get('optimization_rate', 0):.1f}%路程")
-                    except Exception as e:
-                        print(f"  ✗ 第{day.day}天: 优化失败 - {e}")
+                for day, day_plan in zip(schedule, plan['days']):
+                    print(f"  ✓ 第{day.day}天: {len(day_plan['attractions'])}个景点，约{day_plan['hours']}小时")
+            except Exception as e:
+                print(f"  ✗ 多天规划失败，保留原分配 - {e}")
         
         print("✅ 完整行程生成成功！")
         
-        # 步骤4：AI验证行程合理性
-        print("步骤4: AI验证行程合理性...")
+        # 步骤4：验证行程（先做本地时间可行性检查，不可行时不再调用AI）
+        print("步骤4: 验证行程合理性...")
         try:
             validator = get_validator()
             validation = await validator.validate_itinerary({
@@ -5,6 +5,9 @@ from fastapi import APIRouter
 from typing import Dict, Any
 
 from app.services.optimized_ai_base import get_monitor, get_cache
+from app.core.amap_client import get_amap_client
+from app.core.solver_pool import get_solver_pool
+from app.core.ttl_cache import get_cache_stats, clear_caches
 
 router = APIRouter()
 
@@ -68,3 +71,49 @@ async def get_cache_info():
         "ttl_seconds": 3600
     }
 
+
+
+@router.get("/amap")
+async def get_amap_stats():
+    """
+    获取高德API连接池统计
+    
+    Returns:
+        连接数、并发请求数、饱和度、DNS缓存及各端点调用统计
+    """
+    return get_amap_client().get_stats()
+
+
+@router.get("/solver")
+async def get_solver_stats():
+    """
+    获取TSP求解线程池统计
+    
+    Returns:
+        线程数、排队深度、运行中求解数、等待/求解耗时及取消次数
+    """
+    return get_solver_pool().get_stats()
+
+
+@router.get("/amap/cache")
+async def get_amap_cache_info():
+    """
+    获取高德API响应缓存统计
+    
+    Returns:
+        各缓存的条目数、命中/未命中/淘汰次数和命中率
+    """
+    return get_cache_stats()
+
+
+@router.post("/amap/cache/clear")
+async def clear_amap_cache():
+    """
+    清空高德API响应缓存
+    """
+    clear_caches()
+    
+    return {
+        "message": "高德缓存已清空",
+        "status": "success"
+    }
@@ -0,0 +1,405 @@
+"""
+高德API共享HTTP客户端
+进程内共享一个长连接池（支持HTTP/2），由FastAPI lifespan创建和关闭，
+MapService 与 RouteService 的所有高德请求都经由此客户端发出
+"""
+import asyncio
+import copy
+import socket
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import httpcore
+import httpx
+
+from app.core.circuit_breaker import CircuitBreaker, CircuitOpenError, LatencyTracker
+from app.core.config import settings
+from app.core.rate_governor import RateGovernor, match_endpoint
+from app.core.ttl_cache import make_cache_key
+
+# 高德配额超限的错误码（访问过于频繁 / 各类QPS超限）
+QUOTA_EXCEEDED_CODES = {'10004', '10014', '10019', '10020', '10021'}
+
+# HTTP/2 需要 h2 包（httpx[http2]），缺失时降级为 HTTP/1.1 长连接
+try:
+    import h2  # noqa: F401
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+
+class CachingDNSBackend(httpcore.AsyncNetworkBackend):
+    """带DNS缓存的网络后端：TTL内复用域名解析结果，新建连接时不再重复解析"""
+
+    def __init__(self, ttl: int = 300):
+        self._backend = httpcore.AnyIOBackend()
+        self._ttl = ttl
+        self._cache: Dict[Tuple[str, int], Tuple[float, List[str]]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def _resolve(self, host: str, port: int) -> List[str]:
+        """解析域名（优先使用缓存）"""
+        key = (host, port)
+        now = time.monotonic()
+        cached = self._cache.get(key)
+        if cached and cached[0] > now:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache[key] = (now + self._ttl, addresses)
+        return addresses
+
+    async def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: Optional[float] = None,
+        local_address: Optional[str] = None,
+        socket_options=None
+    ) -> httpcore.AsyncNetworkStream:
+        try:
+            addresses = await self._resolve(host, port)
+        except OSError:
+            # 解析失败交给底层后端处理，保持httpcore原有的异常类型
+            return await self._backend.connect_tcp(
+                host, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+            )
+
+        last_error = None
+        for address in addresses:
+            try:
+                # TLS的SNI使用请求中的原始域名，这里直接连IP不影响证书校验
+                return await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+
+        # 缓存的地址全部不可用，丢弃缓存以便下次重新解析
+        self._cache.pop((host, port), None)
+        raise last_error
+
+    async def connect_unix_socket(self, path: str, timeout: Optional[float] = None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+    def get_stats(self) -> Dict:
+        """DNS缓存统计"""
+        return {
+            'entries': len(self._cache),
+            'hits': self.hits,
+            'misses': self.misses,
+            'ttl_seconds': self._ttl
+        }
+
+
+class AmapTransport(httpx.AsyncHTTPTransport):
+    """使用带DNS缓存网络后端的连接池传输层"""
+
+    def __init__(self, limits: httpx.Limits, http2: bool, dns_backend: CachingDNSBackend):
+        super().__init__(limits=limits, http2=http2)
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(http2=http2),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            network_backend=dns_backend
+        )
+
+    @property
+    def pool(self) -> httpcore.AsyncConnectionPool:
+        return self._pool
+
+
+class AmapClient:
+    """高德API共享客户端：连接复用 + 分端点限流/熔断/自适应超时 + 相同请求合并 + 连接池监控"""
+
+    def __init__(self):
+        self.http2 = settings.AMAP_HTTP2 and HAS_HTTP2
+        if settings.AMAP_HTTP2 and not HAS_HTTP2:
+            print("[高德客户端] ⚠️ 未安装h2，降级为HTTP/1.1长连接")
+
+        self.limits = httpx.Limits(
+            max_connections=settings.AMAP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AMAP_MAX_KEEPALIVE,
+            keepalive_expiry=settings.AMAP_KEEPALIVE_EXPIRY
+        )
+        self.dns_backend = CachingDNSBackend(ttl=settings.AMAP_DNS_CACHE_TTL)
+        self.transport = AmapTransport(self.limits, self.http2, self.dns_backend)
+        self._client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(self.configured_timeout('default'), pool=settings.AMAP_POOL_TIMEOUT)
+        )
+        self.governor = RateGovernor(settings.AMAP_RATE_LIMITS, burst=settings.AMAP_RATE_BURST)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+
+        self._in_flight = 0
+        # 进行中的请求：请求键 -> 共享的上游任务
+        # 进行中的请求：参数键 -> [请求任务, 共享该结果的其他调用方数]
+        self._flights: Dict[str, List] = {}
+        self.stats = {
+            'total_requests': 0,
+            'failed_requests': 0,
+            'coalesced_requests': 0,
+            'quota_exceeded': 0,
+            'pool_timeouts': 0,
+            'peak_in_flight': 0,
+            'endpoints': {}  # 每个端点的统计
+        }
+
+    @staticmethod
+    def endpoint_of(url: str) -> str:
+        """
+        从URL提取端点名称（去掉版本号）
+
+        例如：https://restapi.amap.com/v5/place/text -> place/text
+        """
+        parts = urlparse(url).path.strip('/').split('/')
+        if parts and parts[0] in ('v3', 'v4', 'v5'):
+            parts = parts[1:]
+        return '/'.join(parts)
+
+    def configured_timeout(self, endpoint: str) -> float:
+        """获取端点配置的超时上限（秒）"""
+        timeouts = settings.AMAP_TIMEOUTS
+        key = match_endpoint(endpoint, timeouts)
+        return float(timeouts[key] if key else timeouts.get('default', 10.0))
+
+    def timeout_for(self, endpoint: str) -> float:
+        """
+        获取端点的超时时间（秒）
+
+        样本足够时按 p99延迟 × 系数 收紧，但不低于AMAP_TIMEOUT_MIN、不超过配置值
+        """
+        configured = self.configured_timeout(endpoint)
+        tracker = self._latencies.get(endpoint)
+        if not settings.AMAP_ADAPTIVE_TIMEOUT or tracker is None or len(tracker) < settings.AMAP_LATENCY_MIN_SAMPLES:
+            return configured
+
+        adaptive = tracker.percentile(99) * settings.AMAP_TIMEOUT_P99_FACTOR
+        return min(configured, max(settings.AMAP_TIMEOUT_MIN, adaptive))
+
+    def breaker_for(self, endpoint: str) -> CircuitBreaker:
+        """获取（必要时创建）端点的熔断器"""
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                endpoint,
+                failure_threshold=settings.AMAP_BREAKER_FAILURES,
+                open_seconds=settings.AMAP_BREAKER_OPEN_SECONDS,
+                half_open_probes=settings.AMAP_BREAKER_HALF_OPEN_PROBES
+            )
+            self._breakers[endpoint] = breaker
+        return breaker
+
+    def is_available(self, endpoint: str) -> bool:
+        """端点当前是否可用（未熔断），供调用方提前选择降级方案"""
+        breaker = self._breakers.get(endpoint)
+        return breaker is None or breaker.state != CircuitBreaker.OPEN or breaker.retry_after() <= 0
+
+    def _endpoint_stat(self, endpoint: str) -> Dict:
+        """获取（必要时创建）端点统计"""
+        return self.stats['endpoints'].setdefault(endpoint, {
+            'calls': 0,
+            'failed': 0,
+            'coalesced': 0,
+            'quota_exceeded': 0,
+            'rejected': 0,
+            'total_duration': 0.0
+        })
+
+    async def get_json(self, url: str, params: Dict[str, Any]) -> Dict:
+        """
+        发送GET请求并解析JSON
+
+        参数完全相同的并发请求只会向高德发出一次，其余调用方共享同一个结果；
+        端点熔断时立即抛出CircuitOpenError，调用方应走降级方案
+
+        Args:
+            url: 完整的高德API地址
+            params: 请求参数
+
+        Returns:
+            高德返回的JSON数据
+
+        Raises:
+            CircuitOpenError: 端点处于熔断状态
+        """
+        endpoint = self.endpoint_of(url)
+        if not settings.AMAP_SINGLE_FLIGHT:
+            return await self._request(url, params, endpoint)
+
+        flight_key = make_cache_key(url, params)
+        shared = self._flights.get(flight_key)
+        if shared is not None:
+            shared[1] += 1
+            self.stats['coalesced_requests'] += 1
+            self._endpoint_stat(endpoint)['coalesced'] += 1
+            # shield：某个调用方被取消时不影响其他共享者；结果深拷贝避免互相修改
+            return copy.deepcopy(await asyncio.shield(shared[0]))
+
+        flight = asyncio.ensure_future(self._request(url, params, endpoint))
+        shared = [flight, 0]
+        self._flights[flight_key] = shared
+        flight.add_done_callback(lambda _: self._flights.pop(flight_key, None))
+        data = await asyncio.shield(flight)
+        # 请求完成时已从_flights移除，共享者数不再变化：有共享者时发起方同样拿副本，任何调用方都不持有共享对象
+        return copy.deepcopy(data) if shared[1] else data
+
+    async def _request(self, url: str, params: Dict[str, Any], endpoint: str) -> Dict:
+        """向高德发出请求：熔断检查 -> 排队获取令牌 -> 发送，配额超限时后退并重新排队"""
+        for attempt in range(settings.AMAP_QUOTA_RETRIES + 1):
+            breaker = self.breaker_for(endpoint) if settings.AMAP_BREAKER_ENABLED else None
+            if breaker is not None and not breaker.allow():
+                self._endpoint_stat(endpoint)['rejected'] += 1
+                raise CircuitOpenError(endpoint, breaker.retry_after())
+
+            await self.governor.acquire(endpoint)
+            data = await self._send(url, params, endpoint, breaker)
+
+            if not isinstance(data, dict) or str(data.get('infocode', '')) not in QUOTA_EXCEEDED_CODES:
+                return data
+
+            self.stats['quota_exceeded'] += 1
+            self._endpoint_stat(endpoint)['quota_exceeded'] += 1
+            self.governor.penalize(endpoint, settings.AMAP_QUOTA_BACKOFF)
+            print(f"[高德客户端] ⚠️ {endpoint} 配额超限({data.get('info')})，"
+                  f"第{attempt + 1}次，后退{settings.AMAP_QUOTA_BACKOFF}秒后重新排队")
+
+        return data
+
+    async def _send(self, url: str, params: Dict[str, Any], endpoint: str, breaker: Optional[CircuitBreaker]) -> Dict:
+        """实际发出一次上游请求，并把结果计入熔断器和延迟统计"""
+        # 半开探测使用配置的完整超时，避免被收紧后的超时误判为仍然故障
+        if breaker is not None and breaker.probing:
+            timeout_seconds = self.configured_timeout(endpoint)
+        else:
+            timeout_seconds = self.timeout_for(endpoint)
+        timeout = httpx.Timeout(timeout_seconds, pool=settings.AMAP_POOL_TIMEOUT)
+        endpoint_stat = self._endpoint_stat(endpoint)
+        tracker = self._latencies.setdefault(endpoint, LatencyTracker(settings.AMAP_LATENCY_WINDOW))
+
+        self._in_flight += 1
+        self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self._in_flight)
+        start_time = time.monotonic()
+        outcome = None
+
+        try:
+            response = await self._client.get(url, params=params, timeout=timeout)
+            data = response.json()
+            outcome = 'success'
+            return data
+        except httpx.PoolTimeout:
+            # 连接池耗尽：等待空闲连接超时（本地排队问题，不计入熔断）
+            self.stats['pool_timeouts'] += 1
+            self.stats['failed_requests'] += 1
+            endpoint_stat['failed'] += 1
+            raise
+        except Exception as e:
+            outcome = 'timeout' if isinstance(e, httpx.TimeoutException) else 'failure'
+            self.stats['failed_requests'] += 1
+            endpoint_stat['failed'] += 1
+            raise
+        finally:
+            duration = time.monotonic() - start_time
+            self._in_flight -= 1
+            self.stats['total_requests'] += 1
+            endpoint_stat['calls'] += 1
+            endpoint_stat['total_duration'] += duration
+
+            # 超时的耗时也计入样本（实际延迟只会更长），让收紧的超时能随高德变慢而回升
+            if outcome in ('success', 'timeout'):
+                tracker.record(duration)
+            if breaker is not None:
+                if outcome == 'success':
+                    breaker.record_success()
+                elif outcome in ('timeout', 'failure'):
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+
+    @property
+    def is_closed(self) -> bool:
+        return self._client.is_closed
+
+    async def aclose(self):
+        """关闭连接池"""
+        await self._client.aclose()
+
+    def get_stats(self) -> Dict:
+        """获取连接池饱和度等统计信息"""
+        connections = self.transport.pool.connections
+        idle = sum(1 for c in connections if c.is_idle())
+        max_connections = self.limits.max_connections
+
+        endpoints = {}
+        for endpoint, stat in self.stats['endpoints'].items():
+            tracker = self._latencies.get(endpoint)
+            breaker = self._breakers.get(endpoint)
+            endpoints[endpoint] = {
+                **stat,
+                'avg_duration': stat['total_duration'] / stat['calls'] if stat['calls'] else 0.0,
+                'p50_duration': tracker.percentile(50) if tracker else None,
+                'p99_duration': tracker.percentile(99) if tracker else None,
+                'timeout': self.timeout_for(endpoint),
+                'circuit': breaker.get_stats() if breaker else None
+            }
+
+        return {
+            'http2': self.http2,
+            'max_connections': max_connections,
+            'max_keepalive_connections': self.limits.max_keepalive_connections,
+            'open_connections': len(connections),
+            'idle_connections': idle,
+            'active_connections': len(connections) - idle,
+            'in_flight_requests': self._in_flight,
+            'peak_in_flight': self.stats['peak_in_flight'],
+            'saturation': f"{(self._in_flight / max_connections * 100) if max_connections else 0:.1f}%",
+            'total_requests': self.stats['total_requests'],
+            'failed_requests': self.stats['failed_requests'],
+            'coalesced_requests': self.stats['coalesced_requests'],
+            'quota_exceeded': self.stats['quota_exceeded'],
+            'pool_timeouts': self.stats['pool_timeouts'],
+            'dns_cache': self.dns_backend.get_stats(),
+            'rate_limits': self.governor.get_stats(),
+            'endpoints': endpoints
+        }
+
+
+# 全局客户端实例
+_client_instance: Optional[AmapClient] = None
+
+
+def get_amap_client() -> AmapClient:
+    """获取共享客户端（lifespan之外使用时按需创建）"""
+    global _client_instance
+    if _client_instance is None or _client_instance.is_closed:
+        _client_instance = AmapClient()
+    return _client_instance
+
+
+async def init_amap_client() -> AmapClient:
+    """应用启动时创建共享客户端"""
+    client = get_amap_client()
+    print(f"[高德客户端] 连接池已创建（HTTP/2: {client.http2}, 最大连接数: {client.limits.max_connections}）")
+    return client
+
+
+async def close_amap_client():
+    """应用关闭时释放连接池"""
+    global _client_instance
+    if _client_instance is not None:
+        await _client_instance.aclose()
+        _client_instance = None
+        print("[高德客户端] 连接池已关闭")
@@ -0,0 +1,135 @@
+"""
+高德API熔断器与延迟统计
+端点连续失败时熔断（快速失败，调用方走估算等降级方案），冷却后放行少量探测请求，成功则恢复；
+同时记录每个端点的近期延迟，用p99推算请求超时，避免高德变慢时每次都等满固定超时
+"""
+import time
+from collections import deque
+from typing import Dict, Optional
+
+
+class CircuitOpenError(Exception):
+    """端点处于熔断状态，请求未发出"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super().__init__(f"高德接口 {endpoint} 已熔断，{retry_after:.0f}秒后重试")
+
+
+class LatencyTracker:
+    """滑动窗口延迟统计"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._sorted = None
+
+    def record(self, duration: float):
+        self._samples.append(duration)
+        self._sorted = None
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """获取百分位延迟（秒），无样本时返回None"""
+        if not self._samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        index = min(len(self._sorted) - 1, int(len(self._sorted) * p / 100))
+        return self._sorted[index]
+
+
+class CircuitBreaker:
+    """
+    熔断器（closed -> open -> half_open -> closed）
+
+    - closed: 正常放行，连续失败达到阈值后进入open
+    - open: 直接拒绝，冷却时间过后进入half_open
+    - half_open: 只放行有限个探测请求，成功则closed，失败则重新open
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = 5, open_seconds: float = 30.0, half_open_probes: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+        self.opened_count = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        """距离允许探测还有多少秒"""
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """请求发出前调用：是否放行（half_open状态下放行即占用一个探测名额）"""
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._probes = 0
+
+        if self.state == self.HALF_OPEN:
+            if self._probes >= self.half_open_probes:
+                self.rejected += 1
+                return False
+            self._probes += 1
+
+        return True
+
+    @property
+    def probing(self) -> bool:
+        return self.state == self.HALF_OPEN
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            print(f"[熔断器] ✅ {self.name} 探测成功，恢复正常")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probes = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open()
+
+    def release(self):
+        """请求被取消（既非成功也非失败）时归还探测名额"""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def _open(self):
+        if self.state == self.HALF_OPEN:
+            print(f"[熔断器] ⚠️ {self.name} 探测失败，继续熔断{self.open_seconds:g}秒")
+        elif self.state == self.CLOSED:
+            self.opened_count += 1
+            print(f"[熔断器] ⚠️ {self.name} 连续失败{self.consecutive_failures}次，熔断{self.open_seconds:g}秒")
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probes = 0
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        if self.state == self.OPEN and self.retry_after() <= 0:
+            state = self.HALF_OPEN
+        else:
+            state = self.state
+        return {
+            'state': state,
+            'consecutive_failures': self.consecutive_failures,
+            'opened_count': self.opened_count,
+            'rejected': self.rejected,
+            'retry_after': round(self.retry_after(), 1) if state == self.OPEN else 0.0
+        }
@@ -2,7 +2,7 @@
 配置管理模块
 使用 Pydantic Settings 管理环境变量
 """
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings
 from pydantic import validator
 
@@ -52,10 +52,103 @@ class Settings(BaseSettings):
     AI_RETRY_DELAY: float = 1.0           # 重试延迟（秒）
     AI_CACHE_TTL: int = 3600              # 缓存过期时间（秒）
     AI_ENABLE_CACHE: bool = True          # 是否启用缓存
+    AGENT_MODE: str = "react"             # Agent模式：react（文本ReAct，每轮1个工具）/ tool_calling（原生工具调用，同一轮的多个工具并行执行）
+    AGENT_TOOL_BUDGET_BASE: int = 4       # 每次Agent运行的工具调用预算 = 基础 + 城市数×每城市 + 天数×每天
+    AGENT_TOOL_BUDGET_PER_CITY: int = 4
+    AGENT_TOOL_BUDGET_PER_DAY: int = 2
+    AGENT_PHOTO_STORE_MAX_ENTRIES: int = 2000  # 工具结果中省略的景点照片在服务端保存的条目数
+    AGENT_MAX_SESSIONS: int = 200         # Agent会话数上限（超出时淘汰最久未使用的会话）
+    AGENT_SESSION_IDLE_TTL: int = 1800    # Agent会话空闲超时（秒）
     
     # 路径优化配置
     MAX_ATTRACTIONS: int = 12  # 最大景点数量
     TSP_TIME_LIMIT: int = 10  # TSP求解时间限制（秒）
+    TSP_SOLVER_WORKERS: int = 2  # TSP求解线程池大小（OR-Tools求解不在事件循环中执行）
+    TSP_EXACT_MAX_N: int = 13  # 不超过该景点数时用状态压缩DP求精确最优解
+    TSP_ORTOOLS_MAX_N: int = 80  # 不超过该景点数时用OR-Tools，更多时用网格近邻+2-opt/Or-opt
+    TSP_TIME_PER_NODE: float = 0.1  # OR-Tools每个景点分配的求解时间（秒），总时长在1秒到TSP_TIME_LIMIT之间
+    TSP_LOCAL_SEARCH_BUDGET: float = 0.5  # 大规模局部搜索（2-opt/Or-opt）的时间预算（秒）
+    TOUR_CACHE_MAX_ENTRIES: int = 1000  # TSP解缓存的最大条目数（按景点集合缓存访问顺序）
+    TOUR_CACHE_TTL: int = 3600  # TSP解缓存过期时间（秒）
+    VRP_DAY_START: str = "09:00"  # 每天从酒店出发的时间
+    VRP_DAY_HOURS: float = 10.0  # 多天规划时每天可用时长（小时，含游玩、路上和等待开门时间）
+    VRP_DEFAULT_VISIT_HOURS: float = 2.0  # 景点未给出游玩时长时的默认值（小时）
+    TSP_ROAD_DISTANCE: bool = True  # TSP使用高德驾车数据（近邻点对真实数据 + 其余按绕行系数换算）
+    TSP_HYBRID_K: int = 5  # 每个景点获取真实驾车数据的近邻数
+    TSP_HYBRID_MAX_N: int = 40  # 不超过该景点数时构建混合矩阵（更多时直接用直线距离）
+    TSP_COST_METRIC: str = "duration"  # TSP优化目标：duration（行驶时间）/ distance（行驶距离）
+    ROUTE_LEG_CONCURRENCY: int = 6  # 获取详细路线时并发请求的路段数
+    
+    # 天气预报缓存：高德每天在这些整点（北京时间）发布预报，缓存在下一个发布时刻过期
+    WEATHER_PUBLISH_HOURS: List[int] = [8, 11, 18]
+    
+    # 高德API连接池配置
+    AMAP_HTTP2: bool = True               # 是否启用HTTP/2（需安装h2）
+    AMAP_MAX_CONNECTIONS: int = 50        # 连接池最大连接数
+    AMAP_MAX_KEEPALIVE: int = 20          # 最大保活连接数
+    AMAP_KEEPALIVE_EXPIRY: float = 30.0   # 空闲连接保活时间（秒）
+    AMAP_POOL_TIMEOUT: float = 5.0        # 等待空闲连接的超时（秒）
+    AMAP_DNS_CACHE_TTL: int = 300         # DNS缓存时间（秒）
+    AMAP_SINGLE_FLIGHT: bool = True       # 合并参数相同的并发请求
+    # 分端点超时（秒），键为去掉版本号的端点前缀，如 place/text、direction
+    AMAP_TIMEOUTS: Dict[str, float] = {
+        'default': 10.0,
+        'direction': 15.0,
+        'distance': 15.0
+    }
+    # 分端点限流（每秒请求数，<=0表示不限流），超出配额的请求排队等待
+    AMAP_RATE_LIMITS: Dict[str, float] = {
+        'default': 20.0,
+        'place': 20.0,
+        'direction': 10.0,
+        'distance': 10.0,
+        'weather': 10.0,
+        'geocode': 10.0
+    }
+    AMAP_RATE_BURST: float = 1.0          # 允许的突发量（按秒计，桶容量 = 配额 × 该值）
+    AMAP_QUOTA_BACKOFF: float = 1.0       # 高德返回超限后该端点整体后退的时间（秒）
+    AMAP_QUOTA_RETRIES: int = 2           # 超限后重新排队重试的次数
+    AMAP_BULK_CONCURRENCY: int = 8        # 批量解析（POI详情/名称/地理编码）的最大并发请求数
+    
+    # 高德API熔断与自适应超时
+    AMAP_BREAKER_ENABLED: bool = True     # 是否启用分端点熔断
+    AMAP_BREAKER_FAILURES: int = 5        # 连续失败多少次后熔断
+    AMAP_BREAKER_OPEN_SECONDS: float = 30.0   # 熔断持续时间（秒），之后放行探测请求
+    AMAP_BREAKER_HALF_OPEN_PROBES: int = 1    # 半开状态下允许的探测请求数
+    AMAP_ADAPTIVE_TIMEOUT: bool = True    # 是否根据近期p99延迟收紧超时（不超过AMAP_TIMEOUTS）
+    AMAP_TIMEOUT_P99_FACTOR: float = 3.0  # 超时 = p99延迟 × 该系数
+    AMAP_TIMEOUT_MIN: float = 2.0         # 自适应超时下限（秒）
+    AMAP_LATENCY_WINDOW: int = 200        # 每个端点保留的延迟样本数
+    AMAP_LATENCY_MIN_SAMPLES: int = 20    # 样本数达到该值后才启用自适应超时
+    
+    # 高德POI响应缓存配置
+    POI_CACHE_ENABLED: bool = True        # 是否启用POI缓存
+    POI_CACHE_MAX_ENTRIES: int = 2000     # 最大缓存条目数（LRU淘汰）
+    # 分端点缓存时间（秒）
+    POI_CACHE_TTLS: Dict[str, int] = {
+        'default': 3600,
+        'place/text': 3600,
+        'place/around': 1800,
+        'place/detail': 86400
+    }
+    
+    # POI持久化存储（attractions表）
+    POI_STORE_ENABLED: bool = True        # 是否把POI写入数据库并优先读取
+    POI_STORE_MAX_AGE_HOURS: int = 72     # 数据库中POI的有效期（小时）
+    
+    # 路段缓存配置（起终点吸附到约10米网格）
+    ROUTE_LEG_CACHE_MAX_ENTRIES: int = 5000   # 最大缓存路段数
+    ROUTE_LEG_CACHE_POLYLINE: bool = True     # 是否缓存路线坐标串（占用内存较多）
+    DISTANCE_CACHE_MAX_ENTRIES: int = 20000   # 距离矩阵点对缓存的最大条目数
+    # 分出行方式的缓存时间（秒）：驾车受实时路况影响，缓存时间最短
+    ROUTE_LEG_CACHE_TTLS: Dict[str, int] = {
+        'default': 3600,
+        'driving': 1800,
+        'transit': 86400,
+        'walking': 604800,
+        'bicycling': 604800,
+        'electrobike': 604800
+    }
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,56 @@
+"""
+Agent工具结果（observation）的紧凑编码
+工具结果会写入Agent的scratchpad，之后每一轮都随提示词重新发给LLM，篇幅直接决定每轮的token数：
+不缩进、去掉空值字段、坐标保留5位小数（约1米）；照片URL列表只给张数，完整列表留在服务端，构建行程时再展开
+"""
+import json
+from typing import Any, List, Tuple
+
+from app.core.config import settings
+from app.core.ttl_cache import TTLCache, MISSING
+
+_EMPTY_VALUES = ('', '未知', None)
+
+# 景点照片：名称@坐标 -> {'photos': [...], 'thumbnail': ...}
+_photo_store = TTLCache('agent_photos', max_entries=settings.AGENT_PHOTO_STORE_MAX_ENTRIES, default_ttl=3600)
+
+
+def encode_observation(data: Any) -> str:
+    """把工具结果编码为紧凑的JSON字符串"""
+    return json.dumps(_compact(data), ensure_ascii=False, separators=(',', ':'))
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            k: _compact(v) for k, v in value.items()
+            if not (isinstance(v, (str, type(None))) and v in _EMPTY_VALUES) and v != [] and v != {}
+        }
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    return value
+
+
+def format_coord(lng: float, lat: float) -> str:
+    """坐标 -> 'lng,lat'（保留5位小数）"""
+    return f"{float(lng):.5f},{float(lat):.5f}"
+
+
+def stash_photos(name: str, coord: str, photos: List[str], thumbnail: str = '') -> int:
+    """
+    把景点照片留在服务端
+
+    Returns:
+        照片张数（写入observation）
+    """
+    if photos or thumbnail:
+        _photo_store.set(f"{name}@{coord}", {'photos': list(photos), 'thumbnail': thumbnail})
+    return len(photos)
+
+
+def expand_photos(name: str, coord: str) -> Tuple[List[str], str]:
+    """取回景点照片，返回 (照片URL列表, 缩略图)"""
+    item = _photo_store.get(f"{name}@{coord}")
+    if item is MISSING:
+        return [], ''
+    return item['photos'], item['thumbnail']
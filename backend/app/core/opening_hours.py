@@ -0,0 +1,80 @@
+"""
+营业时间解析
+高德POI的 business.opentime_today 形如 "08:30-17:00"、"09:00-12:00;14:00-17:30"、"10:00-次日02:00"、"全天"，
+统一解析为当天的营业时段（距0点的秒数），供路线规划的时间窗约束和行程可行性检查使用
+"""
+import re
+from typing import List, Optional, Tuple
+
+Window = Tuple[int, int]
+
+_WINDOW_RE = re.compile(r'(\d{1,2})[:：](\d{2})\s*[-~－—至到]+\s*(次日)?\s*(\d{1,2})[:：](\d{2})')
+_ALL_DAY_MARKS = ('全天', '24小时', '00:00-24:00', '00:00-23:59')
+
+
+def parse_clock(text: str) -> Optional[int]:
+    """'09:30' -> 34200（秒），无法解析返回None"""
+    match = re.match(r'^\s*(\d{1,2})[:：](\d{2})', text or '')
+    if not match:
+        return None
+    return int(match.group(1)) * 3600 + int(match.group(2)) * 60
+
+
+def format_clock(seconds: float) -> str:
+    """34200 -> '09:30'（超过24点按次日继续计数，如 '25:00'）"""
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def parse_opentime(text: Optional[str]) -> Optional[List[Window]]:
+    """
+    解析营业时间
+
+    Args:
+        text: 营业时间字符串
+
+    Returns:
+        按开始时间排序、合并重叠后的营业时段列表 [(开门秒数, 关门秒数)]；
+        全天营业或无法解析时返回None（表示不限制）
+    """
+    if not text or any(mark in text for mark in _ALL_DAY_MARKS):
+        return None
+
+    windows = []
+    for match in _WINDOW_RE.finditer(text):
+        open_at = int(match.group(1)) * 3600 + int(match.group(2)) * 60
+        close_at = int(match.group(4)) * 3600 + int(match.group(5)) * 60
+        # 跨午夜营业（"次日"或关门早于开门）
+        if match.group(3) or close_at <= open_at:
+            close_at += 24 * 3600
+        windows.append((open_at, close_at))
+    if not windows:
+        return None
+
+    windows.sort()
+    merged = [windows[0]]
+    for open_at, close_at in windows[1:]:
+        if open_at <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], close_at))
+        else:
+            merged.append((open_at, close_at))
+    return merged
+
+
+def visit_start_windows(windows: Optional[List[Window]], duration: float) -> Optional[List[Window]]:
+    """
+    可以开始游玩的时段（游玩需在关门前结束）
+
+    Returns:
+        [(最早开始, 最晚开始)]；不限制时返回None，营业时间不够游玩时返回空列表
+    """
+    if windows is None:
+        return None
+    return [(open_at, int(close_at - duration)) for open_at, close_at in windows if close_at - duration >= open_at]
+
+
+def fits_opentime(windows: Optional[List[Window]], start: float, duration: float) -> bool:
+    """在start开始游玩duration秒，是否落在某个营业时段内"""
+    if windows is None:
+        return True
+    return any(open_at <= start and start + duration <= close_at for open_at, close_at in windows)
@@ -0,0 +1,149 @@
+"""
+高德API限流器
+按端点维护令牌桶，请求在超出配额时按到达顺序排队等待，而不是直接打到高德后报 CUQPS_HAS_EXCEEDED_THE_LIMIT
+"""
+import asyncio
+import time
+from typing import Any, Dict, Optional
+
+
+def match_endpoint(endpoint: str, table: Dict[str, Any]) -> Optional[str]:
+    """在按端点前缀配置的表中查找最长匹配的键，找不到返回None"""
+    best = None
+    for key in table:
+        if key == 'default':
+            continue
+        if endpoint == key or endpoint.startswith(key + '/'):
+            if best is None or len(key) > len(best):
+                best = key
+    return best
+
+
+class TokenBucket:
+    """
+    令牌桶（先到先得）
+
+    等待令牌的协程通过 asyncio.Lock 排队，Lock 按FIFO唤醒，
+    因此请求按到达顺序依次放行，不会有请求一直抢不到令牌。
+    """
+
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.acquired = 0
+        self.delayed = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> float:
+        """
+        获取一个令牌（必要时排队等待）
+
+        Returns:
+            等待时间（秒）
+        """
+        start_time = time.monotonic()
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            async with self._lock:
+                self._refill()
+                while self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                    self._refill()
+                self.tokens -= 1
+        finally:
+            self.waiting -= 1
+
+        wait = time.monotonic() - start_time
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        if wait > 0.001:
+            self.delayed += 1
+        return wait
+
+    def penalize(self, seconds: float):
+        """高德返回超限时清空令牌，让后续请求整体后退一段时间"""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+        self.throttled += 1
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        self._refill()
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'available_tokens': round(max(self.tokens, 0.0), 2),
+            'queue_depth': self.waiting,
+            'peak_queue_depth': self.peak_waiting,
+            'acquired': self.acquired,
+            'delayed': self.delayed,
+            'throttled': self.throttled,
+            'avg_wait': self.total_wait / self.acquired if self.acquired else 0.0,
+            'max_wait': self.max_wait
+        }
+
+
+class RateGovernor:
+    """按端点分配令牌桶的限流器"""
+
+    def __init__(self, rates: Dict[str, float], burst: float = 1.0):
+        """
+        Args:
+            rates: 各端点前缀每秒允许的请求数（键为去掉版本号的端点前缀，'default'为兜底配额），<=0 表示不限流
+            burst: 允许的突发请求数（按秒计，实际桶容量 = rate * burst）
+        """
+        self.rates = rates
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        # 端点 -> 令牌桶（同一前缀下的端点共享一个桶）
+        self._endpoint_buckets: Dict[str, Optional[TokenBucket]] = {}
+
+    def bucket_for(self, endpoint: str) -> Optional[TokenBucket]:
+        """获取端点所属的令牌桶，未配置配额时返回None"""
+        if endpoint in self._endpoint_buckets:
+            return self._endpoint_buckets[endpoint]
+
+        key = match_endpoint(endpoint, self.rates) or 'default'
+        rate = float(self.rates.get(key) or 0)
+        bucket = None
+        if rate > 0:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(key, rate, rate * self.burst)
+                self._buckets[key] = bucket
+
+        self._endpoint_buckets[endpoint] = bucket
+        return bucket
+
+    async def acquire(self, endpoint: str) -> float:
+        """请求发出前获取令牌，返回排队时间（秒）"""
+        bucket = self.bucket_for(endpoint)
+        if bucket is None:
+            return 0.0
+        return await bucket.acquire()
+
+    def penalize(self, endpoint: str, seconds: float):
+        """高德返回超限后让该端点整体后退"""
+        bucket = self.bucket_for(endpoint)
+        if bucket is not None:
+            bucket.penalize(seconds)
+
+    def get_stats(self) -> Dict:
+        """获取各令牌桶的统计信息"""
+        return {name: bucket.get_stats() for name, bucket in self._buckets.items()}
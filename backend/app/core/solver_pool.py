@@ -0,0 +1,165 @@
+"""
+TSP求解线程池
+OR-Tools求解是CPU密集的同步调用，直接在async handler里执行会卡住整个事件循环（所有SSE流和请求）；
+这里把求解放到独立的线程池中，并支持在客户端断开（等待方被取消）时中止正在进行的求解
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+
+
+class SolveCancelToken:
+    """
+    求解取消令牌
+
+    求解函数在开始搜索前通过 bind() 登记可中止的对象（如OR-Tools的RoutingModel），
+    等待方被取消时调用 cancel()，正在进行的搜索随即停止并返回当前最优解
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._target = None
+        self.cancelled = False
+
+    def bind(self, target: Any):
+        """登记可中止的对象（需提供CancelSearch方法）；已取消时立即中止"""
+        with self._lock:
+            self._target = target
+            cancelled = self.cancelled
+        if cancelled:
+            target.CancelSearch()
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            target = self._target
+        if target is not None:
+            target.CancelSearch()
+
+
+class SolverPool:
+    """求解线程池（带排队/运行数监控）"""
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tsp-solver')
+        self._lock = threading.Lock()
+
+        self.queued = 0
+        self.running = 0
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'cancelled': 0,
+            'peak_queue_depth': 0,
+            'solves': 0,
+            'total_wait': 0.0,
+            'total_solve': 0.0,
+            'max_wait': 0.0
+        }
+
+    async def run(self, fn: Callable, *args, token: Optional[SolveCancelToken] = None, **kwargs) -> Any:
+        """
+        在线程池中执行求解函数
+
+        Args:
+            fn: 同步求解函数
+            token: 取消令牌（同时以token参数传给求解函数，等待方被取消时用于中止求解）
+
+        Returns:
+            求解函数的返回值
+        """
+        if token is not None:
+            kwargs['token'] = token
+
+        submitted_at = time.monotonic()
+        with self._lock:
+            self.queued += 1
+            self.stats['submitted'] += 1
+            self.stats['peak_queue_depth'] = max(self.stats['peak_queue_depth'], self.queued)
+
+        def task():
+            started_at = time.monotonic()
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                wait = started_at - submitted_at
+                self.stats['total_wait'] += wait
+                self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.stats['solves'] += 1
+                    self.stats['total_solve'] += time.monotonic() - started_at
+
+        future = self._executor.submit(task)
+        try:
+            result = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # 等待方被取消（如客户端断开）：还在排队的直接撤销，已开始的通知求解器中止
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+            elif token is not None:
+                token.cancel()
+            with self._lock:
+                self.stats['cancelled'] += 1
+            print("[求解池] 等待方已取消，中止求解")
+            raise
+        except Exception:
+            with self._lock:
+                self.stats['failed'] += 1
+            raise
+
+        with self._lock:
+            self.stats['completed'] += 1
+        return result
+
+    def shutdown(self):
+        """关闭线程池（不等待正在进行的求解）"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        with self._lock:
+            started = self.stats['solves'] + self.running
+            return {
+                'max_workers': self.max_workers,
+                'queue_depth': self.queued,
+                'running': self.running,
+                'peak_queue_depth': self.stats['peak_queue_depth'],
+                'submitted': self.stats['submitted'],
+                'completed': self.stats['completed'],
+                'failed': self.stats['failed'],
+                'cancelled': self.stats['cancelled'],
+                'avg_wait': self.stats['total_wait'] / started if started else 0.0,
+                'max_wait': self.stats['max_wait'],
+                'avg_solve': self.stats['total_solve'] / self.stats['solves'] if self.stats['solves'] else 0.0
+            }
+
+
+# 全局求解池
+_solver_pool: Optional[SolverPool] = None
+
+
+def get_solver_pool() -> SolverPool:
+    """获取求解池（按需创建）"""
+    global _solver_pool
+    if _solver_pool is None:
+        _solver_pool = SolverPool(settings.TSP_SOLVER_WORKERS)
+    return _solver_pool
+
+
+def close_solver_pool():
+    """应用关闭时释放求解池"""
+    global _solver_pool
+    if _solver_pool is not None:
+        _solver_pool.shutdown()
+        _solver_pool = None
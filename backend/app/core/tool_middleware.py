@@ -0,0 +1,139 @@
+"""
+Agent工具调用中间件
+在一次Agent运行内：规范化工具参数、重复调用直接返回已有结果、按任务规模限制工具调用次数，并统计本次运行的调用情况
+（提示词里的"工具调用预算"和"禁止重复搜索"只是建议，这里在执行层面强制）
+"""
+import asyncio
+import contextvars
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from app.core.config import settings
+from app.core.tool_monitor import get_monitor
+
+BUDGET_EXHAUSTED = "工具调用次数已用完（本次预算{budget}次），不要再调用任何工具，请立即根据已获得的信息给出最终回复"
+
+# 当前Agent运行的工具调用状态（Agent执行器创建的任务会继承该上下文）
+_current_run: contextvars.ContextVar[Optional['ToolRun']] = contextvars.ContextVar('agent_tool_run', default=None)
+
+
+def normalize_tool_args(tool_input: Any) -> Any:
+    """
+    规范化工具参数：去掉代码块标记、解析JSON、去除字符串两端空白和空值参数
+
+    Returns:
+        解析后的参数；不是JSON时返回去除空白的原字符串
+    """
+    if isinstance(tool_input, str):
+        text = tool_input.strip().strip('`').strip()
+        if text.startswith('json'):
+            text = text[4:].strip()
+        try:
+            tool_input = json.loads(text)
+        except ValueError:
+            return text
+    return _strip(tool_input)
+
+
+def _strip(value: Any) -> Any:
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, dict):
+        return {str(k).strip(): _strip(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_strip(v) for v in value]
+    return value
+
+
+class ToolRun:
+    """一次Agent运行的工具调用状态"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.calls = 0          # 实际执行次数（计入预算）
+        self.memo_hits = 0      # 重复调用次数（返回已有结果）
+        self.rejected = 0       # 超出预算被拒绝的次数
+        self.tool_calls: Dict[str, int] = {}
+        self._memo: Dict[str, asyncio.Future] = {}
+        self._started = time.monotonic()
+
+    async def call(self, tool_name: str, params: Any, execute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行一次工具调用
+
+        Args:
+            tool_name: 工具名称
+            params: 规范化后的参数（用于识别重复调用）
+            execute: 实际执行工具的函数
+        """
+        key = f"{tool_name}:{json.dumps(params, ensure_ascii=False, sort_keys=True)}"
+        self.tool_calls[tool_name] = self.tool_calls.get(tool_name, 0) + 1
+
+        # 重复调用（包括同一轮并行发起的相同调用）共用同一次执行的结果
+        task = self._memo.get(key)
+        if task is not None:
+            self.memo_hits += 1
+            if settings.DEBUG_TOOLS:
+                print(f"[工具中间件] {tool_name} 重复调用，返回已有结果")
+            return await task
+
+        if self.calls >= self.budget:
+            self.rejected += 1
+            if settings.DEBUG_TOOLS:
+                print(f"[工具中间件] {tool_name} 超出工具调用预算（{self.budget}次），拒绝执行")
+            return BUDGET_EXHAUSTED.format(budget=self.budget)
+
+        self.calls += 1
+        task = asyncio.ensure_future(get_monitor().call_with_monitor(tool_name, execute))
+        self._memo[key] = task
+        try:
+            return await task
+        except Exception:
+            # 执行失败（工具以ToolException表示失败）不缓存，允许重试
+            self._memo.pop(key, None)
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'budget': self.budget,
+            'calls': self.calls,
+            'memo_hits': self.memo_hits,
+            'rejected': self.rejected,
+            'tool_calls': dict(self.tool_calls),
+            'seconds': round(time.monotonic() - self._started, 1)
+        }
+
+
+def start_tool_run(budget: int) -> ToolRun:
+    """开始一次Agent运行（在当前上下文中生效，之后创建的任务都会继承）"""
+    run = ToolRun(budget)
+    _current_run.set(run)
+    return run
+
+
+def guard_tool(name: str, coroutine: Callable, keyword_args: bool) -> Callable:
+    """
+    给工具函数加上中间件
+
+    Args:
+        name: 工具名称
+        coroutine: 工具的异步函数
+        keyword_args: 参数是否以关键字参数传入（结构化工具）；否则为单个输入（ReAct工具的JSON字符串）
+
+    Returns:
+        包装后的异步函数（不在Agent运行中调用时只规范化参数）
+    """
+    async def guarded(*args, **kwargs):
+        params = normalize_tool_args(kwargs if keyword_args else args[0])
+        if keyword_args:
+            execute = lambda: coroutine(**params)
+        else:
+            execute = lambda: coroutine(params)
+
+        run = _current_run.get()
+        if run is None:
+            return await execute()
+        return await run.call(name, params, execute)
+
+    return guarded
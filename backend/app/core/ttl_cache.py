@@ -0,0 +1,140 @@
+"""
+内存TTL + LRU缓存
+用于缓存高德API响应，容量有上限，按最近使用淘汰，并统计命中/未命中/淘汰次数
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# 未命中标记（允许缓存None等假值）
+MISSING = object()
+
+# 已创建的缓存实例（用于监控API汇总统计）
+_registry: Dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    """
+    TTL + LRU 缓存
+
+    所有操作都是同步的、不包含await，在单个事件循环内天然是原子的，
+    可以被并发的协程安全共享。
+    """
+
+    def __init__(self, name: str, max_entries: int = 1000, default_ttl: float = 3600):
+        self.name = name
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        _registry[name] = self
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        """获取缓存，过期或不存在时返回default"""
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: str, default: Any = MISSING) -> Any:
+        """查看缓存但不计入命中统计、不调整LRU顺序"""
+        item = self._data.get(key)
+        if item is None or item[0] <= time.monotonic():
+            return default
+        return item[1]
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """写入缓存，ttl<=0表示不缓存"""
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+
+        # 超出容量时淘汰最久未使用的条目
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        """删除缓存"""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict:
+        """获取统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hit_rate': f"{(self.hits / lookups * 100) if lookups else 0:.1f}%"
+        }
+
+
+def make_cache_key(namespace: str, params: Dict[str, Any]) -> str:
+    """
+    根据规范化后的请求参数生成缓存键
+
+    - 忽略API密钥和空参数
+    - 参数按名称排序，字符串去除多余空白，浮点数统一精度
+
+    Args:
+        namespace: 命名空间（通常是端点名称，如 place/text）
+        params: 请求参数
+
+    Returns:
+        缓存键
+    """
+    normalized = []
+    for name in sorted(params):
+        if name == 'key':
+            continue
+        value = params[name]
+        if value is None or value == '':
+            continue
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        elif isinstance(value, float):
+            value = f"{value:.6f}"
+        else:
+            value = ' '.join(str(value).split())
+        normalized.append(f"{name}={value}")
+    return f"{namespace}?{'&'.join(normalized)}"
+
+
+def get_cache_stats() -> Dict[str, Dict]:
+    """获取所有缓存的统计信息"""
+    return {name: cache.get_stats() for name, cache in _registry.items()}
+
+
+def clear_caches():
+    """清空所有缓存"""
+    for cache in _registry.values():
+        cache.clear()
@@ -1,23 +1,38 @@
 """
 FastAPI应用入口
 """
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
 from app.core.database import engine, Base
+from app.core.amap_client import init_amap_client, close_amap_client
+from app.core.solver_pool import close_solver_pool
 from app.api.v1 import api_router
 
 # 创建数据库表
 Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享资源，关闭时释放"""
+    await init_amap_client()
+    yield
+    await close_amap_client()
+    close_solver_pool()
+
+
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.PROJECT_NAME,
     version=settings.VERSION,
     description="基于GIS与AI的智能旅行规划系统",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # 配置CORS
@@ -33,6 +33,9 @@ class TripSummary(BaseModel):
     total_duration_hours: float
     total_cost: float
     optimization_rate: Optional[float] = None  # 优化率
+    optimization_basis: Optional[str] = None  # 优化率计算依据：api（真实路线）/ matrix（距离矩阵）
+    distance_matrix: Optional[str] = None  # TSP代价矩阵来源：hybrid（近邻真实驾车数据 + 绕行系数换算）/ straight（直线距离）
+    routing_latency: Optional[Dict[str, Any]] = None  # 详细路线获取耗时分解
 
 
 class TripCreate(BaseModel):
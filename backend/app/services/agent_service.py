@@ -3,17 +3,31 @@
 类似MCP (Model Context Protocol) 的架构
 """
 import asyncio
-from typing import List, Dict, Any, Optional
-from langchain.agents import AgentExecutor, create_react_agent
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+from langchain.agents import AgentExecutor, create_react_agent, create_tool_calling_agent
 from langchain.tools import Tool, StructuredTool
 from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from langchain.schema import AIMessage, HumanMessage, SystemMessage
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.tools import ToolException
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+from langchain.schema import AgentAction, AIMessage, HumanMessage, SystemMessage
 from pydantic import BaseModel, Field
 
 from app.core.config import settings
+from app.core.circuit_breaker import CircuitOpenError
+from app.core.city_mapping import SUPPORTED_CITIES
+from app.core.geometry import haversine_matrix, path_length
+from app.core.solver_pool import SolveCancelToken, get_solver_pool
+from app.core.observation import encode_observation, expand_photos, format_coord, stash_photos
+from app.core.tool_middleware import guard_tool, start_tool_run
 from app.services.map_service import MapService
 from app.services.route_planner import RoutePlanner
+from app.services.tour_cache import get_cached_tour, set_cached_tour
+from app.services.tsp_solver import solve_tsp_ortools
 
 
 class SearchAttractionInput(BaseModel):
@@ -27,7 +41,8 @@ class CalculateRouteInput(BaseModel):
     """计算路线输入"""
     origin: str = Field(..., description="起点名称")
     destination: str = Field(..., description="终点名称")
-    city: str = Field(..., description="所在城市")
+    city: Optional[str] = Field(None, description="所在城市（跨城路线可不填）")
+    mode: str = Field("auto", description="交通方式：auto/walking/driving/transit/bicycling")
 
 
 class OptimizeRouteInput(BaseModel):
@@ -49,6 +64,16 @@ class GetWeatherInput(BaseModel):
     city: str = Field(..., description="城市名称")
 
 
+class GetMultiWeatherInput(BaseModel):
+    """批量获取天气输入"""
+    cities: List[str] = Field(..., description="城市名称列表")
+
+
+class GetCityInfoInput(BaseModel):
+    """获取城市信息输入"""
+    city: str = Field(..., description="城市名称")
+
+
 class SearchFoodInput(BaseModel):
     """搜索美食输入"""
     city: str = Field(..., description="城市名称")
@@ -56,8 +81,186 @@ class SearchFoodInput(BaseModel):
     limit: int = Field(5, description="返回数量")
 
 
+class TokenUsageCallback(AsyncCallbackHandler):
+    """统计一次Agent运行中各轮LLM调用的token用量（scratchpad越长，每轮的prompt越大）"""
+    
+    def __init__(self):
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_prompt_tokens = 0
+    
+    async def on_llm_end(self, response, **kwargs):
+        usage = {}
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, 'message', None)
+                if getattr(message, 'usage_metadata', None):
+                    usage = {'prompt': message.usage_metadata['input_tokens'],
+                             'completion': message.usage_metadata['output_tokens']}
+        if not usage and response.llm_output and response.llm_output.get('token_usage'):
+            token_usage = response.llm_output['token_usage']
+            usage = {'prompt': token_usage.get('prompt_tokens', 0), 'completion': token_usage.get('completion_tokens', 0)}
+        
+        self.llm_calls += 1
+        self.prompt_tokens += usage.get('prompt', 0)
+        self.completion_tokens += usage.get('completion', 0)
+        self.max_prompt_tokens = max(self.max_prompt_tokens, usage.get('prompt', 0))
+    
+    def get_report(self) -> Dict[str, int]:
+        return {
+            'llm_calls': self.llm_calls,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'max_prompt_tokens': self.max_prompt_tokens
+        }
+
+
+# 行程规划要求（ReAct和原生工具调用两种模式共用；花括号已转义，供提示词模板使用）
+_PLANNING_GUIDE = """💡 **高效工作流程**（必须严格遵守，避免超时）：
+
+🚨 **关键原则：工具调用要少而精，避免重复搜索！**
+
+1️⃣ 查询天气（1次）：
+   ✅ 必须使用 get_multi_weather 批量查询所有城市
+      示例: get_multi_weather({{"cities": ["济南", "青岛", "淄博"]}})
+   ❌ 禁止：多次调用get_weather单独查询
+   
+2️⃣ 搜索景点（每城市最多1次）：
+   ⚠️ **景点数量严格控制**：
+   - 单城市3天：搜索1次，取6-9个景点即可（每天2-3个）
+   - 多城市行程：每个城市搜索1次，按天数分配
+   - **禁止重复搜索**：不要用不同关键词反复搜索同一城市
+   
+   ⚠️ **地理位置严格要求**（最重要！）：
+   - 🎯 **观察坐标选景点**：必须看搜索结果的经纬度，选择坐标接近的（经度或纬度相差<0.05度）
+   - 🚫 **绝对禁止偏远景点**：
+     * 济南市区：117.0±0.05, 36.66±0.05（趵突泉、大明湖、千佛山区域）
+     * 淄博周村：117.84±0.03, 36.80±0.03（周村古商城附近）
+     * 青岛市南区：120.32±0.05, 36.06±0.05（栈桥、八大关区域）
+   - ❌ **必须过滤掉**：
+     * 友谊葫芦、万德文化中心（远郊，距市区50km+）
+     * 热带鱼林（不知名小景点）
+     * 绿野仙踪文化（远郊）
+   - ✅ **只选热门核心景点**：评分4.5+，且在市区核心区域
+   
+   ⚠️ **多城市行程规划**：
+   - 城市之间要有明确的先后顺序，不要来回跑
+   - 例如：济南2天→淄博2天→青岛3天（顺序游玩）
+   - **禁止**：济南→青岛→济南→淄博（来回跑）
+   
+3️⃣ 优化顺序（可选）：
+   - 只有当同城景点≥3个时才使用optimize_route
+   - 跨城市的景点绝对不要一起优化
+   
+4️⃣ 规划交通（仅关键路段）：
+   - 跨城市：必须规划1次（如济南→淄博）
+   - 同城：距离>10km时规划
+   - **禁止**：为每个相邻景点都计算路线（浪费工具调用）
+   
+5️⃣ 搜索配套（每城市各1次）：
+   - search_hotels：每城市1次
+   - search_food：每城市1次
+   - **禁止重复搜索**
+
+🎯 **工具调用预算**（超出后工具不再执行，只能用已获得的信息给出回复）：
+- 3天单城市：≤12次工具调用
+- 5天双城市：≤18次工具调用  
+- 7天三城市：≤25次工具调用
+
+🚗 **交通方式选择建议**：
+- <2km: walking（步行，0元）
+- 2-10km: transit（公交/地铁，2-5元）或 bicycling（骑行，0元）
+- 10-50km: driving（出租车，约30-130元）或 transit（地铁，约5元）
+- >50km跨城: transit（高铁），费用约0.45元/km，耗时约150km/h
+  例：济南→青岛300km，高铁约135元，2小时
+
+💰 **预算分配标准**（根据总预算合理分配）：
+假设总预算B元，游玩D天，N个城市：
+- 交通费：B × (0.35-0.45)，跨城市多则占比高
+  * 同城游：B × 0.25（主要是市内交通）
+  * 2-3城市：B × 0.35（含1-2次城际高铁）
+  * 4+城市：B × 0.45（多次城际高铁）
+- 住宿费：B × 0.30-0.35，约 B/(D×3) 元/晚
+  * 预算紧张：150-200元/晚（经济型连锁酒店）
+  * 预算宽裕：250-350元/晚（中档酒店）
+- 餐饮费：B × 0.20-0.25，约 B/(D×15) 元/餐
+  * 早餐：15-25元（快餐/小吃）
+  * 午餐：30-50元（特色美食）
+  * 晚餐：40-70元（正餐）
+- 门票费：B × 0.10-0.15
+  * 优先选择免费景点（公园、广场、古城）
+  * 控制付费景点数量（每天1-2个）
+- 应急备用：B × 0.05（用于意外支出）
+
+💡 **预算优化技巧**：
+- 预算紧张时：多选免费景点、住青旅/经济连锁、多吃小吃/快餐、市内多用公交
+- 预算充裕时：可选高评分景点、住中档酒店、尝试特色餐厅、适当打车
+
+⚠️ **景点规划要求**（最重要，必须严格遵守！）：
+
+🎯 **核心原则**：只选市区核心景点，绝不选偏远景点！
+
+1. **景点数量**：每天2-3个景点（严格上限）
+2. **地理位置**：必须观察坐标，选择经纬度接近的景点（相差<0.05度）
+3. **距离控制**：景点间直线距离<3km，绝不超过5km
+4. **评分要求**：优先4.5+评分，过滤0分或低分景点
+5. **必须过滤掉的偏远景点**：
+   - ❌ 友谊葫芦非遗文化产业园（117.536075, 36.622176）距市区46km
+   - ❌ 万德文化中心（116.920241, 36.33788）距市区63km
+   - ❌ 热带鱼林高端水族文化馆（117.156335, 37.299244）距市区72km
+   - ❌ 玄霆司民俗文创体验馆（117.857969, 36.814306）0分小景点
+   - ❌ 绿野仙踪文化（120.422658, 36.098227）远郊景点
+6. **只选核心景区**：
+   - ✅ 济南：趵突泉(117.015893, 36.661087)、大明湖、千佛山、芙蓉街
+   - ✅ 淄博：周村古商城(117.841013, 36.798378)及其内部景点
+   - ✅ 青岛：栈桥(120.320444, 36.058475)、八大关、信号山、德国建筑群
+
+⚠️ **时间规划标准**（必须严格遵守）：
+- 🌅 上午第1个景点：start_time="09:00", duration_hours=2.5
+- 🍜 午餐时间：12:00-13:30（不在景点列表中）
+- ☀️ 下午第2个景点：start_time="13:30", duration_hours=2.5
+- 🍽️ 晚餐时间：18:00-19:30（不在景点列表中）
+- 🌙 晚上第3个景点（可选）：start_time="19:30", duration_hours=1.5
+
+**重要**：
+- 每个景点必须有不同的start_time，不能都是09:00
+- duration_hours根据景点类型：大景区2.5-3小时，小景点1.5-2小时
+
+⚠️ **输出要求**：
+最终回复必须包含两部分：
+1. 详细的行程规划文本（包含每天的时间表）
+2. JSON格式的结构化数据（在文本末尾）
+
+JSON格式示例（必须严格遵守）：
+```json
+{{
+  "destination": "目的地城市",
+  "days": 天数,
+  "daily_schedule": [
+    {{
+      "day": 1,
+      "city": "当天所在城市",
+      "theme": "当天主题（如：泉城文化游）",
+      "attractions": [
+        {{"name": "景点名", "address": "地址", "lng": 经度, "lat": 纬度, "cost": 门票, "rating": 评分, "start_time": "09:00", "duration_hours": 2}}
+      ],
+      "hotel": {{"name": "酒店名", "address": "地址", "lng": 经度, "lat": 纬度, "price_per_night": 价格}},
+      "transportation": [{{"from_location": "起点", "to_location": "终点", "type": "交通方式", "cost": 费用, "distance": "距离", "duration": "时长"}}]
+    }}
+  ],
+  "cost_breakdown": {{"transportation": 交通费, "accommodation": 住宿费, "food": 餐饮费, "tickets": 门票费, "total": 总计}}
+}}
+```"""
+
+
 class TravelPlannerAgent:
-    """旅行规划智能体"""
+    """
+    旅行规划智能体
+    
+    LLM客户端、工具和Agent执行器在所有会话间共享且运行中不被修改；
+    迭代上限等每次运行的设置放在本次运行的执行器副本和调用config中，对话历史由调用方（AgentSession）传入
+    """
     
     def __init__(self):
         self.map_service = MapService()
@@ -71,17 +274,16 @@ class TravelPlannerAgent:
             temperature=settings.AI_TEMPERATURE_BALANCED,
             max_tokens=settings.AI_MAX_TOKENS,
             timeout=settings.AI_TIMEOUT,
+            stream_usage=True,  # 流式调用时也返回token用量
             model_kwargs={"stream": False}
         )
         
-        # 创建工具
-        self.tools = self._create_tools()
+        # 创建工具（原生工具调用模式使用带参数结构的工具）
+        self.mode = settings.AGENT_MODE
+        self.tools = self._create_tools(structured=self.mode == 'tool_calling')
         
         # 创建Agent
         self.agent = self._create_agent()
-        
-        # 对话历史
-        self.chat_history = []
     
     async def _retry_tool_call(self, func, tool_name: str, max_retries: int = 2):
         """
@@ -94,12 +296,20 @@ class TravelPlannerAgent:
             
         Returns:
             执行结果
+            
+        Raises:
+            ToolException: 接口熔断或重试后仍失败（作为失败observation返回给AI，且不计入重复调用的缓存）
         """
         last_exception = None
         
         for attempt in range(max_retries + 1):
             try:
                 return await func()
+            except CircuitOpenError as e:
+                # 高德接口已熔断：重试只会白等，直接返回让AI改用其他信息
+                if settings.DEBUG_TOOLS:
+                    print(f"[工具重试] {tool_name} 接口熔断，跳过重试: {e}")
+                raise ToolException(f"工具调用失败（{e}）") from e
             except Exception as e:
                 last_exception = e
                 
@@ -112,10 +322,15 @@ class TravelPlannerAgent:
                     if settings.DEBUG_TOOLS:
                         print(f"[工具重试] {tool_name} 达到最大重试次数({max_retries})，返回错误")
         
-        return f"工具调用失败（已重试{max_retries}次）: {str(last_exception)}"
+        raise ToolException(f"工具调用失败（已重试{max_retries}次）: {str(last_exception)}") from last_exception
     
-    def _create_tools(self) -> List[Tool]:
-        """创建AI可以调用的工具"""
+    def _create_tools(self, structured: bool = False) -> List[Tool]:
+        """
+        创建AI可以调用的工具
+        
+        Args:
+            structured: 是否创建带参数结构的工具（原生工具调用模式）；否则创建输入为JSON字符串的工具（ReAct模式）
+        """
         
         # 工具1：搜索景点
         async def search_attractions_tool(city: str, keyword: str, limit: int = 5) -> str:
@@ -136,33 +351,30 @@ class TravelPlannerAgent:
                     tool_name="search_attractions"
                 )
                 
-                # 检查返回结果
-                if isinstance(results, str) and results.startswith("工具调用失败"):
-                    return results  # 重试后仍失败，返回错误信息
-                
                 if not results:
                     return f"未找到'{keyword}'相关景点"
                 
-                # 格式化结果（包含照片信息）
+                # 格式化结果（照片留在服务端，只给张数，构建行程时按名称和坐标展开）
                 attractions_info = []
-                for idx, attr in enumerate(results[:limit], 1):
+                for attr in results[:limit]:
+                    coord = format_coord(attr['lng'], attr['lat'])
                     info = {
-                        "序号": idx,
                         "名称": attr['name'],
                         "地址": attr.get('address', '未知'),
                         "类型": attr.get('type', '未知'),
                         "评分": attr.get('rating', 0),
-                        "坐标": f"({attr['lng']}, {attr['lat']})",
-                        "照片": attr.get('photos', []),  # 所有照片URL列表
-                        "缩略图": attr.get('thumbnail', '')  # 第一张照片作为缩略图
+                        "坐标": coord,
+                        "营业时间": attr.get('opentime', ''),
+                        "照片数": stash_photos(attr['name'], coord, attr.get('photos') or [], attr.get('thumbnail', ''))
                     }
                     attractions_info.append(info)
                 
-                import json
-                return json.dumps(attractions_info, ensure_ascii=False, indent=2)
+                return encode_observation(attractions_info)
                 
+            except ToolException:
+                raise
             except Exception as e:
-                return f"搜索失败: {str(e)}"
+                raise ToolException(f"搜索失败: {str(e)}") from e
         
         # 工具2：智能路线规划（让AI决定交通方式）
         async def calculate_route_tool(origin: str, destination: str, city: str = None, mode: str = "auto") -> str:
@@ -250,8 +462,7 @@ class TravelPlannerAgent:
                     result_data["建议"] = f"根据{straight_distance/1000:.1f}km的距离，建议使用: {', '.join(modes_to_try)}"
                     result_data["可选交通方式"] = ["walking", "driving", "transit", "bicycling"]
                     
-                    import json
-                    return json.dumps(result_data, ensure_ascii=False, indent=2)
+                    return encode_observation(result_data)
                 
                 # 调用具体的交通方式API
                 if mode == "walking":
@@ -333,13 +544,14 @@ class TravelPlannerAgent:
                             "费用": 0
                         })
                 
-                import json
-                return json.dumps(result_data, ensure_ascii=False, indent=2)
+                return encode_observation(result_data)
                 
+            except ToolException:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return f"计算路线失败: {str(e)}"
+                raise ToolException(f"计算路线失败: {str(e)}") from e
         
         # 工具3：优化多个景点的游览顺序（仅优化顺序，不规划详细路线）
         async def optimize_route_tool(attractions: List[str], city: str) -> str:
@@ -359,88 +571,62 @@ class TravelPlannerAgent:
                         print(f"[optimize_route] 景点数量过多({len(attractions)})，仅优化前6个")
                     attractions = attractions[:6]
                 
-                # 搜索所有景点的坐标
-                attractions_data = []
-                for name in attractions:
-                    results = await self.map_service.search_attractions(
-                        city=city, keyword=name, limit=1
-                    )
-                    if results:
-                        attractions_data.append(results[0])
+                # 批量解析所有景点的坐标（并发）
+                pois = await self.map_service.get_attractions_by_names(city, attractions)
+                attractions_data = [poi for poi in pois if poi]
                 
                 if len(attractions_data) < 2:
                     return "至少需要2个景点才能优化路线"
                 
                 # 使用TSP算法优化顺序（基于直线距离）
-                from ortools.constraint_solver import routing_enums_pb2, pywrapcp
-                
                 # 计算距离矩阵
-                n = len(attractions_data)
-                distance_matrix = [[0] * n for _ in range(n)]
-                
-                for i in range(n):
-                    for j in range(n):
-                        if i != j:
-                            dist = self.map_service.calculate_distance(
-                                (attractions_data[i]['lng'], attractions_data[i]['lat']),
-                                (attractions_data[j]['lng'], attractions_data[j]['lat'])
-                            )
-                            distance_matrix[i][j] = int(dist)
-                
-                # 创建路由模型
-                manager = pywrapcp.RoutingIndexManager(n, 1, 0)
-                routing = pywrapcp.RoutingModel(manager)
-                
-                def distance_callback(from_index, to_index):
-                    from_node = manager.IndexToNode(from_index)
-                    to_node = manager.IndexToNode(to_index)
-                    return distance_matrix[from_node][to_node]
-                
-                transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-                routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-                
-                search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-                search_parameters.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-                search_parameters.time_limit.seconds = 10
+                distance_matrix = haversine_matrix(attractions_data).astype(int)
                 
-                solution = routing.SolveWithParameters(search_parameters)
+                # 同一组景点（不论输入顺序）已优化过时直接复用回路，旋转到本次的起点
+                cache_params = {'solver': 'agent_ortools', 'metric': 'straight'}
+                cached_tour = get_cached_tour(attractions_data, cache_params, closed=True)
+                if cached_tour is not None:
+                    route = cached_tour['order']
+                    objective = path_length(distance_matrix, route + route[:1])
+                else:
+                    # 在求解线程池中求解，不阻塞事件循环；Agent运行被取消时中止求解
+                    route, objective = await get_solver_pool().run(
+                        solve_tsp_ortools,
+                        distance_matrix,
+                        10,
+                        guided_local_search=False,
+                        token=SolveCancelToken()
+                    )
+                    if route:
+                        set_cached_tour(attractions_data, route, cache_params, closed=True)
                 
-                if solution:
+                if route:
                     # 提取优化后的顺序
-                    index = routing.Start(0)
-                    optimal_order = []
-                    route_segments = []
-                    
-                    while not routing.IsEnd(index):
-                        node = manager.IndexToNode(index)
-                        optimal_order.append(attractions_data[node]['name'])
-                        
-                        next_index = solution.Value(routing.NextVar(index))
-                        if not routing.IsEnd(next_index):
-                            next_node = manager.IndexToNode(next_index)
-                            segment_distance = distance_matrix[node][next_node] / 1000  # 转为公里
-                            route_segments.append({
-                                "从": attractions_data[node]['name'],
-                                "到": attractions_data[next_node]['name'],
-                                "直线距离": f"{segment_distance:.1f}km"
-                            })
-                        
-                        index = next_index
+                    optimal_order = [attractions_data[node]['name'] for node in route]
+                    route_segments = [
+                        {
+                            "从": attractions_data[node]['name'],
+                            "到": attractions_data[next_node]['name'],
+                            "直线距离": f"{distance_matrix[node][next_node] / 1000:.1f}km"  # 转为公里
+                        }
+                        for node, next_node in zip(route, route[1:])
+                    ]
                     
-                    import json
-                    return json.dumps({
+                    return encode_observation({
                         "优化后顺序": optimal_order,
                         "相邻景点间距离": route_segments,
-                        "总直线距离": f"{solution.ObjectiveValue()/1000:.1f}公里",
+                        "总直线距离": f"{objective/1000:.1f}公里",
                         "提示": "请使用 calculate_route 工具为每个路段规划具体交通方式"
-                    }, ensure_ascii=False, indent=2)
+                    })
                 else:
-                    return "TSP优化失败，请检查景点数据"
+                    raise ToolException("TSP优化失败，请检查景点数据")
                 
+            except ToolException:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return f"优化路线失败: {str(e)}"
+                raise ToolException(f"优化路线失败: {str(e)}") from e
         
         # 工具4：获取城市信息
         async def get_city_info_tool(city: str) -> str:
@@ -458,16 +644,17 @@ class TravelPlannerAgent:
                     city=city, keyword="景点", limit=10
                 )
                 
-                import json
-                return json.dumps({
+                return encode_observation({
                     "城市": city,
                     "热门景点数量": len(results),
                     "推荐游玩天数": "3-5天" if len(results) > 15 else "2-3天",
                     "部分热门景点": [r['name'] for r in results[:5]]
-                }, ensure_ascii=False, indent=2)
+                })
                 
+            except ToolException:
+                raise
             except Exception as e:
-                return f"获取城市信息失败: {str(e)}"
+                raise ToolException(f"获取城市信息失败: {str(e)}") from e
         
         # 工具5：搜索住宿
         async def search_hotels_tool(city: str, location: str = "市中心", price_range: str = "经济型", limit: int = 5) -> str:
@@ -496,9 +683,8 @@ class TravelPlannerAgent:
                     return f"未找到{city}{location}的酒店"
                 
                 hotels_info = []
-                for idx, hotel in enumerate(results[:limit], 1):
+                for hotel in results[:limit]:
                     info = {
-                        "序号": idx,
                         "名称": hotel['name'],
                         "地址": hotel.get('address', '未知'),
                         "价格": hotel.get('cost', '未知'),
@@ -506,11 +692,12 @@ class TravelPlannerAgent:
                     }
                     hotels_info.append(info)
                 
-                import json
-                return json.dumps(hotels_info, ensure_ascii=False, indent=2)
+                return encode_observation(hotels_info)
                 
+            except ToolException:
+                raise
             except Exception as e:
-                return f"搜索酒店失败: {str(e)}"
+                raise ToolException(f"搜索酒店失败: {str(e)}") from e
         
         # 工具6：批量获取天气预报（并行查询，速度快3倍）
         async def get_multi_weather_tool(cities: List[str]) -> str:
@@ -567,15 +754,16 @@ class TravelPlannerAgent:
                         all_weather[city] = {"错误": str(weather_data)}
                 
                 if not all_weather:
-                    return "所有城市的天气信息都获取失败"
+                    raise ToolException("所有城市的天气信息都获取失败")
                 
-                import json
-                return json.dumps(all_weather, ensure_ascii=False, indent=2)
+                return encode_observation(all_weather)
                 
+            except ToolException:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return f"批量获取天气失败: {str(e)}"
+                raise ToolException(f"批量获取天气失败: {str(e)}") from e
         
         # 工具6B：单个城市天气查询（兼容旧用法）
         async def get_weather_tool(city: str) -> str:
@@ -591,7 +779,7 @@ class TravelPlannerAgent:
                 weather = await self.map_service.get_weather(city)
                 
                 if not weather:
-                    return f"无法获取{city}的天气信息"
+                    raise ToolException(f"无法获取{city}的天气信息")
                 
                 forecasts = weather.get('forecasts', [])[:3]
                 weather_info = {
@@ -608,11 +796,12 @@ class TravelPlannerAgent:
                     ]
                 }
                 
-                import json
-                return json.dumps(weather_info, ensure_ascii=False, indent=2)
+                return encode_observation(weather_info)
                 
+            except ToolException:
+                raise
             except Exception as e:
-                return f"获取天气失败: {str(e)}"
+                raise ToolException(f"获取天气失败: {str(e)}") from e
         
         # 工具7：搜索美食
         async def search_food_tool(city: str, cuisine: str = "美食", limit: int = 5) -> str:
@@ -640,9 +829,8 @@ class TravelPlannerAgent:
                     return f"未找到{city}的{cuisine}"
                 
                 food_info = []
-                for idx, restaurant in enumerate(results[:limit], 1):
+                for restaurant in results[:limit]:
                     info = {
-                        "序号": idx,
                         "名称": restaurant['name'],
                         "地址": restaurant.get('address', '未知'),
                         "评分": restaurant.get('rating', 0),
@@ -651,11 +839,12 @@ class TravelPlannerAgent:
                     }
                     food_info.append(info)
                 
-                import json
-                return json.dumps(food_info, ensure_ascii=False, indent=2)
+                return encode_observation(food_info)
                 
+            except ToolException:
+                raise
             except Exception as e:
-                return f"搜索美食失败: {str(e)}"
+                raise ToolException(f"搜索美食失败: {str(e)}") from e
         
         # 包装工具以处理JSON字符串输入（ReAct模式需要）
         import json as json_module
@@ -665,8 +854,10 @@ class TravelPlannerAgent:
             try:
                 params = json_module.loads(tool_input) if isinstance(tool_input, str) else tool_input
                 return await search_attractions_tool(**params)
+            except ToolException:
+                raise
             except Exception as e:
-                return f"参数解析错误: {str(e)}, 输入: {tool_input}"
+                raise ToolException(f"参数解析错误: {str(e)}, 输入: {tool_input}") from e
         
         async def wrapped_calculate_route(tool_input: str) -> str:
             """包装路线计算工具"""
@@ -676,18 +867,28 @@ class TravelPlannerAgent:
                 if 'mode' not in params:
                     params['mode'] = 'auto'
                 return await calculate_route_tool(**params)
+            except ToolException:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return f"参数解析错误: {str(e)}, 输入: {tool_input}"
+                raise ToolException(f"参数解析错误: {str(e)}, 输入: {tool_input}") from e
         
         async def wrapped_optimize_route(tool_input: str) -> str:
             """包装路线优化工具"""
             try:
                 params = json_module.loads(tool_input) if isinstance(tool_input, str) else tool_input
                 return await optimize_route_tool(**params)
+            except ToolException:
+                raise
             except Exception as e:
-                return f"参数解析错误: {str(e)}"
+                raise ToolException(f"参数解析错误: {str(e)}") from e
+        
+        async def wrapped_get_city_info(tool_input: str) -> str:
+            """包装城市信息工具（输入可以是城市名或JSON）"""
+            params = json_module.loads(tool_input) if isinstance(tool_input, str) and tool_input.startswith('{') else tool_input
+            city = params.get('city', '') if isinstance(params, dict) else params
+            return await get_city_info_tool(city)
         
         async def wrapped_get_weather(tool_input: str) -> str:
             """包装天气工具"""
@@ -695,10 +896,12 @@ class TravelPlannerAgent:
                 params = json_module.loads(tool_input) if isinstance(tool_input, str) else tool_input
                 city = params.get('city', params) if isinstance(params, dict) else params
                 return await get_weather_tool(city)
+            except ToolException:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return f"参数解析错误: {str(e)}, 输入: {tool_input}"
+                raise ToolException(f"参数解析错误: {str(e)}, 输入: {tool_input}") from e
         
         async def wrapped_get_multi_weather(tool_input: str) -> str:
             """包装批量天气工具"""
@@ -709,81 +912,133 @@ class TravelPlannerAgent:
                 if isinstance(cities, str):
                     cities = [cities]
                 return await get_multi_weather_tool(cities)
+            except ToolException:
+                raise
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                return f"参数解析错误: {str(e)}, 输入: {tool_input}"
+                raise ToolException(f"参数解析错误: {str(e)}, 输入: {tool_input}") from e
         
         async def wrapped_search_hotels(tool_input: str) -> str:
             """包装酒店搜索工具"""
             try:
                 params = json_module.loads(tool_input) if isinstance(tool_input, str) else tool_input
                 return await search_hotels_tool(**params)
+            except ToolException:
+                raise
             except Exception as e:
-                return f"参数解析错误: {str(e)}"
+                raise ToolException(f"参数解析错误: {str(e)}") from e
         
         async def wrapped_search_food(tool_input: str) -> str:
             """包装美食搜索工具"""
             try:
                 params = json_module.loads(tool_input) if isinstance(tool_input, str) else tool_input
                 return await search_food_tool(**params)
+            except ToolException:
+                raise
             except Exception as e:
-                return f"参数解析错误: {str(e)}"
+                raise ToolException(f"参数解析错误: {str(e)}") from e
         
-        # 返回工具列表（使用简单的Tool类，适配ReAct模式）
-        return [
-            Tool(
-                name="search_attractions",
-                func=wrapped_search_attractions,
-                description='搜索景点。输入JSON，例：{{"city": "北京", "keyword": "故宫", "limit": 5}}',
-                coroutine=wrapped_search_attractions
-            ),
-            Tool(
-                name="calculate_route",
-                func=wrapped_calculate_route,
-                description='计算路线，支持同城和跨城。输入JSON，例：同城{{"origin": "芙蓉街", "destination": "大明湖", "city": "济南", "mode": "auto"}}，跨城{{"origin": "济南", "destination": "青岛", "mode": "transit"}}。mode可选：auto/walking/driving/transit/bicycling。',
-                coroutine=wrapped_calculate_route
-            ),
-            Tool(
-                name="optimize_route",
-                func=wrapped_optimize_route,
-                description='优化景点顺序（TSP算法）。输入JSON，例：{{"attractions": ["景点A", "景点B"], "city": "济南"}}。只返回优化顺序，需再用calculate_route规划交通。',
-                coroutine=wrapped_optimize_route
-            ),
-            Tool(
-                name="get_city_info",
-                func=lambda city: get_city_info_tool(city),
-                description="获取城市信息。输入：城市名称字符串",
-                coroutine=get_city_info_tool
-            ),
-            Tool(
-                name="search_hotels",
-                func=wrapped_search_hotels,
-                description='搜索住宿。输入JSON，例：{{"city": "济南", "location": "市中心", "price_range": "经济型", "limit": 3}}',
-                coroutine=wrapped_search_hotels
-            ),
-            Tool(
-                name="get_weather",
-                func=wrapped_get_weather,
-                description='获取单个城市天气。输入JSON，例：{{"city": "济南"}}',
-                coroutine=wrapped_get_weather
-            ),
-            Tool(
-                name="get_multi_weather",
-                func=wrapped_get_multi_weather,
-                description='批量获取多城市天气（并行查询，推荐）。输入JSON，例：{{"cities": ["济南", "青岛", "淄博"]}}。速度快3倍。',
-                coroutine=wrapped_get_multi_weather
-            ),
-            Tool(
-                name="search_food",
-                func=wrapped_search_food,
-                description='搜索美食。输入JSON，例：{{"city": "济南", "cuisine": "鲁菜", "limit": 3}}',
-                coroutine=wrapped_search_food
-            )
-        ]
+        if structured:
+            # 原生工具调用：参数结构由模型按schema生成，无需解析JSON字符串
+            tools = [
+                StructuredTool.from_function(
+                    coroutine=search_attractions_tool, name="search_attractions",
+                    description="搜索景点", args_schema=SearchAttractionInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=calculate_route_tool, name="calculate_route",
+                    description="计算路线，支持同城和跨城（跨城时origin/destination填城市名）", args_schema=CalculateRouteInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=optimize_route_tool, name="optimize_route",
+                    description="优化景点顺序（TSP算法）。只返回优化顺序，需再用calculate_route规划交通", args_schema=OptimizeRouteInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=get_city_info_tool, name="get_city_info",
+                    description="获取城市信息", args_schema=GetCityInfoInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=search_hotels_tool, name="search_hotels",
+                    description="搜索住宿", args_schema=SearchHotelsInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=get_weather_tool, name="get_weather",
+                    description="获取单个城市天气", args_schema=GetWeatherInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=get_multi_weather_tool, name="get_multi_weather",
+                    description="批量获取多城市天气（并行查询，推荐）", args_schema=GetMultiWeatherInput
+                ),
+                StructuredTool.from_function(
+                    coroutine=search_food_tool, name="search_food",
+                    description="搜索美食", args_schema=SearchFoodInput
+                )
+            ]
+        else:
+            # 工具列表（使用简单的Tool类，适配ReAct模式）
+            tools = [
+                Tool(
+                    name="search_attractions",
+                    func=wrapped_search_attractions,
+                    description='搜索景点。输入JSON，例：{{"city": "北京", "keyword": "故宫", "limit": 5}}',
+                    coroutine=wrapped_search_attractions
+                ),
+                Tool(
+                    name="calculate_route",
+                    func=wrapped_calculate_route,
+                    description='计算路线，支持同城和跨城。输入JSON，例：同城{{"origin": "芙蓉街", "destination": "大明湖", "city": "济南", "mode": "auto"}}，跨城{{"origin": "济南", "destination": "青岛", "mode": "transit"}}。mode可选：auto/walking/driving/transit/bicycling。',
+                    coroutine=wrapped_calculate_route
+                ),
+                Tool(
+                    name="optimize_route",
+                    func=wrapped_optimize_route,
+                    description='优化景点顺序（TSP算法）。输入JSON，例：{{"attractions": ["景点A", "景点B"], "city": "济南"}}。只返回优化顺序，需再用calculate_route规划交通。',
+                    coroutine=wrapped_optimize_route
+                ),
+                Tool(
+                    name="get_city_info",
+                    func=wrapped_get_city_info,
+                    description="获取城市信息。输入：城市名称字符串",
+                    coroutine=wrapped_get_city_info
+                ),
+                Tool(
+                    name="search_hotels",
+                    func=wrapped_search_hotels,
+                    description='搜索住宿。输入JSON，例：{{"city": "济南", "location": "市中心", "price_range": "经济型", "limit": 3}}',
+                    coroutine=wrapped_search_hotels
+                ),
+                Tool(
+                    name="get_weather",
+                    func=wrapped_get_weather,
+                    description='获取单个城市天气。输入JSON，例：{{"city": "济南"}}',
+                    coroutine=wrapped_get_weather
+                ),
+                Tool(
+                    name="get_multi_weather",
+                    func=wrapped_get_multi_weather,
+                    description='批量获取多城市天气（并行查询，推荐）。输入JSON，例：{{"cities": ["济南", "青岛", "淄博"]}}。速度快3倍。',
+                    coroutine=wrapped_get_multi_weather
+                ),
+                Tool(
+                    name="search_food",
+                    func=wrapped_search_food,
+                    description='搜索美食。输入JSON，例：{{"city": "济南", "cuisine": "鲁菜", "limit": 3}}',
+                    coroutine=wrapped_search_food
+                )
+            ]
+        
+        # 中间件：规范化参数、同一次运行内的重复调用直接返回已有结果、限制工具调用次数
+        # 工具以ToolException表示失败，失败信息作为observation返回给AI
+        for tool in tools:
+            tool.coroutine = guard_tool(tool.name, tool.coroutine, keyword_args=structured)
+            tool.handle_tool_error = True
+        return tools
     
     def _create_agent(self) -> AgentExecutor:
-        """创建Agent执行器（使用ReAct模式）"""
+        """创建Agent执行器（按 AGENT_MODE 使用ReAct或原生工具调用）"""
+        if self.mode == 'tool_calling':
+            return self._create_tool_calling_agent()
         
         # ReAct风格的提示词模板
         template = """你是专业旅行规划助手，拥有强大的工具，能基于真实数据规划行程。
@@ -803,141 +1058,7 @@ Observation: 工具返回的结果
 Thought: 我现在知道最终答案了
 Final Answer: 给用户的最终回复
 
-💡 **高效工作流程**（必须严格遵守，避免超时）：
-
-🚨 **关键原则：工具调用要少而精，避免重复搜索！**
-
-1️⃣ 查询天气（1次）：
-   ✅ 必须使用 get_multi_weather 批量查询所有城市
-      示例: get_multi_weather({{"cities": ["济南", "青岛", "淄博"]}})
-   ❌ 禁止：多次调用get_weather单独查询
-   
-2️⃣ 搜索景点（每城市最多1次）：
-   ⚠️ **景点数量严格控制**：
-   - 单城市3天：搜索1次，取6-9个景点即可（每天2-3个）
-   - 多城市行程：每个城市搜索1次，按天数分配
-   - **禁止重复搜索**：不要用不同关键词反复搜索同一城市
-   
-   ⚠️ **地理位置严格要求**（最重要！）：
-   - 🎯 **观察坐标选景点**：必须看搜索结果的经纬度，选择坐标接近的（经度或纬度相差<0.05度）
-   - 🚫 **绝对禁止偏远景点**：
-     * 济南市区：117.0±0.05, 36.66±0.05（趵突泉、大明湖、千佛山区域）
-     * 淄博周村：117.84±0.03, 36.80±0.03（周村古商城附近）
-     * 青岛市南区：120.32±0.05, 36.06±0.05（栈桥、八大关区域）
-   - ❌ **必须过滤掉**：
-     * 友谊葫芦、万德文化中心（远郊，距市区50km+）
-     * 热带鱼林（不知名小景点）
-     * 绿野仙踪文化（远郊）
-   - ✅ **只选热门核心景点**：评分4.5+，且在市区核心区域
-   
-   ⚠️ **多城市行程规划**：
-   - 城市之间要有明确的先后顺序，不要来回跑
-   - 例如：济南2天→淄博2天→青岛3天（顺序游玩）
-   - **禁止**：济南→青岛→济南→淄博（来回跑）
-   
-3️⃣ 优化顺序（可选）：
-   - 只有当同城景点≥3个时才使用optimize_route
-   - 跨城市的景点绝对不要一起优化
-   
-4️⃣ 规划交通（仅关键路段）：
-   - 跨城市：必须规划1次（如济南→淄博）
-   - 同城：距离>10km时规划
-   - **禁止**：为每个相邻景点都计算路线（浪费工具调用）
-   
-5️⃣ 搜索配套（每城市各1次）：
-   - search_hotels：每城市1次
-   - search_food：每城市1次
-   - **禁止重复搜索**
-
-🎯 **工具调用预算**（超过就会超时）：
-- 3天单城市：≤12次工具调用
-- 5天双城市：≤18次工具调用  
-- 7天三城市：≤25次工具调用
-
-🚗 **交通方式选择建议**：
-- <2km: walking（步行，0元）
-- 2-10km: transit（公交/地铁，2-5元）或 bicycling（骑行，0元）
-- 10-50km: driving（出租车，约30-130元）或 transit（地铁，约5元）
-- >50km跨城: transit（高铁），费用约0.45元/km，耗时约150km/h
-  例：济南→青岛300km，高铁约135元，2小时
-
-💰 **预算分配标准**（根据总预算合理分配）：
-假设总预算B元，游玩D天，N个城市：
-- 交通费：B × (0.35-0.45)，跨城市多则占比高
-  * 同城游：B × 0.25（主要是市内交通）
-  * 2-3城市：B × 0.35（含1-2次城际高铁）
-  * 4+城市：B × 0.45（多次城际高铁）
-- 住宿费：B × 0.30-0.35，约 B/(D×3) 元/晚
-  * 预算紧张：150-200元/晚（经济型连锁酒店）
-  * 预算宽裕：250-350元/晚（中档酒店）
-- 餐饮费：B × 0.20-0.25，约 B/(D×15) 元/餐
-  * 早餐：15-25元（快餐/小吃）
-  * 午餐：30-50元（特色美食）
-  * 晚餐：40-70元（正餐）
-- 门票费：B × 0.10-0.15
-  * 优先选择免费景点（公园、广场、古城）
-  * 控制付费景点数量（每天1-2个）
-- 应急备用：B × 0.05（用于意外支出）
-
-💡 **预算优化技巧**：
-- 预算紧张时：多选免费景点、住青旅/经济连锁、多吃小吃/快餐、市内多用公交
-- 预算充裕时：可选高评分景点、住中档酒店、尝试特色餐厅、适当打车
-
-⚠️ **景点规划要求**（最重要，必须严格遵守！）：
-
-🎯 **核心原则**：只选市区核心景点，绝不选偏远景点！
-
-1. **景点数量**：每天2-3个景点（严格上限）
-2. **地理位置**：必须观察坐标，选择经纬度接近的景点（相差<0.05度）
-3. **距离控制**：景点间直线距离<3km，绝不超过5km
-4. **评分要求**：优先4.5+评分，过滤0分或低分景点
-5. **必须过滤掉的偏远景点**：
-   - ❌ 友谊葫芦非遗文化产业园（117.536075, 36.622176）距市区46km
-   - ❌ 万德文化中心（116.920241, 36.33788）距市区63km
-   - ❌ 热带鱼林高端水族文化馆（117.156335, 37.299244）距市区72km
-   - ❌ 玄霆司民俗文创体验馆（117.857969, 36.814306）0分小景点
-   - ❌ 绿野仙踪文化（120.422658, 36.098227）远郊景点
-6. **只选核心景区**：
-   - ✅ 济南：趵突泉(117.015893, 36.661087)、大明湖、千佛山、芙蓉街
-   - ✅ 淄博：周村古商城(117.841013, 36.798378)及其内部景点
-   - ✅ 青岛：栈桥(120.320444, 36.058475)、八大关、信号山、德国建筑群
-
-⚠️ **时间规划标准**（必须严格遵守）：
-- 🌅 上午第1个景点：start_time="09:00", duration_hours=2.5
-- 🍜 午餐时间：12:00-13:30（不在景点列表中）
-- ☀️ 下午第2个景点：start_time="13:30", duration_hours=2.5
-- 🍽️ 晚餐时间：18:00-19:30（不在景点列表中）
-- 🌙 晚上第3个景点（可选）：start_time="19:30", duration_hours=1.5
-
-**重要**：
-- 每个景点必须有不同的start_time，不能都是09:00
-- duration_hours根据景点类型：大景区2.5-3小时，小景点1.5-2小时
-
-⚠️ **输出要求**：
-Final Answer必须包含两部分：
-1. 详细的行程规划文本（包含每天的时间表）
-2. JSON格式的结构化数据（在文本末尾）
-
-JSON格式示例（必须严格遵守）：
-```json
-{{
-  "destination": "目的地城市",
-  "days": 天数,
-  "daily_schedule": [
-    {{
-      "day": 1,
-      "city": "当天所在城市",
-      "theme": "当天主题（如：泉城文化游）",
-      "attractions": [
-        {{"name": "景点名", "address": "地址", "lng": 经度, "lat": 纬度, "cost": 门票, "rating": 评分, "start_time": "09:00", "duration_hours": 2}}
-      ],
-      "hotel": {{"name": "酒店名", "address": "地址", "lng": 经度, "lat": 纬度, "price_per_night": 价格}},
-      "transportation": [{{"from_location": "起点", "to_location": "终点", "type": "交通方式", "cost": 费用, "distance": "距离", "duration": "时长"}}]
-    }}
-  ],
-  "cost_breakdown": {{"transportation": 交通费, "accommodation": 住宿费, "food": 餐饮费, "tickets": 门票费, "total": 总计}}
-}}
-```
+""" + _PLANNING_GUIDE + """
 
 现在开始！
 
@@ -953,8 +1074,32 @@ Thought:{agent_scratchpad}"""
             prompt=prompt
         )
         
-        # 创建执行器
-        agent_executor = AgentExecutor(
+        return self._build_executor(agent)
+    
+    def _create_tool_calling_agent(self) -> AgentExecutor:
+        """
+        创建原生工具调用Agent：模型一轮可返回多个工具调用，执行器用asyncio.gather并行执行，
+        不需要解析 Action Input 文本（多城市的天气、景点、住宿、美食可在一两轮内取回）
+        """
+        system_prompt = """你是专业旅行规划助手，拥有强大的工具，能基于真实数据规划行程。
+
+🚀 **并行调用**：同一轮可以同时发起多个互不依赖的工具调用（如所有城市的天气、每个城市的景点/住宿/美食），它们会并行执行；
+有依赖的调用（如先搜索景点、再优化顺序和规划交通）放到下一轮。尽量在1-2轮内取回所需数据。
+
+""" + _PLANNING_GUIDE
+        
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
+            ("human", "{input}"),
+            MessagesPlaceholder("agent_scratchpad")
+        ])
+        
+        agent = create_tool_calling_agent(self.llm, self.tools, prompt)
+        return self._build_executor(agent)
+    
+    def _build_executor(self, agent) -> AgentExecutor:
+        """创建执行器"""
+        return AgentExecutor(
             agent=agent,
             tools=self.tools,
             verbose=True,
@@ -964,48 +1109,66 @@ Thought:{agent_scratchpad}"""
             handle_parsing_errors=True
             # 不设置early_stopping_method，让Agent自然完成
         )
-        
-        return agent_executor
     
-    async def chat(self, user_input: str) -> Dict[str, Any]:
+    def _run_executor(self, user_input: str) -> AgentExecutor:
+        """本次运行的执行器：浅拷贝共享执行器并设置迭代上限（LLM、工具、提示词仍共享，共享执行器不被修改）"""
+        return self.agent.model_copy(update={'max_iterations': self._estimate_max_iterations(user_input)})
+    
+    @staticmethod
+    def _with_callback(config: Optional[Dict], callback: AsyncCallbackHandler) -> Dict:
+        """在本次运行的调用配置中加入回调"""
+        config = dict(config or {})
+        config['callbacks'] = list(config.get('callbacks') or []) + [callback]
+        return config
+    
+    @staticmethod
+    def _record_history(history: Optional[List], user_input: str, output: str):
+        """更新会话的对话历史（仅用于记录，保留最近10条）"""
+        if history is None:
+            return
+        history.append(HumanMessage(content=user_input))
+        history.append(AIMessage(content=output))
+        del history[:-10]
+    
+    async def chat(
+        self,
+        user_input: str,
+        history: Optional[List] = None,
+        config: Optional[Dict] = None
+    ) -> Dict[str, Any]:
         """
         与Agent对话
         
         Args:
             user_input: 用户输入
+            history: 会话的对话历史（就地更新）
+            config: 本次运行的调用配置（metadata、tags等）
             
         Returns:
             包含回复和中间步骤的字典
         """
         try:
-            # 动态计算max_iterations
-            max_iterations = self._estimate_max_iterations(user_input)
-            
-            # 临时调整Agent的max_iterations
-            original_max_iterations = self.agent.max_iterations
-            self.agent.max_iterations = max_iterations
+            # 按任务复杂度设置本次运行的max_iterations和工具调用预算
+            executor = self._run_executor(user_input)
+            tool_run = start_tool_run(self._tool_budget(user_input))
+            token_usage = TokenUsageCallback()
             
             # 执行Agent（ReAct不需要chat_history）
-            result = await self.agent.ainvoke({
+            result = await executor.ainvoke({
                 "input": user_input
-            })
-            
-            # 恢复原始设置
-            self.agent.max_iterations = original_max_iterations
+            }, config=self._with_callback(config, token_usage))
             
-            # 更新对话历史（仅用于记录）
-            self.chat_history.append(HumanMessage(content=user_input))
-            self.chat_history.append(AIMessage(content=result['output']))
-            
-            # 限制历史长度
-            if len(self.chat_history) > 10:
-                self.chat_history = self.chat_history[-10:]
+            self._record_history(history, user_input, result['output'])
+            print(f"[Agent] 工具调用统计: {tool_run.get_stats()}")
+            print(f"[Agent] token用量: {token_usage.get_report()}")
             
             # 返回结果
             return {
                 "reply": result['output'],
                 "intermediate_steps": result.get('intermediate_steps', []),
-                "tool_calls": self._format_tool_calls(result.get('intermediate_steps', []))
+                "tool_calls": self._format_tool_calls(result.get('intermediate_steps', [])),
+                "tool_usage": tool_run.get_stats(),
+                "token_usage": token_usage.get_report()
             }
             
         except Exception as e:
@@ -1017,6 +1180,34 @@ Thought:{agent_scratchpad}"""
                 "tool_calls": []
             }
     
+    # 已知城市名（长名优先，避免"石家庄"只匹配到更短的名字）
+    _CITY_PATTERN = re.compile('|'.join(sorted(map(re.escape, SUPPORTED_CITIES), key=len, reverse=True)))
+
+    @classmethod
+    def _analyze_task(cls, user_input: str) -> Tuple[int, int]:
+        """从用户输入中提取城市数量（按已知城市名匹配，未识别到时按1个城市）和天数"""
+        cities = cls._CITY_PATTERN.findall(user_input)
+        city_count = len(set(cities)) or 1
+        
+        # 提取天数
+        days_match = re.search(r'(\d+)\s*天', user_input)
+        days = int(days_match.group(1)) if days_match else 3
+        
+        return city_count, days
+    
+    def _tool_budget(self, user_input: str) -> int:
+        """
+        本次运行的工具调用预算（硬上限，略高于提示词中的建议次数）
+        
+        3天单城市约14次、5天双城市约22次、7天三城市约30次
+        """
+        city_count, days = self._analyze_task(user_input)
+        budget = (settings.AGENT_TOOL_BUDGET_BASE
+                  + city_count * settings.AGENT_TOOL_BUDGET_PER_CITY
+                  + days * settings.AGENT_TOOL_BUDGET_PER_DAY)
+        print(f"[Agent] 工具调用预算: {budget}次")
+        return budget
+    
     def _estimate_max_iterations(self, user_input: str) -> int:
         """
         根据用户输入估算所需的max_iterations
@@ -1027,18 +1218,10 @@ Thought:{agent_scratchpad}"""
         Returns:
             建议的max_iterations值
         """
-        import re
-        
         # 基础迭代次数（约5次工具调用）
         base_iterations = 10
         
-        # 提取城市数量（常见关键词：去、到、游、玩）
-        cities = re.findall(r'([北上广深成都杭州西安南京武汉重庆天津青岛大连厦门苏州长沙郑州济南哈尔滨沈阳昆明贵阳南昌福州石家庄太原兰州银川西宁乌鲁木齐拉萨呼和浩特南宁海口香港澳门台北高雄等][\u4e00-\u9fa5]{0,3}?(?:市|地区)?)', user_input)
-        city_count = len(set(cities)) if cities else 1
-        
-        # 提取天数
-        days_match = re.search(r'(\d+)\s*天', user_input)
-        days = int(days_match.group(1)) if days_match else 3
+        city_count, days = self._analyze_task(user_input)
         
         # 计算公式：基础 + 城市数*8 + 天数*3（优化后每天景点少，工具调用减少）
         estimated_tools = base_iterations + city_count * 8 + days * 3
@@ -1062,12 +1245,19 @@ Thought:{agent_scratchpad}"""
         
         return max_iterations
     
-    async def chat_stream(self, user_input: str):
+    async def chat_stream(
+        self,
+        user_input: str,
+        history: Optional[List] = None,
+        config: Optional[Dict] = None
+    ):
         """
         与Agent流式对话（实时显示工具调用过程）
         
         Args:
             user_input: 用户输入
+            history: 会话的对话历史（就地更新）
+            config: 本次运行的调用配置（metadata、tags等）
             
         Yields:
             流式事件（工具调用、思考过程、最终回复）
@@ -1084,80 +1274,48 @@ Thought:{agent_scratchpad}"""
                 "content": "🤖 Agent开始执行..."
             }
             
-            # 动态计算max_iterations
-            max_iterations = self._estimate_max_iterations(user_input)
-            
-            # 临时调整Agent的max_iterations
-            original_max_iterations = self.agent.max_iterations
-            print(f"[Agent] 原始max_iterations: {original_max_iterations}")
-            self.agent.max_iterations = max_iterations
-            print(f"[Agent] 动态调整后max_iterations: {self.agent.max_iterations}")
-            print(f"[Agent] 超时时间: {self.agent.max_execution_time}秒")
+            # 按任务复杂度设置本次运行的max_iterations和工具调用预算
+            executor = self._run_executor(user_input)
+            max_iterations = executor.max_iterations
+            tool_run = start_tool_run(self._tool_budget(user_input))
+            token_usage = TokenUsageCallback()
+            print(f"[Agent] 超时时间: {executor.max_execution_time}秒")
             
-            # 执行Agent（ReAct不需要chat_history）
-            import time
+            # 执行Agent（ReAct不需要chat_history），按Agent的事件流实时转发工具调用和LLM输出
             start_time = time.time()
-            
-            result = await self.agent.ainvoke({
-                "input": user_input
-            })
+            result = {}
+            streamed = False
+            async for event in self._stream_run(executor, user_input, self._with_callback(config, token_usage)):
+                if event['type'] == 'result':
+                    result = event['data']
+                    continue
+                if event['type'] == 'llm_stream_reset':
+                    streamed = False
+                streamed = streamed or event['type'] == 'llm_stream'
+                yield event
             
             execution_time = time.time() - start_time
             
-            # 恢复原始设置
-            self.agent.max_iterations = original_max_iterations
-            
             print(f"[Agent Stream] Agent执行完成")
             print(f"[Agent Stream] 实际执行时间: {execution_time:.1f}秒")
             print(f"[Agent Stream] 超时限制: {settings.AI_TIMEOUT}秒")
             print(f"[Agent Stream] 使用的max_iterations: {max_iterations}")
             
-            # 显示工具调用记录
             intermediate_steps = result.get('intermediate_steps', [])
             print(f"[Agent Stream] 实际工具调用次数: {len(intermediate_steps)}")
-            print(f"[Agent Stream] 预估需要: {len(intermediate_steps) * 2}次迭代（实际可能更多）")
-            if settings.DEBUG_AGENT:
-                print(f"[Agent Stream] 中间步骤数量: {len(intermediate_steps)}")
-            
             if len(intermediate_steps) == 0:
                 if settings.DEBUG_AGENT:
                     print("[Agent Stream] ⚠️ 警告：没有调用任何工具！")
                     print(f"[Agent Stream] 原始输出: {result.get('output', '')[:200]}")
             
-            for step in intermediate_steps:
-                if len(step) >= 2:
-                    action, observation = step[0], step[1]
-                    tool_name = action.tool
-                    tool_input = action.tool_input
-                    
-                    if settings.DEBUG_TOOLS:
-                        print(f"[工具调用] {tool_name} - 输入: {tool_input}")
-                    
-                    # 工具调用开始
-                    yield {
-                        "type": "tool_start",
-                        "tool": tool_name,
-                        "input": tool_input,
-                        "content": f"🔧 调用工具：{tool_name}"
-                    }
-                    
-                    # 短暂延迟，让前端能看清
-                    await asyncio.sleep(0.1)
-                    
-                    # 工具调用完成
-                    output_preview = str(observation)[:200] + '...' if len(str(observation)) > 200 else str(observation)
-                    yield {
-                        "type": "tool_end",
-                        "tool": tool_name,
-                        "output": output_preview,
-                        "content": f"✅ {tool_name} 完成"
-                    }
-                    
-                    await asyncio.sleep(0.1)
-            
-            # 最终回复（分段发送，模拟流式）
+            # 最终回复：正常结束时已随LLM输出流式发送；提前停止（迭代/时间上限）时输出来自执行器，在此一次发送
             final_output = result.get('output', '')
             print(f"[Agent Stream] 最终输出长度: {len(final_output)}")
+            if not streamed and final_output:
+                yield {
+                    "type": "llm_stream",
+                    "content": final_output
+                }
             
             # 检查是否因为迭代限制而停止
             if "Agent stopped" in final_output or len(final_output) < 100:
@@ -1172,15 +1330,6 @@ Thought:{agent_scratchpad}"""
             else:
                 print(f"[Agent Stream] 未能构建行程JSON")
             
-            # 分段发送文本（每50个字符）
-            for i in range(0, len(final_output), 50):
-                chunk = final_output[i:i+50]
-                yield {
-                    "type": "llm_stream",
-                    "content": chunk
-                }
-                await asyncio.sleep(0.05)
-            
             # 如果提取到了JSON，发送itinerary事件
             if itinerary_json:
                 yield {
@@ -1188,17 +1337,16 @@ Thought:{agent_scratchpad}"""
                     "data": itinerary_json
                 }
             
-            # 更新对话历史（仅用于记录）
-            self.chat_history.append(HumanMessage(content=user_input))
-            self.chat_history.append(AIMessage(content=final_output))
-            
-            # 限制历史长度
-            if len(self.chat_history) > 10:
-                self.chat_history = self.chat_history[-10:]
+            self._record_history(history, user_input, final_output)
             
+            tool_usage = tool_run.get_stats()
+            print(f"[Agent Stream] 工具调用统计: {tool_usage}")
+            print(f"[Agent Stream] token用量: {token_usage.get_report()}")
             yield {
                 "type": "done",
-                "content": "✅ 完成"
+                "content": "✅ 完成",
+                "tool_usage": tool_usage,
+                "token_usage": token_usage.get_report()
             }
             
         except Exception as e:
@@ -1210,6 +1358,104 @@ Thought:{agent_scratchpad}"""
                 "content": f"❌ Agent执行失败: {str(e)}"
             }
     
+    async def _stream_run(self, executor: AgentExecutor, user_input: str, config: Optional[Dict]):
+        """
+        执行Agent并把事件流（astream_events）转换为前端事件
+        
+        - ReAct：LLM每轮输出 "Thought ... Action ..."，思考部分完整后作为 thinking 事件发送，
+          "Final Answer:" 之后的内容按token作为 llm_stream 事件发送
+        - 原生工具调用：文本按token作为 llm_stream 事件发送；若该轮随后出现工具调用，
+          已发送的文本是调用前的说明，发送 llm_stream_reset 撤回后改作 thinking 事件发送
+        - 工具开始/结束时发送 tool_start / tool_end（工具输入取自Agent本轮决定的AgentAction）
+        - 执行结束时发送 result 事件（执行器的输出，含 intermediate_steps）
+        """
+        marker = 'Final Answer:'
+        text, thought_sent, answer_sent = '', False, 0
+        planned_inputs = {}
+        
+        async for event in executor.astream_events({"input": user_input}, config=config, version='v2'):
+            kind = event['event']
+            
+            if kind == 'on_chat_model_start':
+                text, thought_sent, answer_sent = '', False, 0
+            
+            elif kind == 'on_chat_model_stream' and self.mode == 'tool_calling':
+                chunk = event['data']['chunk']
+                content = chunk.content or ''
+                text += content
+                if chunk.tool_call_chunks and not thought_sent:
+                    # 本轮调用工具：此前的文本是调用前的说明，不属于最终回复
+                    thought_sent = True
+                    for e in self._retract_preamble(text, answer_sent):
+                        yield e
+                elif content and not thought_sent:
+                    yield {"type": "llm_stream", "content": content}
+                    answer_sent += len(content)
+            
+            elif kind == 'on_chat_model_end' and self.mode == 'tool_calling':
+                message = event['data'].get('output')
+                if getattr(message, 'tool_calls', None):
+                    if not thought_sent:
+                        for e in self._retract_preamble(text, answer_sent):
+                            yield e
+                else:
+                    # 没有工具调用的一轮即最终回复（未流式输出时在此补发）
+                    content = getattr(message, 'content', '') or text
+                    if isinstance(content, str) and len(content) > answer_sent:
+                        yield {"type": "llm_stream", "content": content[answer_sent:]}
+            
+            elif kind == 'on_chat_model_stream':
+                text += event['data']['chunk'].content or ''
+                if not thought_sent and ('Action:' in text or marker in text):
+                    thought_sent = True
+                    thought = text.split('Action:')[0].split(marker)[0].replace('Thought:', '').strip()
+                    if thought:
+                        yield {"type": "thinking", "content": thought}
+                if marker in text:
+                    answer = text.split(marker, 1)[1].lstrip()
+                    if len(answer) > answer_sent:
+                        yield {"type": "llm_stream", "content": answer[answer_sent:]}
+                        answer_sent = len(answer)
+            
+            elif kind == 'on_tool_start' and not event['name'].startswith('_'):
+                planned = planned_inputs.get(event['name'])
+                tool_input = planned.pop(0) if planned else event['data'].get('input')
+                if settings.DEBUG_TOOLS:
+                    print(f"[工具调用] {event['name']} - 输入: {tool_input}")
+                yield {
+                    "type": "tool_start",
+                    "tool": event['name'],
+                    "input": tool_input,
+                    "content": f"🔧 调用工具：{event['name']}"
+                }
+            
+            elif kind == 'on_tool_end' and not event['name'].startswith('_'):
+                observation = str(event['data'].get('output', ''))
+                yield {
+                    "type": "tool_end",
+                    "tool": event['name'],
+                    "output": observation[:200] + '...' if len(observation) > 200 else observation,
+                    "content": f"✅ {event['name']} 完成"
+                }
+            
+            elif kind == 'on_chain_end':
+                output = event['data'].get('output')
+                if not event.get('parent_ids'):
+                    yield {"type": "result", "data": output or {}}
+                for action in (output if isinstance(output, list) else [output]):
+                    if isinstance(action, AgentAction):
+                        planned_inputs.setdefault(action.tool, []).append(action.tool_input)
+    
+    @staticmethod
+    def _retract_preamble(text: str, streamed: int) -> List[Dict[str, Any]]:
+        """工具调用前的说明文本：撤回已作为回复流式发送的部分，改作 thinking 事件"""
+        events = []
+        if streamed:
+            events.append({"type": "llm_stream_reset"})
+        if text.strip():
+            events.append({"type": "thinking", "content": text.strip()})
+        return events
+    
     def _build_itinerary_from_steps(self, intermediate_steps: List, user_input: str) -> Optional[Dict]:
         """
         从工具调用结果构建结构化行程JSON
@@ -1253,24 +1499,13 @@ Thought:{agent_scratchpad}"""
                                         coord_str = item['坐标'].strip('()')
                                         coords = coord_str.split(',')
                                         
-                                        # 提取照片信息
-                                        photos = item.get('照片', [])
-                                        thumbnail = item.get('缩略图', '')
-                                        
-                                        # 确保photos是列表
-                                        if not isinstance(photos, list):
-                                            photos = []
+                                        # 照片只在服务端保存，按名称和坐标展开
+                                        photos, thumbnail = expand_photos(item.get('名称', ''), item['坐标'])
                                         
                                         # 如果有照片但没有缩略图，使用第一张作为缩略图
                                         if photos and not thumbnail:
                                             thumbnail = photos[0]
                                         
-                                        # 根据景点在当天的位置分配时间
-                                        # 简单策略：上午09:00，下午13:30，晚上19:30
-                                        time_slots = ["09:00", "13:30", "19:30"]
-                                        attraction_index = len([a for a in all_attractions if a.get('day') == len(all_attractions) // (days or 1) + 1])
-                                        start_time = time_slots[min(attraction_index, 2)]
-                                        
                                         all_attractions.append({
                                             "name": item.get('名称', ''),
                                             "address": item.get('地址', ''),
@@ -1279,7 +1514,8 @@ Thought:{agent_scratchpad}"""
                                             "cost": 0,
                                             "rating": item.get('评分', 0),
                                             "type": item.get('类型', ''),
-                                            "start_time": start_time,  # 动态分配时间
+                                            "opentime": item.get('营业时间', ''),
+                                            "start_time": "",  # 分天后按路上时间和营业时间排定
                                             "duration_hours": 2.5,
                                             "photos": photos,  # 所有照片URL列表
                                             "thumbnail": thumbnail  # 缩略图URL
@@ -1311,13 +1547,17 @@ Thought:{agent_scratchpad}"""
                 end_idx = start_idx + attractions_per_day if day < days else len(all_attractions)
                 day_attractions = all_attractions[start_idx:end_idx]
                 
-                # 为当天的景点重新分配时间
-                time_slots = ["09:00", "13:30", "19:30"]
+                # 大景区2.5小时，小景点1.5-2小时
                 for idx, attr in enumerate(day_attractions):
-                    attr['start_time'] = time_slots[min(idx, 2)]
-                    # 大景区2.5小时，小景点1.5-2小时
                     attr['duration_hours'] = 2.5 if idx < 2 else 1.5
                 
+                # 按路上时间和营业时间排出开始时间（赶不上营业时间的景点记录下来，交给前端/验证提示）
+                timing = self.route_planner.schedule_day(day_attractions, days=days, city=destination)
+                for attr, start_time in zip(day_attractions, timing['start_times']):
+                    attr['start_time'] = start_time
+                if timing['conflicts']:
+                    print(f"[构建行程JSON] 第{day}天营业时间冲突: {', '.join(timing['conflicts'])}")
+                
                 # 分配酒店
                 hotel_idx = min(day - 1, len(all_hotels) - 1) if all_hotels else 0
                 day_hotel = all_hotels[hotel_idx] if all_hotels and hotel_idx < len(all_hotels) else {
@@ -1368,19 +1608,119 @@ Thought:{agent_scratchpad}"""
                 })
         
         return tool_calls
+
+
+class AgentSession:
+    """Agent会话：共享同一个TravelPlannerAgent，只保存自己的对话历史"""
+    
+    def __init__(self, session_id: str, agent: TravelPlannerAgent):
+        self.session_id = session_id
+        self.agent = agent
+        self.chat_history: List = []
+        self.last_used = time.monotonic()
+        # 同一会话的请求依次执行，保证对话历史的顺序
+        self.lock = asyncio.Lock()
+    
+    def _config(self) -> Dict:
+        """本次运行的调用配置（回调和追踪中可区分会话）"""
+        return {'metadata': {'session_id': self.session_id}, 'tags': [f'session:{self.session_id}']}
+    
+    async def chat(self, user_input: str) -> Dict[str, Any]:
+        async with self.lock:
+            return await self.agent.chat(user_input, self.chat_history, self._config())
+    
+    async def chat_stream(self, user_input: str):
+        async with self.lock:
+            async for event in self.agent.chat_stream(user_input, self.chat_history, self._config()):
+                yield event
     
     def reset_history(self):
         """重置对话历史"""
-        self.chat_history = []
+        self.chat_history.clear()
 
 
-# 全局Agent实例
+class AgentSessionPool:
+    """
+    Agent会话池：按会话ID保存会话，超过空闲时间或数量上限时按LRU淘汰
+    （正在执行的会话不淘汰）
+    """
+    
+    def __init__(self, max_sessions: int, idle_ttl: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions: OrderedDict = OrderedDict()
+        self.created = 0
+        self.evicted = 0
+    
+    def get(self, session_id: Optional[str] = None) -> AgentSession:
+        """获取会话，不存在（或未提供ID）时创建"""
+        self._evict(time.monotonic() - self.idle_ttl)
+        
+        session_id = session_id or uuid.uuid4().hex
+        session = self._sessions.get(session_id)
+        if session is None:
+            session = AgentSession(session_id, get_agent())
+            self._sessions[session_id] = session
+            self.created += 1
+            self._evict(None)
+        
+        self._sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+    
+    def _evict(self, idle_before: Optional[float]):
+        """淘汰最久未使用的空闲会话：idle_before为None时按数量上限淘汰，否则淘汰空闲超时的"""
+        for session_id, session in list(self._sessions.items()):
+            if idle_before is None and len(self._sessions) <= self.max_sessions:
+                break
+            if idle_before is not None and session.last_used > idle_before:
+                break
+            if session.lock.locked():
+                continue
+            del self._sessions[session_id]
+            self.evicted += 1
+    
+    def reset(self, session_id: Optional[str] = None) -> int:
+        """重置指定会话的对话历史；未指定时重置全部会话，返回重置的会话数"""
+        sessions = [self._sessions[session_id]] if session_id in self._sessions else []
+        if session_id is None:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            session.reset_history()
+        return len(sessions)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'sessions': len(self._sessions),
+            'running': sum(1 for session in self._sessions.values() if session.lock.locked()),
+            'max_sessions': self.max_sessions,
+            'idle_ttl': self.idle_ttl,
+            'created': self.created,
+            'evicted': self.evicted
+        }
+
+
+# 全局Agent实例（LLM客户端、工具、提示词在会话间共享）
 _agent_instance = None
+_session_pool: Optional[AgentSessionPool] = None
 
 def get_agent() -> TravelPlannerAgent:
-    """获取Agent单例"""
+    """获取共享的Agent实例"""
     global _agent_instance
     if _agent_instance is None:
         _agent_instance = TravelPlannerAgent()
     return _agent_instance
 
+
+def get_session_pool() -> AgentSessionPool:
+    """获取Agent会话池单例"""
+    global _session_pool
+    if _session_pool is None:
+        _session_pool = AgentSessionPool(settings.AGENT_MAX_SESSIONS, settings.AGENT_SESSION_IDLE_TTL)
+    return _session_pool
+
+
+def get_agent_session(session_id: Optional[str] = None) -> AgentSession:
+    """按会话ID获取Agent会话（未提供ID时创建新会话）"""
+    return get_session_pool().get(session_id)
+
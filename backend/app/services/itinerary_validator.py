@@ -7,6 +7,7 @@ from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 
 from app.core.config import settings
+from app.core.opening_hours import fits_opentime, format_clock, parse_clock, parse_opentime
 
 
 class ItineraryValidator:
@@ -34,6 +35,12 @@ class ItineraryValidator:
             验证结果，包含评分、问题和建议
         """
         
+        # 先做本地时间可行性检查（毫秒级），不可行的行程直接返回，不再调用AI
+        feasibility = self.check_feasibility(itinerary_data)
+        if not feasibility['is_feasible']:
+            print(f"本地检查：行程不可行（{len(feasibility['issues'])}处时间冲突），跳过AI验证")
+            return feasibility
+        
         # 构建验证提示
         prompt = ChatPromptTemplate.from_messages([
             ("system", """你是一位经验丰富的旅行规划专家，负责审核行程的合理性和可行性。
@@ -159,6 +166,60 @@ class ItineraryValidator:
                 "summary": "系统基本检查通过，建议人工审核"
             }
     
+    def check_feasibility(self, itinerary_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        本地时间可行性检查（不调用AI）
+        
+        检查每天的景点：
+        - 游玩时段是否落在营业时间（opentime）内
+        - 是否与前一个景点的游玩时段重叠
+        
+        Args:
+            itinerary_data: 包含daily_schedule的行程数据
+            
+        Returns:
+            与 validate_itinerary 相同格式的结果，is_feasible 为False时 issues 列出所有冲突
+        """
+        issues = []
+        
+        for day in itinerary_data.get('daily_schedule', []):
+            day_num = day.get('day', 0)
+            previous_end, previous_name = None, None
+            for attr in day.get('attractions', []):
+                name = attr.get('name', '未知景点')
+                start = parse_clock(attr.get('start_time'))
+                if start is None:
+                    continue
+                duration = float(attr.get('duration_hours') or 0) * 3600
+                
+                opentime = attr.get('opentime')
+                if not fits_opentime(parse_opentime(opentime), start, duration):
+                    issues.append({
+                        "severity": "error",
+                        "issue": f"第{day_num}天{name}安排在{attr.get('start_time')}开始游玩{duration / 3600:g}小时，超出营业时间（{opentime}）",
+                        "suggestion": "调整游玩时间或换到其他天"
+                    })
+                
+                if previous_end is not None and start < previous_end:
+                    issues.append({
+                        "severity": "error",
+                        "issue": f"第{day_num}天{name}的开始时间（{attr.get('start_time')}）早于{previous_name}的结束时间（{format_clock(previous_end)}）",
+                        "suggestion": "顺延后面景点的开始时间或缩短游玩时长"
+                    })
+                previous_end, previous_name = start + duration, name
+        
+        if not issues:
+            return {"is_feasible": True, "issues": []}
+        
+        return {
+            # 不可行的行程最高60分，每处冲突再扣10分
+            "overall_score": max(0, 60 - 10 * len(issues)),
+            "is_feasible": False,
+            "issues": issues,
+            "recommendations": [],
+            "summary": f"本地检查发现{len(issues)}处时间冲突，行程不可行"
+        }
+    
     def _format_daily_schedule(self, daily_schedule: List[Dict]) -> str:
         """格式化每日行程为文本"""
         lines = []
@@ -176,7 +237,9 @@ class ItineraryValidator:
                     start = attr.get('start_time', '--:--')
                     duration = attr.get('duration_hours', 0)
                     cost = attr.get('cost', 0)
-                    lines.append(f"- {start} {name} (游玩{duration}小时, 门票¥{cost})")
+                    opentime = attr.get('opentime')
+                    opentime_text = f", 营业{opentime}" if opentime else ""
+                    lines.append(f"- {start} {name} (游玩{duration}小时, 门票¥{cost}{opentime_text})")
             
             # 住宿
             hotel = day.get('hotel')
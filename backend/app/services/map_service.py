@@ -1,9 +1,45 @@
 """
 地图服务：封装高德API调用
 """
-import httpx
-from typing import List, Dict, Optional, Tuple
+import asyncio
+import copy
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, List, Dict, Optional, Tuple
+
+import numpy as np
+
 from app.core.config import settings
+from app.core.city_mapping import get_city_info
+from app.core.amap_client import AmapClient, get_amap_client
+from app.core.geometry import haversine
+from app.core.ttl_cache import TTLCache, MISSING, make_cache_key
+from app.services.poi_store import get_poi_store
+from app.services.route_service import RouteService
+
+# POI搜索结果缓存（进程内共享）
+_poi_cache = TTLCache('poi', max_entries=settings.POI_CACHE_MAX_ENTRIES)
+
+# 天气预报缓存（按adcode，在高德预报发布时刻过期）
+_weather_cache = TTLCache('weather', max_entries=1000)
+
+# 行政区adcode缓存（仅缓存本地映射表中没有的城市名）
+_district_cache = TTLCache('district', max_entries=1000, default_ttl=30 * 86400)
+
+# 距离测量点对缓存（起终点吸附到约10米网格）
+_distance_cache = TTLCache('distance_pair', max_entries=settings.DISTANCE_CACHE_MAX_ENTRIES)
+
+# 高德预报按北京时间发布
+CHINA_TZ = timezone(timedelta(hours=8))
+
+# 高德批量接口单次上限：ID搜索最多10个ID，地理编码批量模式最多10个地址
+DETAIL_BATCH_SIZE = 10
+GEOCODE_BATCH_SIZE = 10
+
+# 距离测量单次最多100个起点、1个终点
+DISTANCE_MAX_ORIGINS = 100
+
+# 距离测量类型 -> 路段缓存的出行方式
+DISTANCE_TYPE_MODES = {1: 'driving', 3: 'walking'}
 
 
 class MapService:
@@ -14,6 +50,59 @@ class MapService:
         self.api_key = "your_key"
         self.base_url = "https://restapi.amap.com/v3"
     
+    @property
+    def http(self) -> AmapClient:
+        """共享的高德HTTP客户端（连接池由应用lifespan管理）"""
+        return get_amap_client()
+    
+    def _get_cached_pois(self, endpoint: str, params: Dict) -> Optional[List[Dict]]:
+        """读取POI缓存，未命中返回None"""
+        if not settings.POI_CACHE_ENABLED:
+            return None
+        cached = _poi_cache.get(make_cache_key(endpoint, params))
+        if cached is MISSING:
+            return None
+        if settings.DEBUG_POI:
+            print(f"[POI缓存] 命中 {endpoint}")
+        return [dict(poi) for poi in cached]
+    
+    def _set_cached_pois(self, endpoint: str, params: Dict, pois: List[Dict]):
+        """写入POI缓存（按端点配置TTL）"""
+        if not settings.POI_CACHE_ENABLED:
+            return
+        ttl = settings.POI_CACHE_TTLS.get(endpoint, settings.POI_CACHE_TTLS.get('default', 3600))
+        _poi_cache.set(make_cache_key(endpoint, params), [dict(poi) for poi in pois], ttl=ttl)
+    
+    async def _persist_pois(self, pois: List[Dict], city: str = None):
+        """把一次搜索返回的POI批量写入attractions表（失败不影响主流程）"""
+        if not settings.POI_STORE_ENABLED or not pois:
+            return
+        try:
+            await asyncio.to_thread(get_poi_store().save_pois, pois, city)
+        except Exception as e:
+            print(f"[POI存储] 写入失败: {e}")
+    
+    async def _load_stored_pois(self, poi_ids: List[str]) -> Dict[str, Dict]:
+        """从attractions表读取未过期的POI"""
+        if not settings.POI_STORE_ENABLED or not poi_ids:
+            return {}
+        try:
+            return await asyncio.to_thread(get_poi_store().get_by_ids, poi_ids)
+        except Exception as e:
+            print(f"[POI存储] 读取失败: {e}")
+            return {}
+    
+    @staticmethod
+    async def _gather_bounded(aws: List[Awaitable], limit: int = None) -> List[Any]:
+        """限制并发数地执行一组协程，结果按输入顺序返回（异常作为结果返回）"""
+        semaphore = asyncio.Semaphore(limit or settings.AMAP_BULK_CONCURRENCY)
+        
+        async def run(aw):
+            async with semaphore:
+                return await aw
+        
+        return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=True)
+    
     async def search_attractions_v5(
         self, 
         keywords: str,
@@ -58,9 +147,11 @@ class MapService:
         if city_limit:
             params['city_limit'] = 'true'
         
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(url, params=params)
-            data = response.json()
+        cached = self._get_cached_pois('place/text', params)
+        if cached is not None:
+            return cached
+        
+        data = await self.http.get_json(url, params)
         
         # 简化日志（仅在出错时打印详细信息）
         if data.get('status') != '1':
@@ -81,6 +172,7 @@ class MapService:
                     rating = 0.0
                     cost = "未知"
                     tel = ''
+                    opentime = ''
                     
                     if isinstance(business, dict):
                         # 提取rating（餐饮、酒店、景点、影院类POI）
@@ -102,6 +194,10 @@ class MapService:
                             tel = tel_value[0] if tel_value else ''
                         else:
                             tel = str(tel_value) if tel_value else ''
+                        
+                        # 提取当天营业时间（无数据时高德返回空列表）
+                        opentime_value = business.get('opentime_today', '')
+                        opentime = opentime_value if isinstance(opentime_value, str) else ''
                     
                     # 处理photos - 提取URL
                     photos_data = poi.get('photos', [])
@@ -130,6 +226,7 @@ class MapService:
                         'rating': rating,
                         'cost': cost,
                         'tel': tel,
+                        'opentime': opentime,
                         'photos': photos,  # 所有图片
                         'thumbnail': thumbnail  # 缩略图（第一张）
                     })
@@ -138,6 +235,8 @@ class MapService:
                     print(f"[POI解析] 跳过异常POI: {poi.get('name', 'unknown')}, 错误: {e}")
                     continue
             
+            self._set_cached_pois('place/text', params, attractions)
+            await self._persist_pois(attractions, region)
             return attractions
         else:
             raise Exception(f"高德API错误: {data.get('info')}")
@@ -168,111 +267,233 @@ class MapService:
             
             print(f"[天气API] 开始查询：{city}")
             
-            # 1. 获取城市adcode
-            district_url = f"{self.base_url}/config/district"
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                print(f"[天气API] 步骤1：获取城市adcode")
-                response = await client.get(district_url, params={
-                    'key': self.api_key,
-                    'keywords': city,
-                    'subdistrict': 0
-                })
-                data = response.json()
-                print(f"[天气API] 行政区查询响应: status={data.get('status')}, districts数量={len(data.get('districts', []))}")
-                
-                if data.get('status') != '1' or not data.get('districts'):
-                    print(f"[天气API] 未找到城市：{city}")
-                    return None
-                
-                adcode = data['districts'][0]['adcode']
-                city_name = data['districts'][0]['name']
-                print(f"[天气API] 城市adcode: {adcode}, 名称: {city_name}")
-                
-                # 2. 获取天气信息
-                weather_url = f"{self.base_url}/weather/weatherInfo"
-                print(f"[天气API] 步骤2：获取天气预报")
-                response = await client.get(weather_url, params={
-                    'key': self.api_key,
-                    'city': adcode,
-                    'extensions': 'all'
-                })
-                weather_data = response.json()
-                print(f"[天气API] 天气查询响应: status={weather_data.get('status')}, info={weather_data.get('info')}")
-                
-                if weather_data.get('status') != '1':
-                    print(f"[天气API] 天气查询失败：{weather_data.get('info')}")
-                    return None
-                
-                forecasts = weather_data.get('forecasts', [])
-                if not forecasts:
-                    return None
-                
-                forecast = forecasts[0]
-                casts = forecast.get('casts', [])
-                
-                # 格式化数据
-                return {
-                    'city': forecast.get('city'),
-                    'forecasts': [{
-                        'date': c.get('date'),
-                        'week': c.get('week'),
-                        'day_weather': c.get('dayweather'),
-                        'night_weather': c.get('nightweather'),
-                        'day_temp': c.get('daytemp'),
-                        'night_temp': c.get('nighttemp'),
-                        'day_wind': c.get('daywind'),
-                        'day_power': c.get('daypower')
-                    } for c in casts[:7]]
-                }
-                
+            # 1. 解析城市adcode（优先使用本地映射表）
+            adcode = await self._resolve_adcode(city)
+            if not adcode:
+                print(f"[天气API] 未找到城市：{city}")
+                return None
+            
+            cached = _weather_cache.get(adcode)
+            if cached is not MISSING:
+                if settings.DEBUG_WEATHER:
+                    print(f"[天气API] 缓存命中：{city}({adcode})")
+                return copy.deepcopy(cached)
+            
+            # 2. 获取天气信息
+            weather_url = f"{self.base_url}/weather/weatherInfo"
+            print(f"[天气API] 获取天气预报：{city}({adcode})")
+            weather_data = await self.http.get_json(weather_url, {
+                'key': self.api_key,
+                'city': adcode,
+                'extensions': 'all'
+            })
+            print(f"[天气API] 天气查询响应: status={weather_data.get('status')}, info={weather_data.get('info')}")
+            
+            if weather_data.get('status') != '1':
+                print(f"[天气API] 天气查询失败：{weather_data.get('info')}")
+                return None
+            
+            forecasts = weather_data.get('forecasts', [])
+            if not forecasts:
+                return None
+            
+            forecast = forecasts[0]
+            casts = forecast.get('casts', [])
+            
+            # 格式化数据
+            result = {
+                'city': forecast.get('city'),
+                'forecasts': [{
+                    'date': c.get('date'),
+                    'week': c.get('week'),
+                    'day_weather': c.get('dayweather'),
+                    'night_weather': c.get('nightweather'),
+                    'day_temp': c.get('daytemp'),
+                    'night_temp': c.get('nighttemp'),
+                    'day_wind': c.get('daywind'),
+                    'day_power': c.get('daypower')
+                } for c in casts[:7]]
+            }
+            
+            _weather_cache.set(adcode, result, ttl=self._seconds_until_weather_update())
+            return copy.deepcopy(result)
+            
         except Exception as e:
             print(f"[天气API] 异常: {e}")
             return None
     
+    async def _resolve_adcode(self, city: str) -> Optional[str]:
+        """
+        解析城市adcode
+        
+        先查本地城市映射表（300+城市），未收录的城市名才调用行政区查询API
+        """
+        city_info = get_city_info(city)
+        if city_info:
+            return city_info['adcode']
+        
+        cached = _district_cache.get(city)
+        if cached is not MISSING:
+            return cached
+        
+        district_url = f"{self.base_url}/config/district"
+        data = await self.http.get_json(district_url, {
+            'key': self.api_key,
+            'keywords': city,
+            'subdistrict': 0
+        })
+        print(f"[天气API] 行政区查询响应: status={data.get('status')}, districts数量={len(data.get('districts', []))}")
+        
+        if data.get('status') != '1' or not data.get('districts'):
+            return None
+        
+        adcode = data['districts'][0]['adcode']
+        _district_cache.set(city, adcode)
+        return adcode
+    
+    @staticmethod
+    def _seconds_until_weather_update(now: datetime = None) -> float:
+        """距离下一次高德天气预报发布的秒数（北京时间）"""
+        now = now or datetime.now(CHINA_TZ)
+        hours = sorted(settings.WEATHER_PUBLISH_HOURS)
+        
+        for hour in hours:
+            boundary = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if boundary > now:
+                return (boundary - now).total_seconds()
+        
+        # 今天的发布时刻都已过，取明天第一个
+        tomorrow = now + timedelta(days=1)
+        boundary = tomorrow.replace(hour=hours[0], minute=0, second=0, microsecond=0)
+        return (boundary - now).total_seconds()
+    
     async def get_distance_matrix(
         self, 
         origins: List[Tuple[float, float]], 
         destinations: List[Tuple[float, float]],
-        type: int = 3  # 1=驾车, 3=步行
-    ) -> List[List[Dict]]:
+        type: int = 1  # 0=直线, 1=驾车, 3=步行（5公里以内）
+    ) -> Dict:
         """
-        获取距离矩阵（调用高德距离API）
+        获取距离矩阵（调用高德距离测量API）
+        
+        高德单次请求最多100个起点、1个终点，因此按 (≤100个起点 × 1个终点) 切块并发请求；
+        已缓存的点对（含路段缓存中的同类路线）不再请求
         
         Args:
             origins: 起点坐标列表 [(lng, lat), ...]
             destinations: 终点坐标列表 [(lng, lat), ...]
-            type: 类型（1=驾车, 3=步行）
+            type: 类型（0=直线, 1=驾车, 3=步行）
+            
+        Returns:
+            {
+                'distance': 距离矩阵 ndarray(起点数, 终点数)，单位米，未获取到为NaN,
+                'duration': 耗时矩阵 ndarray(起点数, 终点数)，单位秒，未获取到为NaN,
+                'cached_pairs': 命中缓存的点对数,
+                'api_requests': 实际请求次数,
+                'failed_pairs': 未获取到的点对数
+            }
+        """
+        pairs = [(i, j) for j in range(len(destinations)) for i in range(len(origins))]
+        return await self.get_distance_pairs(origins, destinations, pairs, type=type)
+    
+    async def get_distance_pairs(
+        self,
+        origins: List[Tuple[float, float]],
+        destinations: List[Tuple[float, float]],
+        pairs: List[Tuple[int, int]],
+        type: int = 1
+    ) -> Dict:
+        """
+        获取指定点对的距离（稀疏版的 get_distance_matrix，只请求需要的点对）
+        
+        Args:
+            origins: 起点坐标列表
+            destinations: 终点坐标列表
+            pairs: 需要的 (起点下标, 终点下标) 列表
+            type: 类型（0=直线, 1=驾车, 3=步行）
             
         Returns:
-            距离矩阵
+            与 get_distance_matrix 相同；未请求的点对为NaN，failed_pairs 只统计请求了但未获取到的点对
         """
         url = f"{self.base_url}/distance"
+        m, n = len(origins), len(destinations)
+        distance = np.full((m, n), np.nan)
+        duration = np.full((m, n), np.nan)
         
-        # 由于高德API限制，需要分批请求
-        # 每次最多100个起点和终点的组合
-        results = []
+        mode = DISTANCE_TYPE_MODES.get(type)
+        ttls = settings.ROUTE_LEG_CACHE_TTLS
+        ttl = ttls.get(mode, ttls.get('default', 3600))
+        route_service = RouteService()
+        snapped_origins = [RouteService._snap(o) for o in origins]
+        snapped_destinations = [RouteService._snap(d) for d in destinations]
         
-        for origin in origins:
-            origins_str = f"{origin[0]},{origin[1]}"
-            destinations_str = "|".join([f"{d[0]},{d[1]}" for d in destinations])
+        # 1. 读取缓存，按终点收集需要请求的起点
+        pending: Dict[int, List[int]] = {}
+        cached_pairs = 0
+        for i, j in pairs:
+            if snapped_origins[i] == snapped_destinations[j]:
+                distance[i, j] = duration[i, j] = 0
+                continue
             
-            params = {
+            pair = _distance_cache.get(f"{type}|{snapped_origins[i]}|{snapped_destinations[j]}")
+            if pair is MISSING and mode:
+                leg = route_service.peek_leg(origins[i], destinations[j], mode)
+                pair = (leg['distance'], leg['duration']) if leg else MISSING
+            
+            if pair is MISSING:
+                pending.setdefault(j, []).append(i)
+            else:
+                distance[i, j], duration[i, j] = pair
+                cached_pairs += 1
+        
+        # 2. 切块：每块 ≤100个起点 × 1个终点
+        blocks = [
+            (j, rows[k:k + DISTANCE_MAX_ORIGINS])
+            for j, rows in pending.items()
+            for k in range(0, len(rows), DISTANCE_MAX_ORIGINS)
+        ]
+        
+        async def fetch_block(j: int, rows: List[int]) -> Dict:
+            return await self.http.get_json(url, {
                 'key': self.api_key,
-                'origins': origins_str,
-                'destination': destinations_str,
+                'origins': '|'.join(f"{origins[i][0]},{origins[i][1]}" for i in rows),
+                'destination': f"{destinations[j][0]},{destinations[j][1]}",
                 'type': type
-            }
-            
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            })
+        
+        # 3. 并发请求，结果写回矩阵并缓存
+        responses = await self._gather_bounded([fetch_block(j, rows) for j, rows in blocks])
+        for (j, rows), data in zip(blocks, responses):
+            if isinstance(data, Exception) or data.get('status') != '1':
+                info = data if isinstance(data, Exception) else data.get('info')
+                print(f"[距离矩阵] 终点{j}的{len(rows)}个点对获取失败: {info}")
+                continue
             
-            if data['status'] == '1':
-                results.append(data['results'])
-            else:
-                raise Exception(f"高德API错误: {data.get('info')}")
+            for result in data.get('results', []):
+                try:
+                    # origin_id 是该请求内起点的序号（从1开始）
+                    i = rows[int(result['origin_id']) - 1]
+                    if result.get('code') not in (None, '', '0', 0):
+                        continue  # 单个点对无法规划（如步行超过5公里）
+                    pair = (float(result['distance']), float(result['duration']))
+                except (KeyError, IndexError, ValueError, TypeError):
+                    continue
+                distance[i, j], duration[i, j] = pair
+                _distance_cache.set(f"{type}|{snapped_origins[i]}|{snapped_destinations[j]}", pair, ttl=ttl)
         
-        return results
+        failed_pairs = sum(len(rows) for rows in pending.values()) - sum(
+            int((~np.isnan(distance[rows, j])).sum()) for j, rows in pending.items()
+        )
+        if settings.DEBUG_ROUTE:
+            print(f"[距离矩阵] {m}×{n}（{len(pairs)}对），缓存命中{cached_pairs}对，请求{len(blocks)}次，失败{failed_pairs}对")
+        
+        return {
+            'distance': distance,
+            'duration': duration,
+            'cached_pairs': cached_pairs,
+            'api_requests': len(blocks),
+            'failed_pairs': failed_pairs
+        }
     
     async def get_route(
         self,
@@ -305,9 +526,7 @@ class MapService:
             'destination': f"{destination[0]},{destination[1]}"
         }
         
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            response = await client.get(url, params=params)
-            data = response.json()
+        data = await self.http.get_json(url, params)
         
         if data['status'] == '1':
             route = data['route']
@@ -400,9 +619,7 @@ class MapService:
             params['AlternativeRoute'] = 3  # 返回3条方案
         
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 route = data.get('route')
@@ -459,9 +676,7 @@ class MapService:
             params['citylimit'] = 'true'
         
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 tips = data.get('tips', [])
@@ -523,14 +738,18 @@ class MapService:
         if city_limit:
             params['city_limit'] = 'true'
         
+        cached = self._get_cached_pois('place/around', params)
+        if cached is not None:
+            return cached
+        
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
-                pois = data.get('pois', [])
-                return self._parse_pois_v5(pois)
+                results = self._parse_pois_v5(data.get('pois', []))
+                self._set_cached_pois('place/around', params, results)
+                await self._persist_pois(results, region)
+                return results
             else:
                 print(f"[周边搜索] 错误: {data.get('info')}")
                 return []
@@ -546,35 +765,217 @@ class MapService:
         """
         ID搜索（v5 API）
         
+        高德单次最多查询10个ID，超出时自动按10个一组拆分并发请求
+        
         Args:
-            poi_ids: POI ID列表（最多10个）
+            poi_ids: POI ID列表（数量不限）
             show_fields: 返回字段控制
             
         Returns:
-            POI详情列表
+            POI详情列表（按输入顺序，查不到的ID不出现在结果中）
         """
+        poi_ids = list(dict.fromkeys(poi_id for poi_id in poi_ids if poi_id))
+        if len(poi_ids) <= DETAIL_BATCH_SIZE:
+            return await self._get_poi_detail_chunk(poi_ids, show_fields)
+        
+        chunks = [poi_ids[i:i + DETAIL_BATCH_SIZE] for i in range(0, len(poi_ids), DETAIL_BATCH_SIZE)]
+        results = await self._gather_bounded([self._get_poi_detail_chunk(chunk, show_fields) for chunk in chunks])
+        return [poi for chunk in results if isinstance(chunk, list) for poi in chunk]
+    
+    async def _get_poi_detail_chunk(self, poi_ids: List[str], show_fields: str) -> List[Dict]:
+        """ID搜索（单次请求，最多10个ID）"""
+        if not poi_ids:
+            return []
+        
         url = "https://restapi.amap.com/v5/place/detail"
         
         params = {
             'key': self.api_key,
-            'id': '|'.join(poi_ids[:10]),
+            'id': '|'.join(poi_ids),
             'show_fields': show_fields
         }
         
-        try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+        cached = self._get_cached_pois('place/detail', params)
+        if cached is not None:
+            return cached
+        
+        # attractions表中未过期的POI直接使用，只向高德请求缺失的ID
+        stored = await self._load_stored_pois(poi_ids)
+        missing = [poi_id for poi_id in poi_ids if poi_id not in stored]
+        fetched = {}
+        complete = True
+        
+        if missing:
+            try:
+                data = await self.http.get_json(url, {**params, 'id': '|'.join(missing)})
+                
+                if data.get('status') == '1':
+                    pois = self._parse_pois_v5(data.get('pois', []))
+                    fetched = {poi['id']: poi for poi in pois}
+                    await self._persist_pois(pois)
+                else:
+                    print(f"[POI详情] 错误: {data.get('info')}")
+                    complete = False
+            except Exception as e:
+                print(f"[POI详情] 异常: {e}")
+                complete = False
+        
+        by_id = {**stored, **fetched}
+        results = [by_id[poi_id] for poi_id in poi_ids if poi_id in by_id]
+        if complete:
+            self._set_cached_pois('place/detail', params, results)
+        return results
+    
+    async def geocode(self, addresses: List[str], city: str = None) -> List[Optional[Dict]]:
+        """
+        地理编码（v3 API，批量模式）
+        
+        每10个地址合并为一次请求，多组之间并发
+        
+        Args:
+            addresses: 地址或地名列表
+            city: 限定城市（可选）
             
-            if data.get('status') == '1':
-                pois = data.get('pois', [])
-                return self._parse_pois_v5(pois)
-            else:
-                print(f"[POI详情] 错误: {data.get('info')}")
-                return []
-        except Exception as e:
-            print(f"[POI详情] 异常: {e}")
-            return []
+        Returns:
+            与输入一一对应的结果列表，每项为 {'lng', 'lat', 'address', 'level', 'adcode'}，解析失败为None
+        """
+        url = f"{self.base_url}/geocode/geo"
+        
+        async def geocode_chunk(chunk: List[str]) -> List[Optional[Dict]]:
+            params = {
+                'key': self.api_key,
+                'address': '|'.join(chunk),
+                'batch': 'true'
+            }
+            if city:
+                params['city'] = city
+            
+            data = await self.http.get_json(url, params)
+            if data.get('status') != '1':
+                print(f"[地理编码] 错误: {data.get('info')}")
+                return [None] * len(chunk)
+            
+            geocodes = data.get('geocodes', [])
+            results = []
+            for i in range(len(chunk)):
+                item = geocodes[i] if i < len(geocodes) else {}
+                # 批量模式下解析失败的地址，location为空数组
+                location = item.get('location')
+                if not isinstance(location, str) or ',' not in location:
+                    results.append(None)
+                    continue
+                lng, lat = location.split(',')
+                results.append({
+                    'lng': float(lng),
+                    'lat': float(lat),
+                    'address': item.get('formatted_address') or '',
+                    'level': item.get('level') or '',
+                    'adcode': item.get('adcode') or ''
+                })
+            return results
+        
+        chunks = [addresses[i:i + GEOCODE_BATCH_SIZE] for i in range(0, len(addresses), GEOCODE_BATCH_SIZE)]
+        chunk_results = await self._gather_bounded([geocode_chunk(chunk) for chunk in chunks])
+        
+        results = []
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, Exception):
+                print(f"[地理编码] 异常: {chunk_result}")
+                chunk_result = [None] * len(chunk)
+            results.extend(chunk_result)
+        return results
+    
+    async def get_attraction_by_name(self, city: str, name: str) -> Optional[Dict]:
+        """
+        按名称解析景点（名称 -> 坐标等详细信息）
+        
+        优先读取attractions表中该城市同名且未过期的POI，找不到再调用高德搜索取第一条
+        
+        Args:
+            city: 城市名称
+            name: 景点名称
+            
+        Returns:
+            景点信息，找不到返回None
+        """
+        if settings.POI_STORE_ENABLED:
+            try:
+                poi = await asyncio.to_thread(get_poi_store().get_by_name, city, name)
+                if poi:
+                    if settings.DEBUG_POI:
+                        print(f"[POI存储] 命中 {city}/{name}")
+                    return poi
+            except Exception as e:
+                print(f"[POI存储] 读取失败: {e}")
+        
+        results = await self.search_attractions(city=city, keyword=name, limit=1)
+        return results[0] if results else None
+    
+    async def get_attractions_by_names(self, city: str, names: List[str]) -> List[Optional[Dict]]:
+        """
+        按名称批量解析景点
+        
+        1. attractions表一次查询取出已有的同名POI
+        2. 其余名称并发调用高德搜索（有限并发，受共享客户端限流控制）
+        3. 搜索不到的名称用批量地理编码兜底（只有坐标和地址）
+        
+        Args:
+            city: 城市名称
+            names: 景点名称列表
+            
+        Returns:
+            与输入一一对应的景点列表，找不到为None
+        """
+        unique_names = list(dict.fromkeys(name.strip() for name in names if name and name.strip()))
+        resolved: Dict[str, Dict] = {}
+        
+        if settings.POI_STORE_ENABLED and unique_names:
+            try:
+                resolved = await asyncio.to_thread(get_poi_store().get_by_names, city, unique_names)
+                if settings.DEBUG_POI and resolved:
+                    print(f"[POI存储] 批量命中 {len(resolved)}/{len(unique_names)}")
+            except Exception as e:
+                print(f"[POI存储] 读取失败: {e}")
+        
+        missing = [name for name in unique_names if name not in resolved]
+        if missing:
+            results = await self._gather_bounded([
+                self.search_attractions(city=city, keyword=name, limit=1)
+                for name in missing
+            ])
+            for name, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    print(f"[批量解析] {name} 搜索失败: {result}")
+                elif result:
+                    resolved[name] = result[0]
+        
+        missing = [name for name in unique_names if name not in resolved]
+        if missing:
+            try:
+                geocoded = await self.geocode(missing, city=city)
+            except Exception as e:
+                print(f"[批量解析] 地理编码失败: {e}")
+                geocoded = []
+            for name, location in zip(missing, geocoded):
+                if location:
+                    resolved[name] = {
+                        'id': '',
+                        'name': name,
+                        'lng': location['lng'],
+                        'lat': location['lat'],
+                        'address': location['address'],
+                        'type': '',
+                        'rating': 0.0,
+                        'tel': '',
+                        'photos': [],
+                        'thumbnail': '',
+                        'geocoded': True  # 仅有坐标，非POI搜索结果
+                    }
+        
+        return [
+            dict(resolved[name.strip()]) if name and name.strip() in resolved else None
+            for name in names
+        ]
     
     def _parse_pois_v5(self, pois: List[Dict]) -> List[Dict]:
         """解析v5 POI数据"""
@@ -678,26 +1079,7 @@ class MapService:
         Returns:
             距离（米）
         """
-        from math import radians, sin, cos, sqrt, atan2
-        
-        lng1, lat1 = point1
-        lng2, lat2 = point2
-        
-        # 地球半径（米）
-        R = 6371000
-        
-        # 转换为弧度
-        lat1_rad = radians(lat1)
-        lat2_rad = radians(lat2)
-        delta_lat = radians(lat2 - lat1)
-        delta_lng = radians(lng2 - lng1)
-        
-        # Haversine公式
-        a = sin(delta_lat/2)**2 + cos(lat1_rad) * cos(lat2_rad) * sin(delta_lng/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1-a))
-        distance = R * c
-        
-        return distance
+        return haversine(point1, point2)
     
     async def get_location_by_ip(self, ip: str = None) -> Optional[Dict]:
         """
@@ -742,9 +1124,7 @@ class MapService:
             print(f"[IP定位] 调用高德API: {url}")
             print(f"[IP定位] 参数: {params}")
             
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             print(f"[IP定位] 响应状态: {data.get('status')}")
             print(f"[IP定位] 响应数据: {data}")
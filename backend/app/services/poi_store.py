@@ -0,0 +1,212 @@
+"""
+POI持久化存储：把高德POI写入attractions表，作为跨重启、跨worker共享的读穿缓存
+"""
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+
+from sqlalchemy import func
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.attraction import Attraction
+
+# 直接映射到表字段的POI键，其余键整体保存在biz_ext中
+COLUMN_FIELDS = ('id', 'name', 'lng', 'lat', 'address', 'type', 'typecode', 'rating', 'cost', 'tel', 'photos')
+
+
+def _city_variants(city: str) -> List[str]:
+    """城市名的常见写法（北京 / 北京市）"""
+    base = city[:-1] if city.endswith('市') else city
+    return [base, f"{base}市"]
+
+
+class PoiStore:
+    """POI存储（同步实现，异步代码中请通过asyncio.to_thread调用）"""
+
+    def _fresh_after(self) -> datetime:
+        """新鲜度下限：早于该时间更新的记录视为过期"""
+        return datetime.utcnow() - timedelta(hours=settings.POI_STORE_MAX_AGE_HOURS)
+
+    @staticmethod
+    def _to_row(poi: Dict, city: str = None) -> Dict:
+        """POI字典 -> 表字段"""
+        rating = poi.get('rating')
+        try:
+            rating = float(rating) if rating not in (None, '') else None
+        except (ValueError, TypeError):
+            rating = None
+
+        return {
+            'amap_id': poi['id'],
+            'name': poi.get('name', ''),
+            'lng': float(poi['lng']),
+            'lat': float(poi['lat']),
+            'city': poi.get('city') or poi.get('cityname') or city,
+            'address': str(poi.get('address') or '')[:500],
+            'type': str(poi.get('type') or '')[:100],
+            'typecode': str(poi.get('typecode') or '')[:20],
+            'rating': rating,
+            'cost': str(poi.get('cost') or '')[:50],
+            'tel': str(poi.get('tel') or '')[:100],
+            'photos': poi.get('photos', []),
+            'biz_ext': {k: v for k, v in poi.items() if k not in COLUMN_FIELDS}
+        }
+
+    @staticmethod
+    def _to_poi(row: Attraction) -> Dict:
+        """表记录 -> 与MapService解析结果一致的POI字典"""
+        poi = {
+            'id': row.amap_id,
+            'name': row.name,
+            'lng': row.lng,
+            'lat': row.lat,
+            'address': row.address or '',
+            'type': row.type or '',
+            'typecode': row.typecode or '',
+            'rating': row.rating or 0.0,
+            'cost': row.cost or '',
+            'tel': row.tel or '',
+            'photos': row.photos or []
+        }
+        poi.update(row.biz_ext or {})
+        return poi
+
+    def save_pois(self, pois: List[Dict], city: str = None) -> int:
+        """
+        批量写入POI（按amap_id upsert，一次搜索结果一次提交）
+
+        Args:
+            pois: 解析后的POI列表
+            city: 搜索时使用的城市（POI自身无城市字段时使用）
+
+        Returns:
+            写入条数
+        """
+        rows = {}
+        for poi in pois:
+            if not poi.get('id'):
+                continue
+            try:
+                rows[poi['id']] = self._to_row(poi, city)
+            except (KeyError, ValueError, TypeError):
+                continue
+        if not rows:
+            return 0
+
+        db = SessionLocal()
+        try:
+            dialect = db.get_bind().dialect.name
+            if dialect in ('sqlite', 'postgresql'):
+                if dialect == 'sqlite':
+                    from sqlalchemy.dialects.sqlite import insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert
+
+                stmt = insert(Attraction).values(list(rows.values()))
+                update_columns = {
+                    name: stmt.excluded[name]
+                    for name in rows[next(iter(rows))].keys()
+                    if name != 'amap_id'
+                }
+                # 详情/周边结果可能不带城市，不覆盖已有的城市字段
+                update_columns['city'] = func.coalesce(stmt.excluded.city, Attraction.city)
+                update_columns['updated_at'] = func.now()
+                db.execute(stmt.on_conflict_do_update(index_elements=['amap_id'], set_=update_columns))
+            else:
+                # 其他数据库：逐条合并
+                existing = {
+                    a.amap_id: a
+                    for a in db.query(Attraction).filter(Attraction.amap_id.in_(list(rows))).all()
+                }
+                for amap_id, row in rows.items():
+                    attraction = existing.get(amap_id)
+                    if attraction is None:
+                        db.add(Attraction(**row))
+                    else:
+                        for key, value in row.items():
+                            if key == 'city' and not value:
+                                continue
+                            setattr(attraction, key, value)
+
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def get_by_ids(self, poi_ids: List[str]) -> Dict[str, Dict]:
+        """
+        按POI ID批量读取（仅返回未过期的记录）
+
+        Returns:
+            {poi_id: poi}
+        """
+        if not poi_ids:
+            return {}
+
+        db = SessionLocal()
+        try:
+            rows = db.query(Attraction).filter(
+                Attraction.amap_id.in_(poi_ids),
+                Attraction.updated_at >= self._fresh_after()
+            ).all()
+            return {row.amap_id: self._to_poi(row) for row in rows}
+        finally:
+            db.close()
+
+    def get_by_name(self, city: str, name: str) -> Optional[Dict]:
+        """
+        按（城市, 名称）精确查找（仅返回未过期的记录，重名时取评分最高的）
+        """
+        if not city or not name:
+            return None
+
+        db = SessionLocal()
+        try:
+            row = db.query(Attraction).filter(
+                Attraction.name == name.strip(),
+                Attraction.city.in_(_city_variants(city.strip())),
+                Attraction.updated_at >= self._fresh_after()
+            ).order_by(Attraction.rating.desc()).first()
+            return self._to_poi(row) if row else None
+        finally:
+            db.close()
+
+    def get_by_names(self, city: str, names: List[str]) -> Dict[str, Dict]:
+        """
+        按（城市, 名称）批量精确查找（一次查询，重名时取评分最高的）
+
+        Returns:
+            {name: poi}，未找到的名称不出现在结果中
+        """
+        names = [name.strip() for name in names if name and name.strip()]
+        if not city or not names:
+            return {}
+
+        db = SessionLocal()
+        try:
+            rows = db.query(Attraction).filter(
+                Attraction.name.in_(names),
+                Attraction.city.in_(_city_variants(city.strip())),
+                Attraction.updated_at >= self._fresh_after()
+            ).order_by(Attraction.rating.desc()).all()
+
+            results = {}
+            for row in rows:
+                # 已按评分降序，同名只保留第一条
+                if row.name not in results:
+                    results[row.name] = self._to_poi(row)
+            return results
+        finally:
+            db.close()
+
+
+# 全局存储实例
+_poi_store = PoiStore()
+
+
+def get_poi_store() -> PoiStore:
+    """获取POI存储实例"""
+    return _poi_store
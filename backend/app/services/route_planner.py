@@ -1,16 +1,24 @@
 """
 路径规划服务：使用OR-Tools优化TSP + 高德地图真实路线数据
 """
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-from typing import List, Dict, Tuple
+import asyncio
+import time
+from typing import List, Dict, Optional, Tuple
 import numpy as np
 
 from app.core.config import settings
+from app.core.geometry import grid_knn, haversine_matrix, path_length, points_path_length, project_xy
+from app.core.opening_hours import format_clock, parse_clock, parse_opentime, visit_start_windows
+from app.core.solver_pool import SolveCancelToken, get_solver_pool
 from app.services.map_service import MapService
 from app.services.route_service import RouteService
+from app.services.tour_cache import get_cached_tour, set_cached_tour
+from app.services.tsp_solver import solve_tsp_exact, solve_tsp_large, solve_tsp_ortools, solve_vrp_ortools
 from app.core.city_mapping import get_citycode, get_adcode, SUPPORTED_CITIES
 
+# 各城市的绕行系数标定值：城市 -> (真实距离/直线距离, 真实时间/直线距离)
+_city_calibration: Dict[str, Tuple[float, float]] = {}
+
 
 class RoutePlanner:
     """路径规划服务：使用OR-Tools优化TSP + 高德地图真实数据"""
@@ -20,6 +28,13 @@ class RoutePlanner:
         self.route_service = RouteService()  # 新增：高德路线服务
         self.max_attractions = settings.MAX_ATTRACTIONS
         self.time_limit = settings.TSP_TIME_LIMIT
+        # 求解器注册表：按顺序取第一个适用于该景点数量的求解器
+        # input: matrix（距离矩阵）/ points（景点坐标，大规模时不构建 n×n 矩阵）
+        self.solvers = [
+            {'name': 'exact_dp', 'max_n': settings.TSP_EXACT_MAX_N, 'input': 'matrix', 'solve': self._solve_exact},
+            {'name': 'ortools', 'max_n': settings.TSP_ORTOOLS_MAX_N, 'input': 'matrix', 'solve': self._solve_tsp},
+            {'name': 'local_search', 'max_n': None, 'input': 'points', 'solve': self._solve_large},
+        ]
     
     async def optimize_route(
         self,
@@ -40,33 +55,74 @@ class RoutePlanner:
             优化后的行程数据
         """
         n = len(attractions)
+        solver = self._select_solver(n)
+        print(f"使用 {solver['name']} 优化 {n} 个景点")
+        return await self._optimize_with_solver(solver, attractions, budget, days, city)
+    
+    def _select_solver(self, n: int) -> Dict:
+        """
+        按景点数量从求解器注册表中选择求解器（取第一个 max_n 不小于 n 的）
         
-        # 策略1：景点数量≤12个，使用TSP（最优解）
-        if n <= self.max_attractions:
-            print(f"使用TSP算法优化 {n} 个景点")
-            return await self._optimize_with_tsp(attractions, budget, days, city)
-        
-        # 策略2：景点数量过多，使用贪心算法
-        else:
-            print(f"景点数量 {n} 超过限制，使用贪心算法")
-            return await self._optimize_with_greedy(attractions, budget, days, city)
+        - exact_dp：状态压缩DP，小规模下毫秒级得到可证明的最优解
+        - ortools：OR-Tools + 引导局部搜索，求解时间按景点数缩放
+        - local_search：网格近邻构造 + 2-opt/Or-opt，大规模时在固定时间预算内求近似解
+        """
+        for solver in self.solvers:
+            if solver['max_n'] is None or n <= solver['max_n']:
+                return solver
+        return self.solvers[-1]
     
-    async def _optimize_with_tsp(
+    async def _optimize_with_solver(
         self, 
+        solver: Dict,
         attractions: List[Dict],
         budget: float = 5000,
         days: int = 3,
         city: str = "北京"
     ) -> Dict:
-        """使用TSP算法优化"""
-        
-        # 1. 构建距离矩阵
-        print("构建距离矩阵...")
-        distance_matrix = await self._build_distance_matrix(attractions)
-        
-        # 2. 使用OR-Tools求解TSP
-        print("求解TSP...")
-        optimal_indices = self._solve_tsp(distance_matrix)
+        """使用选定的求解器优化"""
+        n = len(attractions)
+        road = settings.TSP_ROAD_DISTANCE and 2 < n <= settings.TSP_HYBRID_MAX_N
+        cache_params = {'solver': solver['name'], 'road': road, 'metric': settings.TSP_COST_METRIC}
+        
+        distance_matrix = None
+        cost_matrix = None
+        matrix_source = 'straight'
+        solve_start = time.perf_counter()
+        cached_tour = get_cached_tour(attractions, cache_params)
+        cached = cached_tour is not None
+        if cached:
+            # 同一组景点已求解过：跳过矩阵构建和求解（沿用求解时的距离矩阵，统计与未命中时一致）
+            print(f"命中TSP解缓存（{solver['name']}）")
+            optimal_indices = cached_tour['order']
+            distance_matrix, matrix_source = cached_tour['distance_matrix'], cached_tour['matrix_source']
+        else:
+            # 1. 构建代价矩阵（直线距离为底，近邻点对使用高德真实驾车数据，其余按城市绕行系数换算）
+            if solver['input'] == 'matrix':
+                print("构建距离矩阵...")
+                distance_matrix = await self._build_distance_matrix(attractions)
+                cost_matrix = distance_matrix
+                if road:
+                    hybrid = await self._build_hybrid_matrix(attractions, distance_matrix, city)
+                    if hybrid is not None:
+                        # 求解按配置的优化目标，优化率始终按距离平面（米）计算
+                        cost_matrix = hybrid[settings.TSP_COST_METRIC]
+                        distance_matrix, matrix_source = hybrid['distance'], 'hybrid'
+            
+            # 2. 在求解线程池中求解
+            print(f"求解TSP（{solver['name']}）...")
+            solve_start = time.perf_counter()
+            optimal_indices = await get_solver_pool().run(
+                solver['solve'],
+                cost_matrix if solver['input'] == 'matrix' else attractions,
+                token=SolveCancelToken()
+            )
+            set_cached_tour(
+                attractions, optimal_indices, cache_params,
+                distance_matrix=distance_matrix if matrix_source == 'hybrid' else None,
+                matrix_source=matrix_source
+            )
+        solve_ms = (time.perf_counter() - solve_start) * 1000
         
         # 3. 按优化顺序重排景点
         optimal_attractions = [attractions[i] for i in optimal_indices]
@@ -74,64 +130,199 @@ class RoutePlanner:
         # 4. 获取详细路线（考虑预算和城市）
         print("获取详细路线...")
         budget_per_day = budget / days if days > 0 else 500
+        routing_start = time.perf_counter()
         routes = await self._get_detailed_routes(optimal_attractions, budget_per_day, city)
+        routing_ms = (time.perf_counter() - routing_start) * 1000
         
         # 5. 计算统计信息
-        summary = self._calculate_summary(optimal_attractions, routes)
+        summary = self._calculate_summary(optimal_attractions, routes, routing_ms)
         
-        # 6. 计算优化率（与原始顺序对比）
-        original_distance = await self._calculate_total_distance(attractions, city)
-        optimized_distance = summary['total_distance_km'] * 1000
-        if original_distance > 0:
-            summary['optimization_rate'] = (original_distance - optimized_distance) / original_distance * 100
+        # 6. 计算优化率（与原始顺序对比，不再为原始顺序重新请求路线）
+        summary.update(self._calculate_optimization_rate(
+            attractions, optimal_indices, routes, distance_matrix, matrix_source, budget_per_day, city
+        ))
         
         return {
             'attractions': optimal_attractions,
             'routes': routes,
             'summary': summary,
-            'algorithm': 'tsp'
+            'algorithm': {
+                'solver': solver['name'],
+                'n': n,
+                'solve_ms': round(solve_ms, 1),
+                'optimal': solver['name'] == 'exact_dp',
+                'cached': cached
+            }
         }
     
-    async def _optimize_with_greedy(
-        self, 
+    async def plan_days(
+        self,
         attractions: List[Dict],
+        days: int,
+        hotel: Optional[Dict] = None,
         budget: float = 5000,
-        days: int = 3,
-        city: str = "北京"
+        city: str = "北京",
+        day_hours: Optional[float] = None
     ) -> Dict:
-        """使用贪心算法优化"""
-        
-        # 贪心算法：每次选择距离最近的景点
-        route = [attractions[0]]
-        remaining = attractions[1:].copy()
-        
-        while remaining:
-            current = route[-1]
-            # 找到距离最近的景点
-            nearest = min(
-                remaining, 
-                key=lambda a: self.map_service.calculate_distance(
-                    (current['lng'], current['lat']),
-                    (a['lng'], a['lat'])
-                )
-            )
-            route.append(nearest)
-            remaining.remove(nearest)
+        """
+        多天行程规划（VRP）：每天看作一辆车、酒店为车场，一次求解同时完成景点分天、每天的游览顺序和开始时间
         
-        # 获取详细路线
-        budget_per_day = budget / days if days > 0 else 500
-        routes = await self._get_detailed_routes(route, budget_per_day, city)
+        每天的时长 = 各景点游玩时长 + 路上时间 + 等待开门时间（含从酒店出发和返回），不超过 day_hours；
+        景点有营业时间（opentime）时，游玩必须在营业时段内开始并结束。
+        总时长不够或营业时间冲突时放弃部分景点并在 unassigned 中返回
+        
+        Args:
+            attractions: 景点列表（需包含lng/lat，duration_hours为游玩时长，opentime为营业时间）
+            days: 天数
+            hotel: 酒店 {'name', 'lng', 'lat'}，缺省时以景点中心为每天的起终点
+            budget: 总预算
+            city: 城市名称
+            day_hours: 每天可用时长（小时），缺省为 VRP_DAY_HOURS
+            
+        Returns:
+            {'days': [{'day', 'attractions', 'start_times', 'routes', 'summary', 'hours'}], 'unassigned': [...],
+             'depot': 酒店, 'algorithm': {...}}，start_times 为各景点的开始时间（如 '09:40'）
+        """
+        if hotel is None or not hotel.get('lng') or not hotel.get('lat'):
+            lng, lat = np.mean([(a['lng'], a['lat']) for a in attractions], axis=0) if attractions else (0.0, 0.0)
+            hotel = {'name': '景点中心', 'lng': float(lng), 'lat': float(lat)}
         
-        # 计算统计信息
-        summary = self._calculate_summary(route, routes)
+        budget_per_day = budget / days if days > 0 else 500
+        budget_tight = budget_per_day < 300
+        nodes = [hotel] + attractions
+        time_matrix = self._build_time_matrix(nodes, budget_tight, city)
+        service_times = [0.0] + [
+            float(a.get('duration_hours') or settings.VRP_DEFAULT_VISIT_HOURS) * 3600 for a in attractions
+        ]
+        capacity = (day_hours or settings.VRP_DAY_HOURS) * 3600
+        day_start = parse_clock(settings.VRP_DAY_START)
+        time_windows = [None] + [
+            self._visit_windows(a.get('opentime'), service, day_start, capacity)
+            for a, service in zip(attractions, service_times[1:])
+        ]
+        time_limit = min(self.time_limit, max(1.0, len(attractions) * settings.TSP_TIME_PER_NODE))
+        
+        print(f"多天规划：{len(attractions)}个景点分配到{days}天（每天{capacity / 3600:g}小时）...")
+        solve_start = time.perf_counter()
+        day_nodes, day_starts, dropped = await get_solver_pool().run(
+            solve_vrp_ortools, time_matrix, service_times, days, capacity, time_limit, time_windows,
+            token=SolveCancelToken()
+        )
+        solve_ms = (time.perf_counter() - solve_start) * 1000
+        if dropped:
+            print(f"多天规划：{len(dropped)}个景点超出每日时长或营业时间冲突，未能安排")
+        
+        async def build_day(day: int, route: List[int], starts: List[int]) -> Dict:
+            day_attractions = [attractions[node - 1] for node in route]
+            routing_start = time.perf_counter()
+            routes = await self._get_detailed_routes(day_attractions, budget_per_day, city)
+            routing_ms = (time.perf_counter() - routing_start) * 1000
+            # 当天时长：最后一个景点结束后回到酒店
+            seconds = starts[-1] + service_times[route[-1]] + time_matrix[route[-1], 0] if route else 0.0
+            return {
+                'day': day,
+                'attractions': day_attractions,
+                'start_times': [format_clock(day_start + t) for t in starts],
+                'routes': routes,
+                'summary': self._calculate_summary(day_attractions, routes, routing_ms),
+                'hours': round(seconds / 3600, 2)
+            }
+        
+        day_plans = await asyncio.gather(*(
+            build_day(d + 1, route, starts) for d, (route, starts) in enumerate(zip(day_nodes, day_starts))
+        ))
         
         return {
-            'attractions': route,
-            'routes': routes,
-            'summary': summary,
-            'algorithm': 'greedy'
+            'days': list(day_plans),
+            'unassigned': [attractions[node - 1] for node in dropped],
+            'depot': hotel,
+            'algorithm': {
+                'solver': 'vrp_ortools',
+                'n': len(attractions),
+                'days': days,
+                'solve_ms': round(solve_ms, 1),
+                'optimal': False
+            }
         }
     
+    def _visit_windows(
+        self,
+        opentime: Optional[str],
+        duration: float,
+        day_start: int,
+        capacity: float
+    ) -> Optional[List[Tuple[int, int]]]:
+        """
+        把营业时间换算为VRP时间窗（距每天出发时刻的秒数）
+        
+        Returns:
+            可开始游玩的时段列表；不限制时为None，当天无法安排时为空列表
+        """
+        windows = visit_start_windows(parse_opentime(opentime), duration)
+        if windows is None:
+            return None
+        result = []
+        for earliest, latest in windows:
+            earliest, latest = max(earliest - day_start, 0), min(latest - day_start, int(capacity - duration))
+            if earliest <= latest:
+                result.append((earliest, latest))
+        return result
+    
+    def schedule_day(self, attractions: List[Dict], budget: float = 5000, days: int = 3, city: str = "北京") -> Dict:
+        """
+        按给定顺序为一天的景点排出开始时间（不改变顺序）
+        
+        从 VRP_DAY_START 出发，依次加上路上时间，早于开门时等到开门；赶不上营业时间的景点记为冲突
+        
+        Args:
+            attractions: 当天景点（按游览顺序，duration_hours为游玩时长，opentime为营业时间）
+            budget: 总预算（用于按交通方式估算路上时间）
+            days: 天数
+            city: 城市名称
+            
+        Returns:
+            {'start_times': ['09:00', ...], 'conflicts': [冲突的景点名称]}
+        """
+        budget_tight = (budget / days if days > 0 else 500) < 300
+        time_matrix = self._build_time_matrix(attractions, budget_tight, city) if attractions else None
+        clock = parse_clock(settings.VRP_DAY_START)
+        start_times, conflicts = [], []
+        for i, attraction in enumerate(attractions):
+            if i > 0:
+                clock += time_matrix[i - 1, i]
+            duration = float(attraction.get('duration_hours') or settings.VRP_DEFAULT_VISIT_HOURS) * 3600
+            windows = visit_start_windows(parse_opentime(attraction.get('opentime')), duration)
+            if windows is not None:
+                start = next((max(clock, earliest) for earliest, latest in windows if latest >= clock), None)
+                if start is None:
+                    conflicts.append(attraction.get('name', ''))
+                else:
+                    clock = start
+            start_times.append(format_clock(clock))
+            clock += duration
+        return {'start_times': start_times, 'conflicts': conflicts}
+    
+    def _build_time_matrix(self, nodes: List[Dict], budget_tight: bool, city: str) -> np.ndarray:
+        """
+        路上时间矩阵（秒）：按直线距离选择交通方式（与获取详细路线时的规则一致）后估算时间
+        
+        Args:
+            nodes: 地点列表（酒店 + 景点）
+            budget_tight: 是否预算紧张
+            city: 默认城市（地点未标注city时视为同城）
+        """
+        distance = haversine_matrix(nodes)
+        n = len(nodes)
+        times = np.zeros((n, n))
+        for i in range(n):
+            for j in range(n):
+                if i == j:
+                    continue
+                is_intercity = nodes[i].get('city', city) != nodes[j].get('city', city)
+                _, mode = self._decide_transport_mode(distance[i, j], budget_tight, is_intercity=is_intercity)
+                times[i, j] = self._estimate_duration(distance[i, j], mode)
+        return times
+    
     async def _build_distance_matrix(self, attractions: List[Dict]) -> np.ndarray:
         """
         构建距离矩阵
@@ -142,86 +333,124 @@ class RoutePlanner:
         Returns:
             距离矩阵（n x n）
         """
-        n = len(attractions)
-        matrix = np.zeros((n, n))
+        # 使用直线距离（Haversine公式，一次向量化计算整个矩阵）
+        # 真实驾车数据由 _build_hybrid_matrix 在此基础上替换
+        matrix = haversine_matrix(attractions)
+        print(f"使用直线距离构建矩阵完成")
         
-        # 提取坐标
-        origins = [(a['lng'], a['lat']) for a in attractions]
-        destinations = origins
+        return matrix
+    
+    async def _build_hybrid_matrix(
+        self,
+        attractions: List[Dict],
+        straight: np.ndarray,
+        city: str
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        构建稀疏混合代价矩阵
+        
+        只为每个景点与其k个最近邻之间的点对（双向）获取高德真实驾车距离/时间（已缓存的点对和路段直接复用），
+        上游开销为 O(n·k) 个点对而不是 O(n²)；其余点对按本次真实点对标定的城市绕行系数
+        （真实距离/直线距离、真实时间/直线距离的中位数）由直线距离换算
+        
+        Args:
+            attractions: 景点列表
+            straight: 直线距离矩阵
+            city: 城市名称（用于记忆该城市的绕行系数）
+            
+        Returns:
+            {'distance': 距离矩阵(米), 'duration': 时间矩阵(秒)}，获取失败时返回None
+        """
+        n = len(attractions)
+        points = [(a['lng'], a['lat']) for a in attractions]
+        knn = grid_knn(project_xy(points), settings.TSP_HYBRID_K)
+        pairs = sorted({(i, int(j)) for i in range(n) for j in knn[i]} | {(int(j), i) for i in range(n) for j in knn[i]})
         
-        # 使用直线距离（步行距离计算，直线距离更合理）
-        # 注意：高德距离API只支持驾车(type=1)，不支持步行(type=3)
-        # 对于步行场景，使用直线距离更合理且高效
         try:
-            for i in range(n):
-                for j in range(n):
-                    if i != j:
-                        # 使用Haversine公式计算地球表面两点直线距离
-                        matrix[i][j] = self.map_service.calculate_distance(
-                            origins[i], origins[j]
-                        )
-                    else:
-                        matrix[i][j] = 0
-            print(f"使用直线距离构建矩阵完成")
+            result = await self.map_service.get_distance_pairs(points, points, pairs, type=1)
         except Exception as e:
-            print(f"计算距离失败: {e}")
-            raise
+            print(f"获取近邻驾车数据失败，使用直线距离: {e}")
+            return None
+        
+        real = ~np.isnan(result['distance']) & (straight > 0)
+        if real.any():
+            detour = float(np.median(result['distance'][real] / straight[real]))
+            seconds_per_meter = float(np.median(result['duration'][real] / straight[real]))
+            # 与该城市以往的标定值平滑，真实点对很少时也比较稳定
+            previous = _city_calibration.get(city)
+            if previous:
+                detour = (detour + previous[0]) / 2
+                seconds_per_meter = (seconds_per_meter + previous[1]) / 2
+            _city_calibration[city] = (detour, seconds_per_meter)
+        elif city in _city_calibration:
+            detour, seconds_per_meter = _city_calibration[city]
+        else:
+            print("未获取到近邻驾车数据，使用直线距离")
+            return None
+        
+        distance = np.where(real, result['distance'], straight * detour)
+        duration = np.where(real, result['duration'], straight * seconds_per_meter)
+        np.fill_diagonal(distance, 0)
+        np.fill_diagonal(duration, 0)
+        print(f"混合矩阵构建完成（真实点对{int(real.sum())}/{n * (n - 1)}，缓存命中{result['cached_pairs']}对，"
+              f"请求{result['api_requests']}次，绕行系数{detour:.2f}，每公里{seconds_per_meter * 1000 / 60:.1f}分钟）")
+        return {'distance': distance, 'duration': duration}
+    
+    def _solve_exact(self, distance_matrix: np.ndarray, token: SolveCancelToken = None) -> List[int]:
+        """
+        状态压缩DP求精确最优解（同步，在求解线程池中执行）
         
-        return matrix
+        Args:
+            distance_matrix: 距离矩阵
+            token: 取消令牌（DP毫秒级完成，不需要中止）
+            
+        Returns:
+            最优访问顺序的索引列表
+        """
+        route, objective = solve_tsp_exact(distance_matrix)
+        print(f"精确求解完成，目标值：{objective:.0f}")
+        return route
     
-    def _solve_tsp(self, distance_matrix: np.ndarray) -> List[int]:
+    def _solve_tsp(self, distance_matrix: np.ndarray, token: SolveCancelToken = None) -> List[int]:
         """
-        使用OR-Tools求解TSP
+        使用OR-Tools求解TSP（同步，在求解线程池中执行）
         
         Args:
             distance_matrix: 距离矩阵
+            token: 取消令牌（客户端断开时中止求解）
             
         Returns:
             最优访问顺序的索引列表
         """
         n = len(distance_matrix)
-        
-        # 创建路由模型
-        manager = pywrapcp.RoutingIndexManager(n, 1, 0)
-        routing = pywrapcp.RoutingModel(manager)
-        
-        # 定义距离回调
-        def distance_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            return int(distance_matrix[from_node][to_node])
-        
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-        
-        # 设置搜索参数
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
-        search_parameters.time_limit.seconds = self.time_limit
+        # 引导局部搜索不会证明最优，总会用满时间限制，因此按景点数缩放
+        time_limit = min(self.time_limit, max(1.0, n * settings.TSP_TIME_PER_NODE))
         
         # 求解
-        print(f"开始求解TSP（时间限制：{self.time_limit}秒）...")
-        solution = routing.SolveWithParameters(search_parameters)
+        print(f"开始求解TSP（时间限制：{time_limit:g}秒）...")
+        route, objective = solve_tsp_ortools(distance_matrix, time_limit, open_path=True, token=token)
         
         # 提取路径
-        if solution:
-            route = []
-            index = routing.Start(0)
-            while not routing.IsEnd(index):
-                route.append(manager.IndexToNode(index))
-                index = solution.Value(routing.NextVar(index))
-            
-            print(f"TSP求解完成，总距离：{solution.ObjectiveValue()} 米")
+        if route:
+            print(f"TSP求解完成，目标值：{objective}")
             return route
         else:
             print("TSP求解失败，返回原顺序")
             return list(range(n))
     
+    def _solve_large(self, attractions: List[Dict], token: SolveCancelToken = None) -> List[int]:
+        """
+        大规模近似求解：网格近邻构造 + 2-opt/Or-opt（同步，在求解线程池中执行）
+        
+        Args:
+            attractions: 景点列表（只用坐标，不构建距离矩阵）
+            token: 取消令牌（局部搜索有固定时间预算，不需要中止）
+            
+        Returns:
+            访问顺序的索引列表
+        """
+        return solve_tsp_large(attractions, settings.TSP_LOCAL_SEARCH_BUDGET)
+    
     async def _get_detailed_routes(
         self, 
         attractions: List[Dict], 
@@ -244,165 +473,179 @@ class RoutePlanner:
         Returns:
             路线列表（包含真实的距离、时间、费用数据）
         """
-        routes = []
         budget_tight = budget_per_day < 300  # 预算紧张阈值
         
         # 获取城市citycode（智能查找，支持100+城市）
         city_code = get_citycode(city)
         
-        for i in range(len(attractions) - 1):
-            origin = (attractions[i]['lng'], attractions[i]['lat'])
-            destination = (attractions[i+1]['lng'], attractions[i+1]['lat'])
-            
-            # 先计算直线距离，用于决策交通方式
-            straight_distance = self.map_service.calculate_distance(origin, destination)
-            
-            # 检查是否跨城市
-            from_city = attractions[i].get('city', city)
-            to_city = attractions[i+1].get('city', city)
-            is_intercity = from_city != to_city
-            
-            # 智能决策交通方式（考虑跨城市情况）
-            _, transport_type = self._decide_transport_mode(
-                straight_distance, 
-                budget_tight,
-                is_intercity=is_intercity
-            )
+        # 各路段并发获取（限制并发数），结果按路段顺序返回
+        semaphore = asyncio.Semaphore(settings.ROUTE_LEG_CONCURRENCY)
+        
+        async def fetch(i: int) -> Dict:
+            async with semaphore:
+                return await self._get_leg_route(attractions, i, city, city_code, budget_tight)
+        
+        return list(await asyncio.gather(*(fetch(i) for i in range(len(attractions) - 1))))
+    
+    async def _get_leg_route(
+        self,
+        attractions: List[Dict],
+        i: int,
+        city: str,
+        city_code: str,
+        budget_tight: bool
+    ) -> Dict:
+        """
+        获取第i段（attractions[i] -> attractions[i+1]）的详细路线，失败时仅该路段使用直线距离估算
+        
+        Returns:
+            路线信息（含 latency_ms：该路段的获取耗时）
+        """
+        start_time = time.perf_counter()
+        origin = (attractions[i]['lng'], attractions[i]['lat'])
+        destination = (attractions[i+1]['lng'], attractions[i+1]['lat'])
+        
+        # 先计算直线距离，用于决策交通方式
+        straight_distance = self.map_service.calculate_distance(origin, destination)
+        
+        # 检查是否跨城市
+        from_city = attractions[i].get('city', city)
+        to_city = attractions[i+1].get('city', city)
+        is_intercity = from_city != to_city
+        
+        # 智能决策交通方式（考虑跨城市情况）
+        _, transport_type = self._decide_transport_mode(
+            straight_distance, 
+            budget_tight,
+            is_intercity=is_intercity
+        )
+        
+        try:
+            # 根据交通方式调用不同的高德API
+            if transport_type == '步行':
+                # 调用高德步行路线API (v5，带路段缓存)
+                route_data = await self.route_service.get_leg(origin, destination, 'walking')
+                
+                if route_data:
+                    route = {
+                        'from_idx': i,
+                        'to_idx': i + 1,
+                        'from_name': attractions[i]['name'],
+                        'to_name': attractions[i+1]['name'],
+                        'distance': route_data['distance'],  # 真实距离
+                        'duration': route_data['duration'],  # 真实时间
+                        'mode': '步行',
+                        'cost': 0,  # 步行免费
+                        'polyline': route_data.get('polyline', ''),
+                        'suggestion': self._get_transport_suggestion(
+                            route_data['distance'], 
+                            '步行',
+                            budget_tight
+                        )
+                    }
+                    print(f"  {attractions[i]['name']} → {attractions[i+1]['name']}: "
+                          f"{route_data['distance']/1000:.1f}km, 步行, 免费 [高德API]")
+                else:
+                    raise Exception("步行路线API返回空")
             
-            try:
-                # 根据交通方式调用不同的高德API
-                if transport_type == '步行':
-                    # 调用高德步行路线API (v5)
-                    route_data = await self.route_service.get_walking_route(origin, destination)
-                    
-                    if route_data:
-                        routes.append({
-                            'from_idx': i,
-                            'to_idx': i + 1,
-                            'from_name': attractions[i]['name'],
-                            'to_name': attractions[i+1]['name'],
-                            'distance': route_data['distance'],  # 真实距离
-                            'duration': route_data['duration'],  # 真实时间
-                            'mode': '步行',
-                            'cost': 0,  # 步行免费
-                            'polyline': route_data.get('polyline', ''),
-                            'suggestion': self._get_transport_suggestion(
-                                route_data['distance'], 
-                                '步行',
-                                budget_tight
-                            )
-                        })
-                        print(f"  {attractions[i]['name']} → {attractions[i+1]['name']}: "
-                              f"{route_data['distance']/1000:.1f}km, 步行, 免费 [高德API]")
-                    else:
-                        raise Exception("步行路线API返回空")
+            elif transport_type in ['公交', '地铁', '地铁/公交']:
+                # 调用高德公交路线API (v5，带路段缓存，取推荐方案)
+                plan = await self.route_service.get_leg(
+                    origin, 
+                    destination,
+                    'transit',
+                    citycode=city_code  # 使用真实城市code
+                )
                 
-                elif transport_type in ['公交', '地铁', '地铁/公交']:
-                    # 调用高德公交路线API (v5)
-                    route_data = await self.route_service.get_transit_route(
-                        origin, 
-                        destination,
-                        city1=city_code,  # 使用真实城市code
-                        city2=city_code
-                    )
-                    
-                    if route_data and route_data.get('plans'):
-                        # 取第一个方案（推荐方案）
-                        plan = route_data['plans'][0]
-                        
-                        routes.append({
-                            'from_idx': i,
-                            'to_idx': i + 1,
-                            'from_name': attractions[i]['name'],
-                            'to_name': attractions[i+1]['name'],
-                            'distance': plan['distance'],  # 真实距离
-                            'duration': plan['duration'],  # 真实时间
-                            'mode': transport_type,
-                            'cost': plan['transit_fee'],  # 真实公交费用
-                            'polyline': '',
-                            'lines': plan.get('lines', []),  # 乘坐线路
-                            'suggestion': self._get_transport_suggestion(
-                                plan['distance'], 
-                                transport_type,
-                                budget_tight
-                            )
-                        })
-                        print(f"  {attractions[i]['name']} → {attractions[i+1]['name']}: "
-                              f"{plan['distance']/1000:.1f}km, {transport_type}, ¥{plan['transit_fee']:.1f} [高德API]")
-                    else:
-                        raise Exception("公交路线API返回空")
+                if plan:
+                    route = {
+                        'from_idx': i,
+                        'to_idx': i + 1,
+                        'from_name': attractions[i]['name'],
+                        'to_name': attractions[i+1]['name'],
+                        'distance': plan['distance'],  # 真实距离
+                        'duration': plan['duration'],  # 真实时间
+                        'mode': transport_type,
+                        'cost': plan['cost'],  # 真实公交费用
+                        'polyline': '',
+                        'lines': plan.get('lines', []),  # 乘坐线路
+                        'suggestion': self._get_transport_suggestion(
+                            plan['distance'], 
+                            transport_type,
+                            budget_tight
+                        )
+                    }
+                    print(f"  {attractions[i]['name']} → {attractions[i+1]['name']}: "
+                          f"{plan['distance']/1000:.1f}km, {transport_type}, ¥{plan['cost']:.1f} [高德API]")
+                else:
+                    raise Exception("公交路线API返回空")
+            
+            elif transport_type in ['出租车', '出租车/网约车']:
+                # 调用高德驾车路线API (v5，带路段缓存) - 包含预估出租车费用
+                route_data = await self.route_service.get_leg(origin, destination, 'driving')
                 
-                elif transport_type in ['出租车', '出租车/网约车']:
-                    # 调用高德驾车路线API (v5) - 包含预估出租车费用
-                    route_data = await self.route_service.get_driving_route(origin, destination)
+                if route_data:
+                    taxi_cost = route_data['cost']
+                    if taxi_cost == 0:
+                        # 使用简单公式估算：起步价13 + 2.3元/km
+                        km = route_data['distance'] / 1000
+                        taxi_cost = 13 + km * 2.3
                     
-                    if route_data:
-                        # 高德API返回的taxi_cost可能为空或字符串，需要转换
-                        taxi_cost = route_data.get('taxi_cost', 0)
-                        try:
-                            taxi_cost = float(taxi_cost) if taxi_cost else 0
-                        except (ValueError, TypeError):
-                            taxi_cost = 0
-                        
-                        if taxi_cost == 0:
-                            # 使用简单公式估算：起步价13 + 2.3元/km
-                            km = route_data['distance'] / 1000
-                            taxi_cost = 13 + km * 2.3
-                        
-                        routes.append({
-                            'from_idx': i,
-                            'to_idx': i + 1,
-                            'from_name': attractions[i]['name'],
-                            'to_name': attractions[i+1]['name'],
-                            'distance': route_data['distance'],  # 真实距离
-                            'duration': route_data['duration'],  # 真实时间
-                            'mode': transport_type,
-                            'cost': taxi_cost,  # 真实/估算出租车费用
-                            'polyline': route_data.get('polyline', ''),
-                            'tolls': route_data.get('tolls', 0),  # 过路费
-                            'traffic_lights': route_data.get('traffic_lights', 0),  # 红绿灯数
-                            'suggestion': self._get_transport_suggestion(
-                                route_data['distance'], 
-                                transport_type,
-                                budget_tight
-                            )
-                        })
-                        print(f"  {attractions[i]['name']} → {attractions[i+1]['name']}: "
-                              f"{route_data['distance']/1000:.1f}km, {transport_type}, ¥{taxi_cost:.1f} [高德API]")
-                    else:
-                        raise Exception("驾车路线API返回空")
-                
+                    route = {
+                        'from_idx': i,
+                        'to_idx': i + 1,
+                        'from_name': attractions[i]['name'],
+                        'to_name': attractions[i+1]['name'],
+                        'distance': route_data['distance'],  # 真实距离
+                        'duration': route_data['duration'],  # 真实时间
+                        'mode': transport_type,
+                        'cost': taxi_cost,  # 真实/估算出租车费用
+                        'polyline': route_data.get('polyline', ''),
+                        'tolls': route_data.get('tolls', 0),  # 过路费
+                        'traffic_lights': route_data.get('traffic_lights', 0),  # 红绿灯数
+                        'suggestion': self._get_transport_suggestion(
+                            route_data['distance'], 
+                            transport_type,
+                            budget_tight
+                        )
+                    }
+                    print(f"  {attractions[i]['name']} → {attractions[i+1]['name']}: "
+                          f"{route_data['distance']/1000:.1f}km, {transport_type}, ¥{taxi_cost:.1f} [高德API]")
                 else:
-                    # 默认使用步行
-                    raise Exception(f"未知交通方式: {transport_type}")
-                
-            except Exception as e:
-                print(f"⚠️  获取路线失败 {attractions[i]['name']} -> {attractions[i+1]['name']}: {e}")
-                print(f"  使用备用方案：直线距离估算")
-                
-                # 使用直线距离作为备用
-                estimated_duration = self._estimate_duration(straight_distance, transport_type)
-                estimated_cost = self._estimate_transport_cost(straight_distance, transport_type)
-                
-                routes.append({
-                    'from_idx': i,
-                    'to_idx': i + 1,
-                    'from_name': attractions[i]['name'],
-                    'to_name': attractions[i+1]['name'],
-                    'distance': straight_distance,
-                    'duration': estimated_duration,
-                    'mode': transport_type,
-                    'cost': estimated_cost,
-                    'polyline': '',
-                    'is_estimated': True,  # 标记为估算数据
-                    'suggestion': self._get_transport_suggestion(
-                        straight_distance, 
-                        transport_type,
-                        budget_tight
-                    )
-                })
-        
-        return routes
+                    raise Exception("驾车路线API返回空")
+            
+            else:
+                # 默认使用步行
+                raise Exception(f"未知交通方式: {transport_type}")
+        
+        except Exception as e:
+            print(f"⚠️  获取路线失败 {attractions[i]['name']} -> {attractions[i+1]['name']}: {e}")
+            print(f"  使用备用方案：直线距离估算")
+            
+            # 使用直线距离作为备用
+            estimated_duration = self._estimate_duration(straight_distance, transport_type)
+            estimated_cost = self._estimate_transport_cost(straight_distance, transport_type)
+            
+            route = {
+                'from_idx': i,
+                'to_idx': i + 1,
+                'from_name': attractions[i]['name'],
+                'to_name': attractions[i+1]['name'],
+                'distance': straight_distance,
+                'duration': estimated_duration,
+                'mode': transport_type,
+                'cost': estimated_cost,
+                'polyline': '',
+                'is_estimated': True,  # 标记为估算数据
+                'suggestion': self._get_transport_suggestion(
+                    straight_distance, 
+                    transport_type,
+                    budget_tight
+                )
+            }
+        
+        route['latency_ms'] = round((time.perf_counter() - start_time) * 1000, 1)
+        return route
     
     def _decide_transport_mode(
         self, 
@@ -554,13 +797,14 @@ class RoutePlanner:
         
         return f"距离{km:.1f}km，建议{mode}"
     
-    def _calculate_summary(self, attractions: List[Dict], routes: List[Dict]) -> Dict:
+    def _calculate_summary(self, attractions: List[Dict], routes: List[Dict], routing_ms: float = None) -> Dict:
         """
         计算行程摘要
         
         Args:
             attractions: 景点列表
             routes: 路线列表
+            routing_ms: 获取详细路线的总耗时（毫秒，各路段并发获取）
             
         Returns:
             摘要信息
@@ -585,15 +829,90 @@ class RoutePlanner:
             except:
                 pass
         
+        # 路线获取耗时：各路段并发获取，总耗时取决于最慢的路段而不是各段之和
+        legs_ms = [r.get('latency_ms', 0) for r in routes]
+        
         return {
             'num_attractions': len(attractions),
             'total_distance_km': round(total_distance / 1000, 2),
             'total_duration_hours': round(total_duration / 3600, 2),
-            'total_cost': total_cost
+            'total_cost': total_cost,
+            'routing_latency': {
+                'total_ms': round(routing_ms, 1) if routing_ms is not None else None,
+                'slowest_leg_ms': max(legs_ms, default=0),
+                'sum_of_legs_ms': round(sum(legs_ms), 1),
+                'legs_ms': legs_ms,
+                'estimated_legs': sum(1 for r in routes if r.get('is_estimated'))
+            }
         }
     
-    async def _calculate_total_distance(self, attractions: List[Dict], city: str = "北京") -> float:
-        """计算按原始顺序的总距离"""
-        routes = await self._get_detailed_routes(attractions, city=city)
-        return sum(r['distance'] for r in routes)
-
+    def _calculate_optimization_rate(
+        self,
+        attractions: List[Dict],
+        optimal_indices: List[int],
+        routes: List[Dict],
+        distance_matrix: Optional[np.ndarray],
+        matrix_source: str,
+        budget_per_day: float,
+        city: str = "北京"
+    ) -> Dict:
+        """
+        计算优化率（优化后路程相对原始顺序的节省比例）
+        
+        原始顺序的每一段都已在路段缓存中、且优化后的路线全部来自高德时，用真实路线距离对比；
+        否则用TSP使用的距离矩阵对比（混合矩阵取距离平面，即使求解按耗时优化；大规模求解没有矩阵时按直线距离逐段计算）。
+        两种方式都以米为单位，都不会额外请求高德。
+        
+        Returns:
+            {'optimization_rate': 优化率(%), 'optimization_basis': 'api' | 'matrix', 'distance_matrix': 'hybrid' | 'straight'}
+        """
+        result = {'optimization_basis': 'matrix', 'distance_matrix': matrix_source}
+        
+        original_distance = None
+        if routes and not any(r.get('is_estimated') for r in routes):
+            budget_tight = budget_per_day < 300
+            city_code = get_citycode(city)
+            legs = [
+                self._peek_route_distance(attractions[i], attractions[i + 1], city, city_code, budget_tight)
+                for i in range(len(attractions) - 1)
+            ]
+            if all(d is not None for d in legs):
+                original_distance = sum(legs)
+                optimized_distance = sum(r['distance'] for r in routes)
+                result['optimization_basis'] = 'api'
+        
+        if original_distance is None and distance_matrix is None:
+            original_distance = points_path_length(attractions, range(len(attractions)))
+            optimized_distance = points_path_length(attractions, optimal_indices)
+        elif original_distance is None:
+            original_distance = path_length(distance_matrix, range(len(attractions)))
+            optimized_distance = path_length(distance_matrix, optimal_indices)
+        
+        if original_distance > 0:
+            result['optimization_rate'] = (original_distance - optimized_distance) / original_distance * 100
+        return result
+    
+    def _peek_route_distance(
+        self,
+        origin_attraction: Dict,
+        destination_attraction: Dict,
+        city: str,
+        city_code: str,
+        budget_tight: bool
+    ) -> Optional[float]:
+        """按 _get_leg_route 的交通方式选择规则，只从路段缓存读取该段的真实距离，未缓存返回None"""
+        origin = (origin_attraction['lng'], origin_attraction['lat'])
+        destination = (destination_attraction['lng'], destination_attraction['lat'])
+        straight_distance = self.map_service.calculate_distance(origin, destination)
+        is_intercity = origin_attraction.get('city', city) != destination_attraction.get('city', city)
+        
+        _, transport_type = self._decide_transport_mode(straight_distance, budget_tight, is_intercity=is_intercity)
+        if transport_type == '步行':
+            leg = self.route_service.peek_leg(origin, destination, 'walking')
+        elif transport_type in ['公交', '地铁', '地铁/公交']:
+            leg = self.route_service.peek_leg(origin, destination, 'transit', citycode=city_code)
+        elif transport_type in ['出租车', '出租车/网约车']:
+            leg = self.route_service.peek_leg(origin, destination, 'driving')
+        else:
+            leg = None  # 跨城交通只有估算，没有真实路线
+        return leg['distance'] if leg else None
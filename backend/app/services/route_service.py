@@ -1,10 +1,19 @@
 """
 路线规划服务 - 使用高德地图路径规划2.0（v5 API）
 """
-import httpx
 from typing import Dict, Optional, Tuple, List
 from enum import Enum
 
+from app.core.config import settings
+from app.core.amap_client import AmapClient, get_amap_client
+from app.core.ttl_cache import TTLCache, MISSING
+
+# 路段缓存（进程内共享）：同一起终点的路线在不同用户间反复出现
+_leg_cache = TTLCache('route_leg', max_entries=settings.ROUTE_LEG_CACHE_MAX_ENTRIES)
+
+# 坐标吸附网格（度），0.0001度约10米
+LEG_GRID = 0.0001
+
 
 class DrivingStrategy(Enum):
     """驾车策略"""
@@ -40,6 +49,146 @@ class RouteService:
         self.api_key = "your_key"
         self.base_url = "https://restapi.amap.com/v5"
     
+    @property
+    def http(self) -> AmapClient:
+        """共享的高德HTTP客户端（连接池由应用lifespan管理）"""
+        return get_amap_client()
+    
+    @staticmethod
+    def _snap(point: Tuple[float, float]) -> str:
+        """把坐标吸附到约10米的网格上"""
+        lng = round(point[0] / LEG_GRID) * LEG_GRID
+        lat = round(point[1] / LEG_GRID) * LEG_GRID
+        return f"{lng:.4f},{lat:.4f}"
+    
+    @staticmethod
+    def _leg_params(mode: str, strategy: Optional[int], citycode: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+        """补齐路段查询的默认策略/城市码（驾车默认32，公交默认0、北京），get_leg 与缓存键共用"""
+        if mode == "driving" and strategy is None:
+            strategy = DrivingStrategy.DEFAULT.value
+        elif mode == "transit":
+            strategy = TransitStrategy.RECOMMEND.value if strategy is None else strategy
+            citycode = citycode or "010"
+        return strategy, citycode
+    
+    def leg_cache_key(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        mode: str,
+        strategy: int = None,
+        citycode: str = None
+    ) -> str:
+        """路段缓存键：(起点, 终点, 出行方式, 策略, 城市码)，未指定的策略/城市码按get_leg的默认值补齐"""
+        strategy, citycode = self._leg_params(mode, strategy, citycode)
+        return f"{mode}|{strategy}|{citycode or ''}|{self._snap(origin)}|{self._snap(destination)}"
+    
+    def peek_leg(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        mode: str,
+        strategy: int = None,
+        citycode: str = None
+    ) -> Optional[Dict]:
+        """只查缓存、不请求高德的路段查询，未缓存返回None"""
+        leg = _leg_cache.peek(self.leg_cache_key(origin, destination, mode, strategy, citycode))
+        return None if leg is MISSING else dict(leg)
+    
+    async def get_leg(
+        self,
+        origin: Tuple[float, float],
+        destination: Tuple[float, float],
+        mode: str = "walking",
+        strategy: int = None,
+        citycode: str = None
+    ) -> Optional[Dict]:
+        """
+        获取单个路段的精简信息（带缓存）
+        
+        Args:
+            origin: 起点 (lng, lat)
+            destination: 终点 (lng, lat)
+            mode: 出行方式 walking/driving/transit/bicycling/electrobike
+            strategy: 策略（驾车默认32，公交默认0）
+            citycode: 城市citycode（公交需要）
+            
+        Returns:
+            {
+                'distance': 距离(米),
+                'duration': 耗时(秒),
+                'cost': 费用(元)，驾车为预估出租车费用（可能为0）,
+                'polyline': 路线坐标串（可选）,
+                'lines': 公交线路（仅公交）,
+                'tolls': 过路费（仅驾车）,
+                'traffic_lights': 红绿灯数（仅驾车）
+            }
+        """
+        strategy, citycode = self._leg_params(mode, strategy, citycode)
+        cache_key = self.leg_cache_key(origin, destination, mode, strategy, citycode)
+        cached = _leg_cache.get(cache_key)
+        if cached is not MISSING:
+            return dict(cached)
+        
+        leg = None
+        if mode == "walking":
+            route = await self.get_walking_route(origin, destination)
+            if route:
+                leg = {
+                    'distance': route['distance'],
+                    'duration': route['duration'],
+                    'cost': 0,
+                    'polyline': route.get('polyline', '')
+                }
+        elif mode == "driving":
+            route = await self.get_driving_route(origin, destination, strategy=DrivingStrategy(strategy))
+            if route:
+                # 高德返回的taxi_cost可能为空或字符串
+                try:
+                    taxi_cost = float(route.get('taxi_cost') or 0)
+                except (ValueError, TypeError):
+                    taxi_cost = 0
+                leg = {
+                    'distance': route['distance'],
+                    'duration': route['duration'],
+                    'cost': taxi_cost,
+                    'polyline': route.get('polyline', ''),
+                    'tolls': route.get('tolls', 0),
+                    'traffic_lights': route.get('traffic_lights', 0)
+                }
+        elif mode == "transit":
+            route = await self.get_transit_route(
+                origin, destination,
+                city1=citycode, city2=citycode,
+                strategy=TransitStrategy(strategy)
+            )
+            if route and route.get('plans'):
+                plan = route['plans'][0]  # 推荐方案
+                leg = {
+                    'distance': plan['distance'],
+                    'duration': plan['duration'],
+                    'cost': plan['transit_fee'],
+                    'polyline': '',
+                    'lines': plan.get('lines', [])
+                }
+        elif mode == "bicycling":
+            route = await self.get_bicycling_route(origin, destination)
+            if route:
+                leg = {'distance': route['distance'], 'duration': route['duration'], 'cost': 0, 'polyline': route.get('polyline', '')}
+        elif mode == "electrobike":
+            route = await self.get_electrobike_route(origin, destination)
+            if route:
+                leg = {'distance': route['distance'], 'duration': route['duration'], 'cost': 0, 'polyline': route.get('polyline', '')}
+        
+        if leg is None:
+            return None
+        
+        if not settings.ROUTE_LEG_CACHE_POLYLINE:
+            leg['polyline'] = ''
+        ttls = settings.ROUTE_LEG_CACHE_TTLS
+        _leg_cache.set(cache_key, leg, ttl=ttls.get(mode, ttls.get('default', 3600)))
+        return dict(leg)
+    
     async def get_driving_route(
         self,
         origin: Tuple[float, float],
@@ -99,9 +248,7 @@ class RouteService:
             params['plate'] = plate
         
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 route = data.get('route', {})
@@ -163,9 +310,7 @@ class RouteService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 route = data.get('route', {})
@@ -230,9 +375,7 @@ class RouteService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 route = data.get('route', {})
@@ -319,9 +462,7 @@ class RouteService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 route = data.get('route', {})
@@ -369,9 +510,7 @@ class RouteService:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                response = await client.get(url, params=params)
-                data = response.json()
+            data = await self.http.get_json(url, params)
             
             if data.get('status') == '1':
                 route = data.get('route', {})
@@ -0,0 +1,114 @@
+"""
+TSP解缓存（与景点输入顺序无关）
+同一组景点会在创建行程、重新优化、Agent工具等入口被反复优化；
+缓存键取景点集合（POI id 或约1米精度的坐标，排序后拼接）+ 求解参数，命中时跳过矩阵构建和求解；
+求解用的是混合矩阵时一并缓存其距离平面，命中时优化率等统计与未命中时一致
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.ttl_cache import TTLCache, MISSING, make_cache_key
+
+_tour_cache = TTLCache('tsp_tour', max_entries=settings.TOUR_CACHE_MAX_ENTRIES, default_ttl=settings.TOUR_CACHE_TTL)
+
+
+def poi_key(poi: Dict) -> str:
+    """景点标识：优先使用POI id，否则使用坐标（保留5位小数）"""
+    if poi.get('id'):
+        return f"id:{poi['id']}"
+    return f"{float(poi['lng']):.5f},{float(poi['lat']):.5f}"
+
+
+def _cache_key(keys: List[str], params: Dict, closed: bool) -> str:
+    return make_cache_key('tour', {**params, 'closed': closed, 'pois': '|'.join(sorted(keys))})
+
+
+def get_cached_tour(pois: List[Dict], params: Dict, closed: bool = False) -> Optional[Dict]:
+    """
+    查找缓存的访问顺序，按本次的起点（pois[0]）旋转后映射为本次输入的下标
+
+    - 回路（closed）：从哪个点开始走代价都一样，旋转到起点即可
+    - 单程路径：终点不固定，从不同起点出发的最优路径不能互相翻转得到，按起点分别缓存
+
+    Args:
+        pois: 景点列表（第一个为起点）
+        params: 求解参数（求解器、优化目标等，不同参数的解不共用）
+        closed: 是否回到起点
+
+    Returns:
+        {
+            'order': 访问顺序（本次输入的下标）,
+            'distance_matrix': 求解时的距离矩阵（按本次输入的顺序，未缓存时为None）,
+            'matrix_source': 'hybrid' | 'straight'
+        }，未命中返回None
+    """
+    keys = [poi_key(p) for p in pois]
+    if len(set(keys)) != len(keys):
+        return None  # 有重复景点时无法一一对应
+    entry = _tour_cache.get(_cache_key(keys, params, closed))
+    if entry is MISSING:
+        return None
+
+    start = keys[0]
+    if closed:
+        path = entry['paths'][0]
+        k = path.index(start)
+        path = path[k:] + path[:k]
+    elif start in entry['paths']:
+        path = entry['paths'][start]
+    else:
+        return None
+
+    index = {key: i for i, key in enumerate(keys)}
+    distance_matrix = entry.get('distance_matrix')
+    if distance_matrix is not None:
+        # 缓存中按排序后的景点标识存放，换回本次输入的顺序
+        position = {key: i for i, key in enumerate(sorted(keys))}
+        idx = [position[key] for key in keys]
+        distance_matrix = distance_matrix[np.ix_(idx, idx)]
+    return {
+        'order': [index[key] for key in path],
+        'distance_matrix': distance_matrix,
+        'matrix_source': entry.get('matrix_source', 'straight')
+    }
+
+
+def set_cached_tour(
+    pois: List[Dict],
+    order: List[int],
+    params: Dict,
+    closed: bool = False,
+    distance_matrix: Optional[np.ndarray] = None,
+    matrix_source: str = 'straight'
+):
+    """
+    缓存求解得到的访问顺序
+
+    Args:
+        pois: 景点列表
+        order: 访问顺序（pois的下标）
+        params: 求解参数
+        closed: 是否回到起点
+        distance_matrix: 求解时的距离矩阵（按pois顺序；直线距离可随时重算，只需缓存混合矩阵）
+        matrix_source: 距离矩阵来源
+    """
+    keys = [poi_key(p) for p in pois]
+    if len(set(keys)) != len(keys) or len(order) != len(keys):
+        return
+    path = [keys[i] for i in order]
+    cache_key = _cache_key(keys, params, closed)
+
+    if closed:
+        entry = {'paths': [path]}
+    else:
+        entry = _tour_cache.peek(cache_key)
+        if entry is MISSING:
+            entry = {'paths': {}}
+        entry['paths'][path[0]] = path
+    entry['matrix_source'] = matrix_source
+    if distance_matrix is not None:
+        perm = sorted(range(len(keys)), key=keys.__getitem__)
+        entry['distance_matrix'] = np.asarray(distance_matrix)[np.ix_(perm, perm)]
+    _tour_cache.set(cache_key, entry)
@@ -0,0 +1,393 @@
+"""
+TSP求解函数（同步，供求解线程池调用）
+RoutePlanner 与 Agent 的 optimize_route 工具共用，避免各自维护一份OR-Tools求解代码
+"""
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
+
+from app.core.geometry import grid_knn, nearest_neighbor_order, project_xy
+from app.core.solver_pool import SolveCancelToken
+
+
+def solve_tsp_ortools(
+    distance_matrix: np.ndarray,
+    time_limit: float,
+    guided_local_search: bool = True,
+    open_path: bool = False,
+    token: Optional[SolveCancelToken] = None
+) -> Tuple[Optional[List[int]], Optional[int]]:
+    """
+    使用OR-Tools求解TSP（从下标0出发）
+
+    Args:
+        distance_matrix: 距离矩阵（米）
+        time_limit: 求解时间限制（秒）
+        guided_local_search: 是否使用引导局部搜索（会一直搜索到时间限制）
+        open_path: 不回到起点（回程距离记为0，目标值即单程路径长度）
+        token: 取消令牌，取消后搜索立即停止并返回当前最优解
+
+    Returns:
+        (访问顺序, 目标值)，无解时为 (None, None)
+    """
+    n = len(distance_matrix)
+    # 转为Python列表，回调中按下标取值比访问ndarray快
+    matrix = np.asarray(distance_matrix).astype(np.int64)
+    if open_path:
+        matrix[:, 0] = 0
+    matrix = matrix.tolist()
+
+    # 创建路由模型
+    manager = pywrapcp.RoutingIndexManager(n, 1, 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    # 定义距离回调
+    # 注意：使用Python回调而不是RegisterTransitMatrix，回调之间会释放GIL，求解线程不会长时间阻塞事件循环
+    def distance_callback(from_index, to_index):
+        return matrix[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+
+    # 设置搜索参数
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    )
+    if guided_local_search:
+        search_parameters.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+        )
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    if token is not None:
+        token.bind(routing)
+
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None, None
+
+    route = []
+    index = routing.Start(0)
+    while not routing.IsEnd(index):
+        route.append(manager.IndexToNode(index))
+        index = solution.Value(routing.NextVar(index))
+    return route, solution.ObjectiveValue()
+
+
+def solve_vrp_ortools(
+    time_matrix: np.ndarray,
+    service_times: List[float],
+    num_vehicles: int,
+    capacity: float,
+    time_limit: float,
+    time_windows: Optional[List[Optional[List[Tuple[int, int]]]]] = None,
+    token: Optional[SolveCancelToken] = None
+) -> Tuple[List[List[int]], List[List[int]], List[int]]:
+    """
+    使用OR-Tools求解带时间容量（和时间窗）的多车辆路径问题（下标0为车场）
+
+    每辆车的时间 = 各节点服务时间 + 节点间路上时间 + 等待时间（含从车场出发和返回），不超过capacity；
+    总容量不足或时间窗冲突时允许放弃节点（放弃惩罚远大于任何路线时间，只在排不下时才放弃）。
+    另加全局跨度成本，避免把所有节点都压到前几辆车上
+
+    Args:
+        time_matrix: 路上时间矩阵（秒）
+        service_times: 各节点服务时间（秒），车场为0
+        num_vehicles: 车辆数
+        capacity: 每辆车的时间容量（秒）
+        time_limit: 求解时间限制（秒）
+        time_windows: 各节点可开始服务的时段 [(最早, 最晚)]（距出发时刻的秒数）；
+            None为不限制，空列表表示无法安排
+        token: 取消令牌
+
+    Returns:
+        (每辆车的访问顺序（不含车场）, 对应的开始服务时刻（距出发的秒数）, 被放弃的节点)
+    """
+    n = len(time_matrix)
+    travel = np.rint(np.asarray(time_matrix, dtype=np.float64)).astype(np.int64)
+    service = np.rint(np.asarray(service_times, dtype=np.float64)).astype(np.int64)
+    # 从i出发到j的时间 = i的服务时间 + i到j的路上时间
+    transit = (travel + service[:, np.newaxis]).tolist()
+    capacity = int(capacity)
+
+    manager = pywrapcp.RoutingIndexManager(n, num_vehicles, 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    def time_callback(from_index, to_index):
+        return transit[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+
+    transit_callback_index = routing.RegisterTransitCallback(time_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    # 允许等待（松弛量），用于等景点开门
+    routing.AddDimension(transit_callback_index, capacity, capacity, True, 'Time')
+    time_dimension = routing.GetDimensionOrDie('Time')
+    time_dimension.SetGlobalSpanCostCoefficient(1)
+
+    penalty = capacity * (num_vehicles + 2)
+    for node in range(1, n):
+        index = manager.NodeToIndex(node)
+        routing.AddDisjunction([index], penalty)
+
+        windows = time_windows[node] if time_windows else None
+        if windows is None:
+            continue
+        if not windows:
+            routing.ActiveVar(index).SetValue(0)
+            continue
+        # 多个营业时段：先限制在首尾范围内，再去掉中间的空档
+        cumul = time_dimension.CumulVar(index)
+        cumul.SetRange(windows[0][0], windows[-1][1])
+        for (_, gap_start), (gap_end, _) in zip(windows, windows[1:]):
+            if gap_end - gap_start > 1:
+                cumul.RemoveInterval(gap_start + 1, gap_end - 1)
+
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+    )
+    search_parameters.local_search_metaheuristic = (
+        routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+    )
+    search_parameters.time_limit.FromMilliseconds(int(time_limit * 1000))
+
+    if token is not None:
+        token.bind(routing)
+
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return [[] for _ in range(num_vehicles)], [[] for _ in range(num_vehicles)], list(range(1, n))
+
+    routes = []
+    start_times = []
+    for vehicle in range(num_vehicles):
+        route = []
+        starts = []
+        index = solution.Value(routing.NextVar(routing.Start(vehicle)))
+        while not routing.IsEnd(index):
+            route.append(manager.IndexToNode(index))
+            # 取最早可行的开始时刻（不做无谓的等待）
+            starts.append(solution.Min(time_dimension.CumulVar(index)))
+            index = solution.Value(routing.NextVar(index))
+        routes.append(route)
+        start_times.append(starts)
+    visited = {node for route in routes for node in route}
+    return routes, start_times, [node for node in range(1, n) if node not in visited]
+
+
+def solve_tsp_exact(distance_matrix: np.ndarray, open_path: bool = True) -> Tuple[List[int], float]:
+    """
+    Held-Karp 状态压缩动态规划求精确最优解（从下标0出发）
+
+    按子集大小逐层计算，每层对所有子集和终点一次向量化求值；
+    n=13 时状态数为 4096x12，毫秒级完成。复杂度 O(2^n * n^2)，只适用于小规模
+
+    Args:
+        distance_matrix: 距离矩阵（米，可非对称）
+        open_path: 不回到起点（默认，行程按单程计算）
+
+    Returns:
+        (访问顺序, 总距离)
+    """
+    d = np.asarray(distance_matrix, dtype=np.float64)
+    n = len(d)
+    if n <= 2:
+        order = list(range(n))
+        cost = float(d[0, 1] + (0 if open_path else d[1, 0])) if n == 2 else 0.0
+        return order, cost
+
+    # 状态只包含下标1..n-1（起点0固定），dp[mask, k]：从0出发走遍mask、停在k的最短距离
+    m = n - 1
+    size = 1 << m
+    sub = d[1:, 1:]
+    bits = 1 << np.arange(m)
+    masks = np.arange(size)
+    popcount = ((masks[:, np.newaxis] & bits) > 0).sum(axis=1)
+
+    dp = np.full((size, m), np.inf)
+    parent = np.full((size, m), -1, dtype=np.int8)
+    dp[bits, np.arange(m)] = d[0, 1:]
+
+    for k in range(2, m + 1):
+        layer = masks[popcount == k]
+        member = (layer[:, np.newaxis] & bits) > 0
+        # prev[l, j]：去掉终点j之后的子集；cand[l, j, i] = dp[prev, i] + sub[i, j]
+        prev = layer[:, np.newaxis] ^ bits
+        cand = dp[prev] + sub.T[np.newaxis, :, :]
+        best = cand.argmin(axis=2)
+        cost = np.take_along_axis(cand, best[..., np.newaxis], axis=2)[..., 0]
+        cost[~member] = np.inf
+        dp[layer] = cost
+        parent[layer] = best
+
+    final = dp[size - 1] if open_path else dp[size - 1] + d[1:, 0]
+    end = int(np.argmin(final))
+    total = float(final[end])
+
+    # 回溯路径
+    path = []
+    mask = size - 1
+    while mask:
+        path.append(end + 1)
+        prev_end = int(parent[mask, end])
+        mask ^= 1 << end
+        end = prev_end
+    return [0] + path[::-1], total
+
+
+def _dist(xy: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """平面坐标下标数组之间的逐元素距离"""
+    diff = xy[a] - xy[b]
+    return np.hypot(diff[..., 0], diff[..., 1])
+
+
+def _pick_disjoint(gain: np.ndarray, lo: np.ndarray, hi: np.ndarray, limit: int = 256) -> List[int]:
+    """
+    从候选移动中按收益挑选一批位置区间互不重叠的移动
+
+    2-opt/Or-opt 移动只改变 [lo, hi] 区间内的位置，区间不重叠的移动互不影响，可以在同一轮中一起执行
+    """
+    candidates = np.flatnonzero(gain > 1e-6)
+    if len(candidates) == 0:
+        return []
+    candidates = candidates[np.argsort(-gain[candidates])[:limit]]
+    chosen = []
+    spans = []
+    for idx in candidates:
+        l, h = lo[idx], hi[idx]
+        if all(h < cl or l > ch for cl, ch in spans):
+            chosen.append(int(idx))
+            spans.append((l, h))
+    return chosen
+
+
+def _two_opt_pass(xy: np.ndarray, tour: np.ndarray, pos: np.ndarray, knn: np.ndarray) -> int:
+    """
+    一轮邻域2-opt：对每条边 (a, b) 和 a 的每个近邻 c，一次向量化计算连接 a-c 的收益
+
+    Returns:
+        执行的移动数
+    """
+    n = len(tour)
+    i = np.arange(n - 1)[:, np.newaxis]
+    a, b = tour[:-1], tour[1:]
+    c = knn[a]
+    p = pos[c]
+    tail = p == n - 1
+    d = tour[np.minimum(p + 1, n - 1)]
+
+    # p > i 时翻转 tour[i+1..p]，p < i 时翻转 tour[p+1..i]，新边都是 (a, c) 和 (b, d)；c为终点时只有 (a, c)
+    gain = _dist(xy, a, b)[:, np.newaxis] - _dist(xy, a[:, np.newaxis], c)
+    gain += np.where(tail, 0.0, _dist(xy, c, d) - _dist(xy, b[:, np.newaxis], d))
+    gain[np.abs(p - i) <= 1] = -np.inf
+
+    lo = np.minimum(i, p).ravel()
+    hi = (np.maximum(i, p) + 1).ravel()
+    moves = _pick_disjoint(gain.ravel(), lo, hi)
+    for m in moves:
+        s, e = lo[m] + 1, hi[m] - 1
+        tour[s:e + 1] = tour[s:e + 1][::-1].copy()
+        pos[tour[s:e + 1]] = np.arange(s, e + 1)
+    return len(moves)
+
+
+def _or_opt_pass(xy: np.ndarray, tour: np.ndarray, pos: np.ndarray, knn: np.ndarray) -> int:
+    """
+    一轮邻域Or-opt：把长度1~3的片段整体移到某个近邻旁边（保持片段方向）
+
+    - 插到片段首点的近邻 c 之后：c → 首 … 尾 → c的后继
+    - 插到片段尾点的近邻 c 之前：c的前驱 → 首 … 尾 → c
+
+    Returns:
+        执行的移动数
+    """
+    n = len(tour)
+    all_gain, all_lo, all_hi, all_moves = [], [], [], []
+    for length in (1, 2, 3):
+        if n - length < 2:
+            break
+        i = np.arange(1, n - length + 1)  # 起点（下标0）固定，不移动
+        head, tail = tour[i], tour[i + length - 1]
+        prev = tour[i - 1]
+        at_end = i + length == n
+        nxt = tour[np.minimum(i + length, n - 1)]
+        removal = _dist(xy, prev, head) + np.where(
+            at_end, 0.0, _dist(xy, tail, nxt) - _dist(xy, prev, nxt)
+        )
+
+        for after in (True, False):
+            c = knn[head] if after else knn[tail]
+            pc = pos[c]
+            # 插入位置为边 (q, q+1)
+            q = pc if after else pc - 1
+            last = q == n - 1
+            u = tour[np.maximum(q, 0)]
+            v = tour[np.minimum(q + 1, n - 1)]
+            insertion = np.where(
+                last,
+                _dist(xy, u, head[:, np.newaxis]),
+                _dist(xy, u, head[:, np.newaxis]) + _dist(xy, tail[:, np.newaxis], v) - _dist(xy, u, v)
+            )
+            gain = removal[:, np.newaxis] - insertion
+            ii = np.broadcast_to(i[:, np.newaxis], q.shape)
+            invalid = (q < 0) | ((q >= ii - 1) & (q < ii + length))
+            gain[invalid] = -np.inf
+
+            all_gain.append(gain.ravel())
+            all_lo.append(np.minimum(ii - 1, q).ravel())
+            all_hi.append(np.maximum(ii + length, q + 1).ravel())
+            all_moves.append(np.column_stack((ii.ravel(), np.full(ii.size, length), q.ravel())))
+
+    if not all_gain:
+        return 0
+    lo, hi = np.concatenate(all_lo), np.concatenate(all_hi)
+    moves_info = np.concatenate(all_moves)
+    moves = _pick_disjoint(np.concatenate(all_gain), lo, hi)
+    for m in moves:
+        start, length, q = (int(x) for x in moves_info[m])
+        l, h = int(lo[m]), min(int(hi[m]), n - 1)
+        segment = tour[start:start + length].copy()
+        # 在 [l, h] 区间内重排：移除片段后插到原位置q的点之后
+        window = tour[l:h + 1]
+        rest = window[~np.isin(window, segment)]
+        k = int(np.flatnonzero(rest == tour[q])[0]) + 1
+        tour[l:h + 1] = np.concatenate((rest[:k], segment, rest[k:]))
+        pos[tour[l:h + 1]] = np.arange(l, h + 1)
+    return len(moves)
+
+
+def solve_tsp_large(points, time_budget: float = 1.0, k: int = 8) -> List[int]:
+    """
+    大规模TSP近似求解（从下标0出发的单程路径，不构建 n×n 距离矩阵）
+
+    网格k近邻 + 最近邻构造初始解，再交替执行邻域2-opt和Or-opt直到没有改进或用完时间预算；
+    每轮对所有候选移动向量化计算收益，并一次执行一批互不重叠的移动
+
+    Args:
+        points: 坐标（[(lng, lat), ...] 或景点字典列表）
+        time_budget: 局部搜索时间预算（秒）
+        k: 每个点考虑的近邻数量
+
+    Returns:
+        访问顺序（下标列表）
+    """
+    xy = project_xy(points)
+    n = len(xy)
+    if n < 4:
+        return list(range(n))
+
+    deadline = time.monotonic() + time_budget
+    knn = grid_knn(xy, k)
+    tour = np.asarray(nearest_neighbor_order(points, knn=knn), dtype=np.int64)
+    pos = np.empty(n, dtype=np.int64)
+    pos[tour] = np.arange(n)
+
+    while time.monotonic() < deadline:
+        if _two_opt_pass(xy, tour, pos, knn):
+            continue
+        if not _or_opt_pass(xy, tour, pos, knn):
+            break
+    return tour.tolist()